@@ -0,0 +1,214 @@
+"""
+Check registry for FHIR API tests
+Scenario tests are registered as named units with declared dependencies, so single checks
+can be selected with -k and independent checks can run in parallel
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Tuple
+from test_utils import TestResults, Colors, phase_timer
+from fixtures import FixtureManager, SharedFixtures, shared_fixture_session
+from tracing import tracer
+from config import INTERACTIVE
+
+
+# (scenario, check name, seconds, passed) for every check run in this process
+check_timings: List[Tuple[str, str, float, bool]] = []
+
+# The check being run in this context (None outside checks), for attributing requests to checks
+current_check: contextvars.ContextVar = contextvars.ContextVar('current_check', default=None)
+
+
+class Check:
+    """A named test unit of a scenario and the checks it depends on"""
+    def __init__(self, scenario: str, name: str, func: Callable, depends: List[str],
+                 section: Optional[str], shared: bool):
+        self.scenario = scenario
+        self.name = name
+        self.func = func
+        self.depends = depends
+        self.section = section
+        self.shared = shared
+
+    def matches(self, pattern: str) -> bool:
+        """Case-insensitive substring match against 'scenario name'"""
+        return pattern.lower() in f"{self.scenario} {self.name}".lower()
+
+
+class CheckContext(dict):
+    """
+    State handed from check to check during one scenario run
+    (e.g. ctx['patient_id'] set by 'Create patient' and used by 'Read patient by ID')
+    """
+    def __init__(self, shared: Optional[SharedFixtures], created_resources: list):
+        super().__init__()
+        self.shared = shared
+        self.created_resources = created_resources
+
+
+class CheckResults(TestResults):
+    """Results of a single check, forwarded to the scenario results"""
+    def __init__(self, parent: TestResults):
+        super().__init__()
+        self.parent = parent
+
+    def add_pass(self, test_name: str):
+        self.passed += 1
+        self.parent.add_pass(test_name)
+
+    def add_fail(self, test_name: str, reason: str):
+        self.failed += 1
+        self.parent.add_fail(test_name, reason)
+
+    def add_skip(self, test_name: str, reason: str):
+        self.skipped += 1
+        self.parent.add_skip(test_name, reason)
+
+
+class Scenario:
+    """
+    Ordered collection of checks for one scenario
+
+    Usage:
+        PATIENT = Scenario('patient', 'Patient Registration Tests')
+
+        @PATIENT.check("Create patient", section="Patient CRUD Operations")
+        def create_patient(ctx, results):
+            ...
+
+        @PATIENT.check("Read patient by ID", depends=["Create patient"])
+        def read_patient(ctx, results):
+            ...
+    """
+    def __init__(self, key: str, title: str):
+        self.key = key
+        self.title = title
+        self.checks: List[Check] = []
+        self._by_name: Dict[str, Check] = {}
+
+    def check(self, name: str, depends: List[str] = (), section: Optional[str] = None,
+              shared: bool = False):
+        """
+        Register a check. Dependencies must be registered first.
+
+        Args:
+            section: Heading printed before the check when running sequentially
+            shared: True if the check uses the shared Organization/Practitioner/Patient fixtures
+        """
+        def decorator(func):
+            if name in self._by_name:
+                raise ValueError(f"Duplicate check name in {self.key}: {name}")
+            for dep in depends:
+                if dep not in self._by_name:
+                    raise ValueError(f"Check '{name}' depends on unknown check '{dep}'")
+            if section is None and self.checks:
+                check_section = self.checks[-1].section
+            else:
+                check_section = section
+            check = Check(self.key, name, func, list(depends), check_section, shared)
+            self.checks.append(check)
+            self._by_name[name] = check
+            return func
+        return decorator
+
+    def select(self, patterns: Optional[List[str]] = None) -> List[Check]:
+        """Return checks matching any pattern plus everything they depend on, in registration order"""
+        if not patterns:
+            return list(self.checks)
+
+        wanted = set()
+
+        def add(check: Check):
+            if check.name in wanted:
+                return
+            wanted.add(check.name)
+            for dep in check.depends:
+                add(self._by_name[dep])
+
+        for check in self.checks:
+            if any(check.matches(pattern) for pattern in patterns):
+                add(check)
+        return [check for check in self.checks if check.name in wanted]
+
+    def run(self, shared: Optional[SharedFixtures] = None, patterns: Optional[List[str]] = None,
+            workers: int = 1) -> TestResults:
+        """
+        Run the selected checks and return their results.
+        Shared fixtures are created here when a selected check needs them and none were passed.
+        """
+        results = TestResults()
+        checks = self.select(patterns)
+        needs_shared = any(check.shared for check in checks)
+
+        print(f"\n{Colors.BOLD}=== {self.title} ==={Colors.RESET}\n")
+
+        session = shared_fixture_session(results, shared) if needs_shared else nullcontext(shared)
+        with tracer.span(self.title, **{'test.scenario': self.key}), \
+                session as shared, FixtureManager(self.key, results) as fixtures:
+            ctx = CheckContext(shared, fixtures.created)
+            if workers > 1 and not INTERACTIVE:
+                run_parallel(checks, ctx, results, workers)
+            else:
+                run_sequential(checks, ctx, results)
+        return results
+
+
+def run_check(check: Check, ctx: CheckContext, results: TestResults, outcomes: Dict[str, bool]) -> bool:
+    """Run one check; returns False if it failed, raised or was skipped for a failed dependency"""
+    failed_deps = [dep for dep in check.depends if not outcomes.get(dep, True)]
+    if failed_deps:
+        results.add_skip(check.name, f"Depends on failed check: {', '.join(failed_deps)}")
+        return False
+
+    check_results = CheckResults(results)
+    start = time.perf_counter()
+    token = current_check.set(check)
+    try:
+        with phase_timer.scope(f"{check.scenario}/{check.name}"), \
+                tracer.span(check.name, **{'test.scenario': check.scenario}) as span:
+            check.func(ctx, check_results)
+            if span:
+                span.error = check_results.failed > 0
+    except Exception as e:
+        check_results.add_fail(check.name, f"Exception: {e}")
+    finally:
+        current_check.reset(token)
+    check_timings.append((check.scenario, check.name, time.perf_counter() - start, check_results.failed == 0))
+    return check_results.failed == 0
+
+
+def run_sequential(checks: List[Check], ctx: CheckContext, results: TestResults):
+    """Run checks one after another in registration order, printing section headings"""
+    outcomes: Dict[str, bool] = {}
+    section = None
+    for check in checks:
+        if check.section and check.section != section:
+            section = check.section
+            print(f"\n{Colors.BOLD}{section}{Colors.RESET}")
+        outcomes[check.name] = run_check(check, ctx, results, outcomes)
+
+
+def run_parallel(checks: List[Check], ctx: CheckContext, results: TestResults, workers: int):
+    """Run checks on a thread pool, starting each one as soon as its dependencies have finished"""
+    outcomes: Dict[str, bool] = {}
+    selected = {check.name for check in checks}
+    pending = list(checks)
+    running = {}
+
+    def ready(check: Check) -> bool:
+        return all(dep in outcomes or dep not in selected for dep in check.depends)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for check in [c for c in pending if ready(c)]:
+                pending.remove(check)
+                # Copy the context so the worker sees the scenario's fixture manager
+                context = contextvars.copy_context()
+                future = executor.submit(context.run, run_check, check, ctx, results, dict(outcomes))
+                running[future] = check
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                check = running.pop(future)
+                outcomes[check.name] = future.result()
@@ -0,0 +1,195 @@
+"""
+Single-flight coalescing of concurrent identical GETs (--coalesce / COALESCE_REQUESTS)
+While a GET is in flight, identical GETs (same endpoint, parameters and headers) from other
+threads or asyncio tasks do not go to the server: they wait for the one request and share its
+response. Each waiter decodes the shared body into its own objects on first json(), so a caller
+editing a resource in place does not change it for the others (decoding is several times faster
+than deep-copying the parsed JSON). Nothing is cached after the request completes - this only
+flattens stampedes such as many workers expanding the same ValueSet at start-up.
+Writes bump a generation per resource type, and a GET only joins a flight started at the current
+generation, so a read sent after a PUT/POST never receives a response read before it.
+
+Usage:
+    with Coalescer().installed() as coalescer:
+        ...threads calling make_request...
+        await fetch('GET', '/ValueSet/$expand', params={...})    # from asyncio code
+    coalescer.print_summary()
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+import test_utils
+from test_utils import (
+    Colors, FHIRResponse, endpoint_label, make_request, set_request_coalescer,
+    add_request_listener, remove_request_listener
+)
+from redundancy import WRITE_METHODS
+
+Key = Tuple
+
+
+def shared_response(source: FHIRResponse, latency_ms: float) -> FHIRResponse:
+    """A waiter's view of another caller's response: same status, headers and body bytes, its own parsed JSON"""
+    return FHIRResponse(source.response, 0, 0, latency_ms)
+
+
+class Flight:
+    """One request in progress and the callers waiting for it"""
+    def __init__(self, generation: Tuple[int, int]):
+        self.generation = generation
+        self.done = threading.Event()
+        self.response: Optional[FHIRResponse] = None
+        self.error: Optional[BaseException] = None
+
+
+def request_key(method: str, endpoint: str, params: Optional[Dict], headers: Optional[Dict],
+                elements, summary) -> Key:
+    """Everything that can change the response of a GET"""
+    return (method, endpoint.lstrip('/'),
+            tuple(sorted((name, str(value)) for name, value in (params or {}).items())),
+            tuple(sorted((name.lower(), str(value)) for name, value in (headers or {}).items())),
+            tuple(elements or ()), summary)
+
+
+class Coalescer:
+    """Single-flight gate in front of make_request GETs, with per-endpoint coalescing counts"""
+    def __init__(self):
+        self.flights: Dict[Key, Flight] = {}
+        # endpoint label -> {'sent': requests that went to the server, 'coalesced': callers that shared one}
+        self.endpoints: Dict[str, Dict[str, int]] = {}
+        self._async_flights: Dict[Tuple[int, Key], Tuple[asyncio.Future, Tuple[int, int]]] = {}
+        # Writes bump the generation of their resource type (and '' for batches), as in RedundancyDetector
+        self._generation: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def installed(self):
+        """Coalesce every make_request GET of the block (in any thread)"""
+        previous = set_request_coalescer(self)
+        add_request_listener(self.record)
+        try:
+            yield self
+        finally:
+            remove_request_listener(self.record)
+            set_request_coalescer(previous)
+
+    def record(self, method: str, endpoint: str, response: FHIRResponse):
+        """Request listener: a completed write makes the flights already sent for its type stale"""
+        path = endpoint.split('?')[0].strip('/')
+        if method not in WRITE_METHODS or '$' in path:
+            return
+        resource_type = path.split('/')[0]
+        with self._lock:
+            self._generation[resource_type] = self._generation.get(resource_type, 0) + 1
+
+    def _generation_of(self, endpoint: str) -> Tuple[int, int]:
+        resource_type = endpoint.split('?')[0].strip('/').split('/')[0]
+        return self._generation.get(resource_type, 0), self._generation.get('', 0)
+
+    def _count(self, label: str, outcome: str):
+        with self._lock:
+            stats = self.endpoints.setdefault(label, {'sent': 0, 'coalesced': 0})
+            stats[outcome] += 1
+
+    def call(self, method: str, endpoint: str, params: Optional[Dict], headers: Optional[Dict], elements,
+             summary: Optional[str], send: Callable[[], FHIRResponse]) -> FHIRResponse:
+        """send() unless the same request is already in flight, in which case wait for its response"""
+        key = request_key(method, endpoint, params, headers, elements, summary)
+        label = endpoint_label(method, endpoint, params)
+        with self._lock:
+            generation = self._generation_of(endpoint)
+            flight = self.flights.get(key)
+            # A flight sent before a write to its type may hold the pre-write version
+            leader = flight is None or flight.generation != generation
+            if leader:
+                flight = self.flights[key] = Flight(generation)
+        if not leader:
+            start = time.perf_counter()
+            flight.done.wait()
+            self._count(label, 'coalesced')
+            if flight.error is not None:
+                raise flight.error
+            return shared_response(flight.response, (time.perf_counter() - start) * 1000)
+
+        self._count(label, 'sent')
+        try:
+            flight.response = send()
+            return flight.response
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # A newer flight may have replaced this one after a write
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+
+    async def call_async(self, method: str, endpoint: str, params: Optional[Dict], headers: Optional[Dict], elements,
+                         summary: Optional[str], send: Callable[[], FHIRResponse]) -> FHIRResponse:
+        """call() for asyncio tasks: waiters await the leader's future instead of blocking a thread"""
+        key = request_key(method, endpoint, params, headers, elements, summary)
+        label = endpoint_label(method, endpoint, params)
+        loop_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            generation = self._generation_of(endpoint)
+        future, started = self._async_flights.get(loop_key, (None, None))
+        if future is not None and started == generation:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.shield(future)
+            finally:
+                self._count(label, 'coalesced')
+            return shared_response(response, (time.perf_counter() - start) * 1000)
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_flights[loop_key] = (future, generation)
+        try:
+            # Counted as sent by call() in the worker thread
+            response = await asyncio.to_thread(send)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved so a flight without waiters does not log "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            if self._async_flights.get(loop_key, (None,))[0] is future:
+                del self._async_flights[loop_key]
+
+    @property
+    def ratio(self) -> float:
+        """Share of GET callers answered by another caller's request"""
+        with self._lock:
+            coalesced = sum(stats['coalesced'] for stats in self.endpoints.values())
+            total = coalesced + sum(stats['sent'] for stats in self.endpoints.values())
+        return coalesced / total if total else 0.0
+
+    def print_summary(self):
+        print(f"\n{Colors.BOLD}Request Coalescing{Colors.RESET}")
+        print(f"{'='*60}")
+        shared = [(label, stats) for label, stats in self.endpoints.items() if stats['coalesced']]
+        calls = sum(stats['sent'] + stats['coalesced'] for stats in self.endpoints.values())
+        if not shared:
+            print(f"No concurrent identical GETs among {calls} call(s)")
+            return
+        print(f"  {'Endpoint':<48} {'Calls':>6} {'Sent':>6} {'Ratio':>6}")
+        for label, stats in sorted(shared, key=lambda item: item[1]['coalesced'], reverse=True):
+            total = stats['sent'] + stats['coalesced']
+            print(f"  {label[:48]:<48} {total:>6} {stats['sent']:>6} {stats['coalesced'] / total:>6.1%}")
+        print(f"{Colors.GREEN}{self.ratio:.1%} of {calls} GET call(s) shared another call's response{Colors.RESET}")
+
+
+async def fetch(method: str, endpoint: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+                elements=None, summary: Optional[str] = None) -> FHIRResponse:
+    """make_request for asyncio code: runs in a worker thread, coalesced across tasks when a Coalescer is installed"""
+    def send():
+        return make_request(method, endpoint, headers=headers, params=params, elements=elements, summary=summary)
+
+    coalescer = test_utils.request_coalescer
+    if coalescer is None or method != 'GET':
+        return await asyncio.to_thread(send)
+    return await coalescer.call_async(method, endpoint, params, headers, elements, summary, send)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Local ConceptMap index with batched $translate fallback
+ConceptMaps are downloaded once and indexed by (source system, code), so whole columns of codes
+are translated in-process. Only codes of systems no loaded map covers go to the server's
+$translate, batched into one batch Bundle per TRANSLATE_BATCH_SIZE codes.
+
+Usage:
+    python concept_maps.py --map https://terminology.dhp.uz/fhir/core/ConceptMap/iso-3166-alpha3-to-alpha2-cs \\
+        --system urn:iso:std:iso:3166 --column country legacy.csv mapped.csv
+"""
+import argparse
+import csv
+import json
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+from test_utils import Colors, make_request, search_all
+
+# $translate calls per batch Bundle when falling back to the server
+TRANSLATE_BATCH_SIZE = 100
+
+# R4 equivalence codes mapped to R5 relationship codes, so both map versions index the same way
+EQUIVALENCE_TO_RELATIONSHIP = {
+    'relatedto': 'related-to', 'equivalent': 'equivalent', 'equal': 'equivalent',
+    'wider': 'source-is-narrower-than-target', 'subsumes': 'source-is-narrower-than-target',
+    'narrower': 'source-is-broader-than-target', 'specializes': 'source-is-broader-than-target',
+    'inexact': 'related-to', 'unmatched': 'not-related-to', 'disjoint': 'not-related-to',
+}
+
+
+class Translation(NamedTuple):
+    """One target of a source code"""
+    system: Optional[str]
+    code: Optional[str]
+    display: Optional[str]
+    relationship: Optional[str]
+    map_url: Optional[str]
+
+
+class ConceptMapIndex:
+    """
+    In-memory index of ConceptMaps
+
+    Usage:
+        index = ConceptMapIndex()
+        index.load(url='https://terminology.dhp.uz/fhir/core/ConceptMap/iso-3166-alpha3-to-alpha2-cs')
+        index.translate('urn:iso:std:iso:3166', 'UZB')
+        index.translate_column('urn:iso:std:iso:3166', codes)
+    """
+    def __init__(self):
+        self.maps: Dict[str, Dict] = {}
+        # (source system, code) -> translations from every loaded map
+        self.index: Dict[Tuple[str, str], List[Translation]] = {}
+        # source system -> [(map url, target system, unmapped)] of the groups covering it
+        self.groups: Dict[str, List[Tuple[str, Optional[str], Optional[Dict]]]] = {}
+        # Server $translate answers, so a repeated code is only sent once
+        self._remote: Dict[Tuple, List[Translation]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, **params) -> int:
+        """Download the ConceptMaps matching a search (e.g. url=..., source-scope-uri=...); returns how many"""
+        loaded = 0
+        for concept_map in search_all('ConceptMap', dict(params, _count='50')):
+            self.add(concept_map)
+            loaded += 1
+        return loaded
+
+    def add(self, concept_map: Dict):
+        """Index a ConceptMap resource (R5 relationship or R4 equivalence)"""
+        url = concept_map.get('url') or f"ConceptMap/{concept_map.get('id')}"
+        self.maps[url] = concept_map
+        for group in concept_map.get('group', []):
+            source = group.get('source')
+            target_system = group.get('target')
+            self.groups.setdefault(source, []).append((url, target_system, group.get('unmapped')))
+            for element in group.get('element', []):
+                key = (source, element.get('code'))
+                targets = self.index.setdefault(key, [])
+                if element.get('noMap'):
+                    targets.append(Translation(None, None, None, 'not-related-to', url))
+                for target in element.get('target', []):
+                    relationship = target.get('relationship') or \
+                        EQUIVALENCE_TO_RELATIONSHIP.get(target.get('equivalence'), target.get('equivalence'))
+                    targets.append(Translation(target_system, target.get('code'), target.get('display'),
+                                               relationship, url))
+
+    def covers(self, system: str, target_system: Optional[str] = None, map_url: Optional[str] = None) -> bool:
+        """True if a loaded map has a group for this source (and target) system"""
+        return any((target_system is None or target == target_system) and (map_url is None or url == map_url)
+                   for url, target, _ in self.groups.get(system, []))
+
+    def lookup(self, system: str, code: str, target_system: Optional[str] = None,
+               map_url: Optional[str] = None) -> List[Translation]:
+        """Local translations of a code, applying the group's unmapped rule when the code has no element"""
+        found = [t for t in self.index.get((system, code), [])
+                 if (target_system is None or t.system == target_system or t.system is None)
+                 and (map_url is None or t.map_url == map_url)]
+        if found:
+            return found
+        for url, target, unmapped in self.groups.get(system, []):
+            if not unmapped or (target_system and target != target_system) or (map_url and url != map_url):
+                continue
+            mode = unmapped.get('mode')
+            if mode == 'use-source-code':
+                found.append(Translation(target, code, None, unmapped.get('relationship', 'equivalent'), url))
+            elif mode == 'fixed':
+                found.append(Translation(target, unmapped.get('code'), unmapped.get('display'),
+                                         unmapped.get('relationship', 'related-to'), url))
+            elif mode == 'other-map' and unmapped.get('otherMap') in self.maps and unmapped['otherMap'] != url:
+                found.extend(self.lookup(system, code, target_system, unmapped['otherMap']))
+        return found
+
+    def translate(self, system: str, code: str, target_system: Optional[str] = None,
+                  map_url: Optional[str] = None) -> List[Translation]:
+        """Translate one code locally, or with the server's $translate if no loaded map covers the system"""
+        return self.translate_column(system, [code], target_system, map_url)[0]
+
+    def translate_column(self, system: str, codes: Iterable[str], target_system: Optional[str] = None,
+                         map_url: Optional[str] = None) -> List[List[Translation]]:
+        """Translate a column of codes; each distinct code is looked up once"""
+        codes = list(codes)
+        distinct = list(dict.fromkeys(codes))
+        if self.covers(system, target_system, map_url):
+            answers = {code: self.lookup(system, code, target_system, map_url) for code in distinct}
+        else:
+            answers = self._translate_remote(system, distinct, target_system, map_url)
+        return [answers[code] for code in codes]
+
+    def _translate_remote(self, system: str, codes: List[str], target_system: Optional[str],
+                          map_url: Optional[str]) -> Dict[str, List[Translation]]:
+        answers = {}
+        missing = []
+        with self._lock:
+            for code in codes:
+                key = (system, code, target_system, map_url)
+                if key in self._remote:
+                    answers[code] = self._remote[key]
+                else:
+                    missing.append(code)
+        for i in range(0, len(missing), TRANSLATE_BATCH_SIZE):
+            chunk = missing[i:i + TRANSLATE_BATCH_SIZE]
+            for code, translations in zip(chunk, translate_batch(system, chunk, target_system, map_url)):
+                answers[code] = translations
+                with self._lock:
+                    self._remote[(system, code, target_system, map_url)] = translations
+        return answers
+
+    def dump(self, path: str):
+        """Save the loaded ConceptMaps as NDJSON, so a later run can index them without downloading"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for concept_map in self.maps.values():
+                f.write(json.dumps(concept_map, ensure_ascii=False) + '\n')
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ConceptMapIndex':
+        index = cls()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    index.add(json.loads(line))
+        return index
+
+
+def translate_params(system: str, code: str, target_system: Optional[str], map_url: Optional[str]) -> Dict[str, str]:
+    params = {'system': system, 'code': code}
+    if target_system:
+        params['target'] = target_system
+    if map_url:
+        params['url'] = map_url
+    return params
+
+
+def parse_translate(parameters: Dict) -> List[Translation]:
+    """Matches of a $translate Parameters response"""
+    translations = []
+    for parameter in parameters.get('parameter', []):
+        if parameter.get('name') != 'match':
+            continue
+        parts = {part.get('name'): part for part in parameter.get('part', [])}
+        coding = parts.get('concept', {}).get('valueCoding', {})
+        relationship = parts.get('relationship', {}).get('valueCode')
+        if relationship is None and 'equivalence' in parts:
+            equivalence = parts['equivalence'].get('valueCode')
+            relationship = EQUIVALENCE_TO_RELATIONSHIP.get(equivalence, equivalence)
+        source = parts.get('originMap', parts.get('source', {}))
+        translations.append(Translation(coding.get('system'), coding.get('code'), coding.get('display'),
+                                        relationship, source.get('valueCanonical') or source.get('valueUri')))
+    return translations
+
+
+def translate_batch(system: str, codes: List[str], target_system: Optional[str] = None,
+                    map_url: Optional[str] = None) -> List[List[Translation]]:
+    """$translate several codes with one batch Bundle; falls back to one GET per code if batches are refused"""
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [
+            {"request": {"method": "GET", "url": "ConceptMap/$translate?" +
+                         urlencode(translate_params(system, code, target_system, map_url))}}
+            for code in codes
+        ]
+    }
+    response = make_request('POST', '/', data=bundle)
+    entries = response.json().get('entry', []) if response.status_code == 200 else []
+    if len(entries) == len(codes) and all('resource' in entry for entry in entries):
+        return [parse_translate(entry['resource']) for entry in entries]
+
+    results = []
+    for code in codes:
+        response = make_request('GET', '/ConceptMap/$translate',
+                                params=translate_params(system, code, target_system, map_url))
+        results.append(parse_translate(response.json()) if response.status_code == 200 else [])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Translate a CSV column of codes with ConceptMaps')
+    parser.add_argument('input', help='CSV file with a header row')
+    parser.add_argument('output', help='CSV file to write, with target_code, target_display and relationship added')
+    parser.add_argument('--column', required=True, help='Column holding the source codes')
+    parser.add_argument('--system', required=True, help='Source code system')
+    parser.add_argument('--target', help='Target code system')
+    parser.add_argument('--map', dest='map_url', help='ConceptMap canonical url to load and use')
+    parser.add_argument('--maps-file', help='NDJSON of ConceptMaps to load instead of downloading (written by --save)')
+    parser.add_argument('--save', help='Write the downloaded ConceptMaps to this NDJSON file')
+    args = parser.parse_args()
+
+    if args.maps_file:
+        index = ConceptMapIndex.from_file(args.maps_file)
+    else:
+        index = ConceptMapIndex()
+        loaded = index.load(url=args.map_url) if args.map_url else index.load(**{'source-scope-uri': args.system})
+        print(f"{Colors.CYAN}Loaded {loaded} ConceptMap(s){Colors.RESET}")
+    if args.save:
+        index.dump(args.save)
+    if not index.covers(args.system, args.target, args.map_url):
+        print(f"{Colors.YELLOW}No loaded map covers {args.system}; using the server's $translate{Colors.RESET}")
+
+    with open(args.input, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    translations = index.translate_column(args.system, [row[args.column] for row in rows], args.target, args.map_url)
+    mapped = 0
+    with open(args.output, 'w', newline='', encoding='utf-8') as f:
+        fields = list(rows[0].keys()) + ['target_code', 'target_display', 'relationship'] if rows else []
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row, found in zip(rows, translations):
+            best = next((t for t in found if t.code), None)
+            mapped += best is not None
+            writer.writerow(dict(row, target_code=best.code if best else '',
+                                 target_display=best.display or '' if best else '',
+                                 relationship=best.relationship if best else ''))
+    print(f"{Colors.GREEN}{mapped}/{len(rows)} codes mapped{Colors.RESET} → {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Adaptive concurrency controller for bulk clients (--adaptive-concurrency / ADAPTIVE_CONCURRENCY)
+One AdaptiveLimiter is shared by every worker thread: make_request waits for a slot before sending.
+The limit on requests in flight follows AIMD:
+- +1 after every window of CONCURRENCY_WINDOW responses whose p95 latency stays within
+  CONCURRENCY_LATENCY_TOLERANCE times the baseline (the lowest window p95 seen, drifting slowly)
+  and during which the limit was actually used
+- x0.9 after a window whose p95 rose beyond that (the server is queueing)
+- x0.5 on 429, 503 or a connection error/timeout, at most once per window, and no new requests at
+  all until a Retry-After has passed
+
+Usage:
+    limiter = AdaptiveLimiter()
+    with limiter.installed():
+        ...threads calling make_request...
+    limiter.print_summary()
+
+    python concurrency.py /Patient --param _count=10 --duration 60    # load test one endpoint
+"""
+import argparse
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, List, Optional, Tuple
+import test_utils
+from test_utils import Colors, FHIRResponse, make_request, set_request_limiter
+from config import (
+    CONCURRENCY_INITIAL, CONCURRENCY_MIN, CONCURRENCY_MAX, CONCURRENCY_WINDOW, CONCURRENCY_LATENCY_TOLERANCE
+)
+
+# Status codes meaning the server wants fewer requests
+OVERLOAD_STATUSES = {429, 503}
+
+# Longest Retry-After honoured (a misconfigured proxy must not stall a run for an hour)
+MAX_RETRY_AFTER = 60.0
+
+# Share of the gap between a window's p95 and the baseline the baseline moves up per window
+BASELINE_DRIFT = 0.05
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delay-seconds or HTTP-date), capped at MAX_RETRY_AFTER"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class AdaptiveLimiter:
+    """Limit on requests in flight, grown while latency is flat and cut on overload signals"""
+    def __init__(self, initial: int = CONCURRENCY_INITIAL, min_limit: int = CONCURRENCY_MIN,
+                 max_limit: int = CONCURRENCY_MAX, window: int = CONCURRENCY_WINDOW,
+                 tolerance: float = CONCURRENCY_LATENCY_TOLERANCE):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.window = window
+        self.tolerance = tolerance
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.baseline_ms: Optional[float] = None
+        self.paused_until = 0.0
+        self.counts: Dict[str, int] = {'requests': 0, 'throttled': 0, 'unavailable': 0, 'errors': 0,
+                                       'increases': 0, 'decreases': 0}
+        # (seconds since start, limit) whenever the limit changes
+        self.history: List[Tuple[float, int]] = []
+        self._samples: List[float] = []
+        self._peak = 0
+        self._since_backoff = window
+        self._start = time.monotonic()
+        self._cond = threading.Condition()
+        self.history.append((0.0, self.limit))
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self):
+        """Wait until a request may be sent"""
+        with self._cond:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < self.limit:
+                    break
+                self._cond.wait(pause if pause > 0 else None)
+            self.in_flight += 1
+            self._peak = max(self._peak, self.in_flight)
+
+    def release(self, response: Optional[FHIRResponse]):
+        """Free the slot and adjust the limit; response is None when the request failed without one"""
+        with self._cond:
+            self.in_flight -= 1
+            self.counts['requests'] += 1
+            self._since_backoff += 1
+            if response is None or response.status_code in OVERLOAD_STATUSES:
+                self._overloaded(response)
+            else:
+                self._samples.append(response.latency_ms)
+                if len(self._samples) >= self.window:
+                    self._end_window()
+            self._cond.notify_all()
+
+    def _overloaded(self, response: Optional[FHIRResponse]):
+        if response is None:
+            self.counts['errors'] += 1
+        else:
+            self.counts['throttled' if response.status_code == 429 else 'unavailable'] += 1
+            pause = retry_after_seconds(response.headers.get('Retry-After'))
+            if pause:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        # Requests already in flight when the server started refusing report the same overload
+        if self._since_backoff >= self.window:
+            self._since_backoff = 0
+            self._samples = []
+            self._set_limit(self._limit * 0.5)
+
+    def _end_window(self):
+        p95 = percentile(self._samples, 0.95)
+        saturated = self._peak >= self.limit
+        self._samples = []
+        self._peak = self.in_flight
+        if self.baseline_ms is None or p95 < self.baseline_ms:
+            self.baseline_ms = p95
+        else:
+            rising = p95 > self.baseline_ms * self.tolerance
+            # Follow lasting shifts (other clients, a bigger result set) instead of ratcheting down forever
+            self.baseline_ms += (p95 - self.baseline_ms) * BASELINE_DRIFT
+            if rising:
+                self._set_limit(self._limit * 0.9)
+                return
+        if saturated:
+            self._set_limit(self._limit + 1)
+
+    def _set_limit(self, value: float):
+        previous = self.limit
+        self._limit = min(max(value, float(self.min_limit)), float(self.max_limit))
+        if self.limit != previous:
+            self.counts['increases' if self.limit > previous else 'decreases'] += 1
+            self.history.append((time.monotonic() - self._start, self.limit))
+
+    @contextmanager
+    def installed(self):
+        """Route every make_request of the block (in any thread) through this limiter"""
+        previous = set_request_limiter(self)
+        try:
+            yield self
+        finally:
+            set_request_limiter(previous)
+
+    def render(self) -> List[str]:
+        """The current limit and requests in flight as OpenMetrics lines"""
+        with self._cond:
+            return [
+                '# TYPE fhir_client_concurrency_limit gauge',
+                '# HELP fhir_client_concurrency_limit Requests the adaptive controller currently allows in flight.',
+                f'fhir_client_concurrency_limit {self.limit}',
+                '# TYPE fhir_client_requests_in_flight gauge',
+                '# HELP fhir_client_requests_in_flight Requests currently sent and not yet answered.',
+                f'fhir_client_requests_in_flight {self.in_flight}',
+            ]
+
+    def print_summary(self):
+        print(f"\n{Colors.BOLD}Adaptive Concurrency{Colors.RESET}")
+        print(f"{'='*60}")
+        limits = [limit for _, limit in self.history]
+        print(f"Limit:     {self.limit} now, {min(limits)}-{max(limits)} during the run "
+              f"(bounds {self.min_limit}-{self.max_limit})")
+        baseline = f"{self.baseline_ms:.1f} ms" if self.baseline_ms is not None else '-'
+        print(f"Baseline:  p95 {baseline}")
+        print(f"Requests:  {self.counts['requests']} ({self.counts['throttled']} × 429, "
+              f"{self.counts['unavailable']} × 503, {self.counts['errors']} failed)")
+        print(f"Changes:   {self.counts['increases']} up, {self.counts['decreases']} down")
+        if len(self.history) > 1:
+            steps = ' → '.join(f"{limit}@{seconds:.0f}s" for seconds, limit in self.history[-12:])
+            print(f"Recent:    {steps}")
+
+
+def run_load(endpoint: str, params: Dict, duration: float, limiter: AdaptiveLimiter) -> Deque[float]:
+    """GET one endpoint from limiter.max_limit threads for duration seconds; returns the latencies"""
+    latencies: Deque[float] = deque()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            try:
+                response = make_request('GET', endpoint, params=params)
+            except Exception:
+                continue
+            if response.status_code < 400:
+                latencies.append(response.latency_ms)
+
+    started = time.monotonic()
+    with limiter.installed():
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True)
+                   for _ in range(limiter.max_limit)]
+        for thread in threads:
+            thread.start()
+        last = None
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+            if limiter.limit != last:
+                last = limiter.limit
+                print(f"  {time.monotonic() - started:6.1f}s  limit {last}")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test one endpoint under the adaptive concurrency controller')
+    parser.add_argument('endpoint', help='Endpoint to GET, e.g. /Patient or /metadata')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE', help='Search parameter (repeatable)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run (default: 30)')
+    parser.add_argument('--max', type=int, default=CONCURRENCY_MAX, help=f'Highest limit (default: {CONCURRENCY_MAX})')
+    args = parser.parse_args()
+
+    test_utils.VERBOSE = False
+    params = dict(param.split('=', 1) for param in args.param)
+    limiter = AdaptiveLimiter(max_limit=args.max)
+    latencies = run_load(args.endpoint, params, args.duration, limiter)
+    if latencies:
+        print(f"{Colors.GREEN}{len(latencies) / args.duration:.1f} req/s{Colors.RESET}, "
+              f"p50 {percentile(list(latencies), 0.5):.1f} ms, p95 {percentile(list(latencies), 0.95):.1f} ms")
+    limiter.print_summary()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,15 @@ BASE_URL = os.environ.get('FHIR_BASE_URL', 'https://playground.dhp.uz/fhir')
 # Test data cleanup - if True, delete test resources after running
 CLEANUP_AFTER_TESTS = os.environ.get('CLEANUP_AFTER_TESTS', 'false').lower() == 'true'
 
+# How test resources are deleted: 'batch' or 'transaction' Bundle, or 'concurrent' DELETE requests
+CLEANUP_MODE = os.environ.get('CLEANUP_MODE', 'batch').lower()
+
+# Number of parallel DELETE requests in concurrent cleanup mode
+CLEANUP_WORKERS = int(os.environ.get('CLEANUP_WORKERS', '8'))
+
+# Seconds to wait after creating search fixtures so the server can index them
+INDEXING_WAIT = int(os.environ.get('INDEXING_WAIT', '5'))
+
 # Verbose output
 VERBOSE = os.environ.get('VERBOSE', 'true').lower() == 'true'
 
@@ -20,3 +29,88 @@ REQUEST_TIMEOUT = int(os.environ.get('REQUEST_TIMEOUT', '30'))
 
 # Test identifiers to avoid conflicts
 TEST_IDENTIFIER_PREFIX = os.environ.get('TEST_IDENTIFIER_PREFIX', 'test-')
+
+# Bandwidth-saving mode - gzip large request bodies and report compression ratios
+BANDWIDTH_SAVING = os.environ.get('BANDWIDTH_SAVING', 'false').lower() == 'true'
+
+# Gzip request bodies at least this many bytes long (only in bandwidth-saving mode)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+# Monitor mode - port of the local OpenMetrics /metrics endpoint
+MONITOR_PORT = int(os.environ.get('MONITOR_PORT', '9464'))
+
+# Monitor mode - seconds of probe results kept for the rolling latency quantiles
+MONITOR_WINDOW = int(os.environ.get('MONITOR_WINDOW', '900'))
+
+# Monitor mode - PINFL looked up by the Patient probe (a search, so it may return no match)
+MONITOR_PATIENT_PINFL = os.environ.get('MONITOR_PATIENT_PINFL', '12345678901234')
+
+# SQLite file that every run_all_tests.py run appends its timings to (empty to disable)
+HISTORY_DB = os.environ.get('HISTORY_DB', 'run_history.db')
+
+# Number of previous runs against the same server used as the --compare baseline
+HISTORY_BASELINE_RUNS = int(os.environ.get('HISTORY_BASELINE_RUNS', '10'))
+
+# Directories with StructureDefinition, ValueSet and CodeSystem JSON files for offline profile
+# validation (comma-separated): the FHIR package cache entry sushi fills for the uz.dhp.core
+# dependency and sushi's own output for input/fsh. Relative paths are relative to this directory.
+PROFILE_SOURCES = os.environ.get(
+    'PROFILE_SOURCES', '~/.fhir/packages/uz.dhp.core#0.3.0/package,../fsh-generated/resources'
+)
+
+# Directory for compiled profile rule tables and definitions fetched from the server
+PROFILE_CACHE_DIR = os.environ.get('PROFILE_CACHE_DIR', '.profile-cache')
+
+# JSON file remembering which documentation examples passed, by content hash (empty to disable)
+DOC_EXAMPLES_CACHE = os.environ.get('DOC_EXAMPLES_CACHE', '.doc-examples-cache.json')
+
+# Also run documentation examples that create resources (POST to a resource type)
+DOC_EXAMPLES_WRITE = os.environ.get('DOC_EXAMPLES_WRITE', 'false').lower() == 'true'
+
+# SQLite file of the local terminology mirror (terminology_mirror.py)
+TERMINOLOGY_DB = os.environ.get('TERMINOLOGY_DB', 'terminology.db')
+
+# SQLite file of the local provider-directory replica (directory_replica.py)
+DIRECTORY_DB = os.environ.get('DIRECTORY_DB', 'directory.db')
+
+# Seconds a cached Organization tree (org_hierarchy.py) is used before it is fetched again
+ORG_TREE_MAX_AGE = int(os.environ.get('ORG_TREE_MAX_AGE', '3600'))
+
+# Report duplicate, refetching and batchable requests after each scenario (same as --detect-redundant)
+DETECT_REDUNDANT = os.environ.get('DETECT_REDUNDANT', 'false').lower() == 'true'
+
+# Bound requests in flight with the adaptive concurrency controller (same as --adaptive-concurrency)
+ADAPTIVE_CONCURRENCY = os.environ.get('ADAPTIVE_CONCURRENCY', 'false').lower() == 'true'
+
+# Adaptive concurrency - starting, lowest and highest number of requests in flight
+CONCURRENCY_INITIAL = int(os.environ.get('CONCURRENCY_INITIAL', '4'))
+CONCURRENCY_MIN = int(os.environ.get('CONCURRENCY_MIN', '1'))
+CONCURRENCY_MAX = int(os.environ.get('CONCURRENCY_MAX', '32'))
+
+# Adaptive concurrency - responses per latency window; the limit changes at most once per window
+CONCURRENCY_WINDOW = int(os.environ.get('CONCURRENCY_WINDOW', '20'))
+
+# Adaptive concurrency - back off when a window's p95 latency exceeds the baseline by this factor
+CONCURRENCY_LATENCY_TOLERANCE = float(os.environ.get('CONCURRENCY_LATENCY_TOLERANCE', '2.0'))
+
+# Hedge idempotent reads: resend a read still unanswered after HEDGE_DELAY, first response wins (same as --hedge)
+HEDGE_READS = os.environ.get('HEDGE_READS', 'false').lower() == 'true'
+
+# Hedging - delay before the duplicate: a percentile of the endpoint's recent latencies ('p95') or milliseconds
+HEDGE_DELAY = os.environ.get('HEDGE_DELAY', 'p95')
+
+# Hedging - most duplicates sent, as a share of all reads
+HEDGE_BUDGET = float(os.environ.get('HEDGE_BUDGET', '0.1'))
+
+# Fail reads of an endpoint fast while its circuit is open (same as --circuit-breaker)
+CIRCUIT_BREAKER = os.environ.get('CIRCUIT_BREAKER', 'false').lower() == 'true'
+
+# Circuit breaker - open when this share of an endpoint's last CIRCUIT_WINDOW reads failed (5xx, timeout, no connection)
+CIRCUIT_ERROR_RATE = float(os.environ.get('CIRCUIT_ERROR_RATE', '0.5'))
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', '10'))
+
+# Circuit breaker - seconds an open circuit fails reads before one trial read is let through
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', '30'))
+
+# Let concurrent identical GETs share one request and report the coalescing ratio (same as --coalesce)
+COALESCE_REQUESTS = os.environ.get('COALESCE_REQUESTS', 'false').lower() == 'true'
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Optimistic-locking contention benchmark for If-Match updates
+N writer threads update a small, optionally skewed set of Patients for a fixed time. Every update
+is read -> modify -> PUT with If-Match: W/"<versionId>"; a 412 (or 409) means another writer
+committed first, so the writer reads again and retries with jittered exponential backoff. Each
+writer count reports committed updates per second, the conflict rate (rejected PUTs / all PUTs)
+and the commit latency distribution (first read to successful PUT, retries included), which
+shows where throughput stops growing with N and where it collapses.
+
+The target Patients are created for the run (synthetic uz-core patients, TEST_IDENTIFIER_PREFIX
+names) and deleted afterwards; each update flips their `active` flag.
+
+Usage:
+    python contention.py --writers 1,2,4,8,16 --patients 1 --duration 20
+    python contention.py --writers 4,16,64 --patients 50 --skew 1.2     # Zipf-skewed targets
+"""
+import argparse
+import contextvars
+import random
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+import test_utils
+from test_utils import Colors, make_request, create_resource
+from fixtures import FixtureManager
+from synthetic_data import UzCoreGenerator
+from concurrency import percentile
+
+# Status codes of a PUT whose If-Match version is no longer current
+CONFLICT_STATUSES = {409, 412}
+
+# Throughput below this share of the best writer count is reported as a collapse
+COLLAPSE_THRESHOLD = 0.8
+
+
+def zipf_weights(n: int, skew: float) -> List[float]:
+    """Weight of the i-th target: 1 / (i + 1)^skew (skew 0 is uniform)"""
+    return [1 / (rank + 1) ** skew for rank in range(n)]
+
+
+def update_once(patient_id: str, max_retries: int, backoff_ms: float, rng: random.Random) -> Dict:
+    """
+    Read, modify and conditionally update one Patient until it commits, fails or runs out of
+    retries. Returns the outcome ('committed', 'gave up' or 'error'), PUTs sent, conflicts and
+    the latency from the first read.
+    """
+    start = time.perf_counter()
+    puts = conflicts = 0
+    outcome = 'gave up'
+    for attempt in range(max_retries + 1):
+        response = make_request('GET', f'/Patient/{patient_id}')
+        if response.status_code != 200:
+            outcome = 'error'
+            break
+        patient = response.json()
+        version = patient.get('meta', {}).get('versionId')
+        if not version:
+            # Without a version there is nothing to put in If-Match
+            outcome = 'error'
+            break
+        patient['active'] = not patient.get('active', True)
+        response = make_request('PUT', f'/Patient/{patient_id}', data=patient,
+                                headers={'If-Match': f'W/"{version}"'})
+        puts += 1
+        if response.status_code in (200, 201):
+            outcome = 'committed'
+            break
+        if response.status_code not in CONFLICT_STATUSES:
+            outcome = 'error'
+            break
+        conflicts += 1
+        # Full jitter: spread the retries of writers that lost the same race
+        time.sleep(rng.uniform(0, backoff_ms * 2 ** min(attempt, 6)) / 1000)
+    return {'outcome': outcome, 'puts': puts, 'conflicts': conflicts,
+            'latency_ms': (time.perf_counter() - start) * 1000}
+
+
+def run_level(patient_ids: List[str], weights: List[float], writers: int, duration: float,
+              max_retries: int, backoff_ms: float, seed: int) -> Dict:
+    """Run `writers` threads against the targets for `duration` seconds and total their updates"""
+    lock = threading.Lock()
+    totals = {'committed': 0, 'gave up': 0, 'error': 0, 'puts': 0, 'conflicts': 0}
+    latencies: List[float] = []
+    retries: Counter = Counter()
+    deadline = time.monotonic() + duration
+
+    def writer(index: int):
+        rng = random.Random(seed * 1000 + index)
+        while time.monotonic() < deadline:
+            patient_id = rng.choices(patient_ids, weights)[0]
+            try:
+                result = update_once(patient_id, max_retries, backoff_ms, rng)
+            except Exception:
+                result = {'outcome': 'error', 'puts': 0, 'conflicts': 0, 'latency_ms': 0.0}
+            with lock:
+                totals[result['outcome']] += 1
+                totals['puts'] += result['puts']
+                totals['conflicts'] += result['conflicts']
+                if result['outcome'] == 'committed':
+                    latencies.append(result['latency_ms'])
+                    retries[result['conflicts']] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(writer, i)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    return dict(totals, writers=writers, elapsed=elapsed, latencies=latencies, retries=retries,
+                throughput=totals['committed'] / elapsed if elapsed else 0.0,
+                conflict_rate=totals['conflicts'] / totals['puts'] if totals['puts'] else 0.0)
+
+
+def print_report(levels: List[Dict]):
+    print(f"\n{Colors.BOLD}If-Match Contention{Colors.RESET}")
+    print(f"{'='*60}")
+    print(f"  {'Writers':>7} {'Commits/s':>10} {'Conflicts':>10} {'Retries':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'Gave up':>8} {'Errors':>7}")
+    for level in levels:
+        latencies = level['latencies']
+        quantiles = [f"{percentile(latencies, q):>8.0f}" if latencies else f"{'-':>8}" for q in (0.5, 0.95, 0.99)]
+        retries_per_commit = level['conflicts'] / level['committed'] if level['committed'] else 0.0
+        print(f"  {level['writers']:>7} {level['throughput']:>10.1f} {level['conflict_rate']:>10.1%} "
+              f"{retries_per_commit:>8.2f} {' '.join(quantiles)} {level['gave up']:>8} {level['error']:>7}")
+
+    print("\n  Retries before commit (share of commits):")
+    for level in levels:
+        committed = sum(level['retries'].values())
+        buckets: Counter = Counter()
+        for retries, count in level['retries'].items():
+            buckets[min(retries, 5)] += count
+        if committed:
+            shares = '  '.join(f"{'5+' if k == 5 else k}: {buckets[k] / committed:>5.1%}" for k in range(6))
+            print(f"  {level['writers']:>7}  {shares}")
+
+    best = max(levels, key=lambda level: level['throughput'])
+    print(f"\nThroughput peaks at {Colors.GREEN}{best['writers']} writer(s){Colors.RESET} "
+          f"({best['throughput']:.1f} commits/s, {best['conflict_rate']:.1%} conflicts)")
+    collapsed = [level for level in levels
+                 if level['writers'] > best['writers'] and level['throughput'] < best['throughput'] * COLLAPSE_THRESHOLD]
+    if collapsed:
+        first = collapsed[0]
+        print(f"{Colors.YELLOW}Collapses at {first['writers']} writer(s): {first['throughput']:.1f} commits/s, "
+              f"{first['conflict_rate']:.1%} of PUTs rejected{Colors.RESET}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent If-Match updates of the same Patients')
+    parser.add_argument('--writers', default='1,2,4,8,16', help='Comma-separated writer counts (default: 1,2,4,8,16)')
+    parser.add_argument('--patients', type=int, default=1, help='Target Patients shared by all writers (default: 1)')
+    parser.add_argument('--skew', type=float, default=0.0,
+                        help='Zipf exponent for picking targets; 0 = uniform (default: 0)')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per writer count (default: 20)')
+    parser.add_argument('--max-retries', type=int, default=20, help='Retries after a 412 before giving up (default: 20)')
+    parser.add_argument('--backoff-ms', type=float, default=5,
+                        help='Base of the jittered exponential backoff between retries; 0 retries at once (default: 5)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    args = parser.parse_args()
+
+    test_utils.VERBOSE = False
+    writer_counts = [int(n) for n in args.writers.split(',')]
+    weights = zipf_weights(args.patients, args.skew)
+
+    # Registered by hand: the targets must outlive the creation step and go after the last level
+    fixtures = FixtureManager('Contention benchmark')
+    patient_ids: List[Optional[str]] = []
+    for patient in UzCoreGenerator(args.seed, duplicate_rate=0).patients(args.patients):
+        del patient['id']
+        created = create_resource('Patient', patient)
+        patient_ids.append(created['id'] if created else None)
+        if created:
+            fixtures.register('Patient', created['id'])
+    try:
+        if None in patient_ids:
+            print(f"{Colors.RED}Could not create the target Patients{Colors.RESET}")
+            return
+        print(f"{Colors.BOLD}{args.patients} Patient(s), skew {args.skew}, {args.duration:.0f}s per level{Colors.RESET}")
+        levels = []
+        for writers in writer_counts:
+            level = run_level(patient_ids, weights, writers, args.duration, args.max_retries, args.backoff_ms, args.seed)
+            print(f"  {writers:>3} writer(s): {level['throughput']:.1f} commits/s, {level['conflict_rate']:.1%} conflicts")
+            levels.append(level)
+        print_report(levels)
+    finally:
+        fixtures.teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Local provider-directory replica in SQLite (DIRECTORY_DB)
+Organization, Practitioner and PractitionerRole are copied once and then kept current from the
+_history change feed. Names are held in an FTS5 trigram index, so name, :contains and :exact
+searches (and type-ahead) answer from the index instead of scanning; identifiers, telecoms,
+codes and references are held in a token index. search() takes the same parameters as
+search_resources() and returns the same searchset Bundle.
+
+Usage:
+    python directory_replica.py sync                   # full on first use, incremental afterwards
+    python directory_replica.py sync --watch 30        # poll the change feed every 30 seconds
+    python directory_replica.py search Organization name:contains=fergana active=true
+    python directory_replica.py typeahead "toshk"
+"""
+import argparse
+import json
+import sqlite3
+import time
+import unicodedata
+import requests
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import test_utils
+from test_utils import Colors, search_all, changes_since, parse_instant
+from config import BASE_URL, DIRECTORY_DB
+
+RESOURCE_TYPES = ['Organization', 'Practitioner', 'PractitionerRole']
+
+# Resources per search or _history page while syncing
+SYNC_PAGE_SIZE = 100
+
+# Default page size of search(), as a server would apply without _count
+DEFAULT_COUNT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    resource_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    last_updated TEXT,
+    json TEXT NOT NULL,
+    PRIMARY KEY (resource_type, id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(
+    resource_type UNINDEXED, id UNINDEXED, param UNINDEXED, raw UNINDEXED, text, tokenize='trigram'
+);
+CREATE TABLE IF NOT EXISTS tokens (
+    resource_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    param TEXT NOT NULL,
+    system TEXT,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    resource_type TEXT PRIMARY KEY,
+    checkpoint TEXT NOT NULL,
+    synced_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tokens_value ON tokens(resource_type, param, value, system);
+CREATE INDEX IF NOT EXISTS idx_tokens_resource ON tokens(resource_type, id);
+"""
+
+# Search parameters answered from the name index; the rest come from the token index
+STRING_PARAMS = {
+    'Organization': {'name', 'address-city'},
+    'Practitioner': {'name', 'family', 'given', 'address-city'},
+    'PractitionerRole': set(),
+}
+TOKEN_PARAMS = {
+    'Organization': {'_id', 'identifier', 'type', 'active', 'partof', 'phone', 'email', 'telecom'},
+    'Practitioner': {'_id', 'identifier', 'active', 'gender', 'phone', 'email', 'telecom'},
+    'PractitionerRole': {'_id', 'identifier', 'active', 'practitioner', 'organization', 'role', 'specialty',
+                         'phone', 'email', 'telecom'},
+}
+REFERENCE_TARGETS = {'partof': 'Organization', 'organization': 'Organization', 'practitioner': 'Practitioner'}
+INCLUDES = {'PractitionerRole:practitioner': 'practitioner', 'PractitionerRole:organization': 'organization',
+            'Organization:partof': 'partof'}
+
+# Uzbek Latin writes oʻ/gʻ with several look-alike apostrophes
+APOSTROPHES = str.maketrans({c: "'" for c in 'ʻʼ‘’`´'})
+
+
+def normalize(text: str) -> str:
+    """Case- and accent-insensitive form of a string, as FHIR string search compares"""
+    decomposed = unicodedata.normalize('NFKD', text.translate(APOSTROPHES))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def glob_escape(text: str) -> str:
+    return ''.join(f'[{c}]' if c in '*?[' else c for c in text)
+
+
+def normalize_phone(value: str) -> str:
+    return ''.join(c for c in value if c.isdigit() or c == '+')
+
+
+def human_names(resource: Dict) -> Iterator[Tuple[str, str]]:
+    """(param, string) pairs of a Practitioner's names"""
+    for name in resource.get('name', []):
+        given = name.get('given', [])
+        parts = name.get('prefix', []) + given + ([name['family']] if name.get('family') else [])
+        full = name.get('text') or ' '.join(parts)
+        if full:
+            yield 'name', full
+        if name.get('family'):
+            yield 'family', name['family']
+        for part in given:
+            yield 'given', part
+
+
+def index_entries(resource: Dict) -> Tuple[List[Tuple[str, str]], List[Tuple[str, Optional[str], str]]]:
+    """(name index rows, token index rows) of a resource"""
+    resource_type = resource['resourceType']
+    strings = []
+    tokens = [('_id', None, resource.get('id'))]
+    if resource_type == 'Organization':
+        strings += [('name', n) for n in [resource.get('name')] + resource.get('alias', []) if n]
+    elif resource_type == 'Practitioner':
+        strings += list(human_names(resource))
+        if resource.get('gender'):
+            tokens.append(('gender', None, resource['gender']))
+    for address in resource.get('address', []):
+        if address.get('city'):
+            strings.append(('address-city', address['city']))
+
+    for identifier in resource.get('identifier', []):
+        if identifier.get('value'):
+            tokens.append(('identifier', identifier.get('system'), identifier['value']))
+    for telecom in resource.get('telecom', []) + [t for c in resource.get('contact', []) for t in c.get('telecom', [])]:
+        value = telecom.get('value')
+        if not value:
+            continue
+        tokens.append(('telecom', telecom.get('system'), value))
+        if telecom.get('system') == 'phone':
+            tokens.append(('phone', None, normalize_phone(value)))
+        elif telecom.get('system') == 'email':
+            tokens.append(('email', None, value.lower()))
+    if 'active' in resource:
+        tokens.append(('active', None, 'true' if resource['active'] else 'false'))
+    for param, element in (('type', 'type'), ('role', 'code'), ('specialty', 'specialty')):
+        for concept in resource.get(element, []):
+            tokens += [(param, coding.get('system'), coding['code'])
+                       for coding in concept.get('coding', []) if coding.get('code')]
+    for param, element in (('partof', 'partOf'), ('organization', 'organization'), ('practitioner', 'practitioner')):
+        reference = resource.get(element, {}).get('reference')
+        if reference:
+            tokens.append((param, None, reference))
+    return strings, [t for t in tokens if t[2]]
+
+
+class DirectoryReplica:
+    """
+    Local copy of the provider directory
+
+    Usage:
+        replica = DirectoryReplica()
+        replica.sync()
+        bundle = replica.search('Organization', {'name:contains': 'Fergana', 'active': 'true'})
+        replica.typeahead('toshk')
+    """
+    def __init__(self, path: str = DIRECTORY_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Sync
+
+    def checkpoint(self, resource_type: str) -> Optional[str]:
+        row = self.conn.execute("SELECT checkpoint FROM sync_state WHERE resource_type = ?",
+                                (resource_type,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, full: bool = False) -> Dict[str, Tuple[int, int]]:
+        """Apply the changes since the last sync (everything on first use); returns {type: (stored, deleted)}"""
+        counts = {}
+        for resource_type in RESOURCE_TYPES:
+            since = None if full else self.checkpoint(resource_type)
+            stored = deleted = 0
+            latest, latest_instant = since, parse_instant(since)
+            started = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            if since is None:
+                everything = search_all(resource_type, {'_count': str(SYNC_PAGE_SIZE)}, required=True)
+                changes = ((r.get('id'), r) for r in everything)
+            else:
+                changes = changes_since(resource_type, since, SYNC_PAGE_SIZE)
+            # A page that fails mid-sync raises, so the transaction rolls back and the checkpoint stays put
+            with self.conn:
+                if since is None:
+                    for table in ('resources', 'names', 'tokens'):
+                        self.conn.execute(f"DELETE FROM {table} WHERE resource_type = ?", (resource_type,))
+                for resource_id, resource in changes:
+                    self._delete(resource_type, resource_id)
+                    if resource is None:
+                        deleted += 1
+                        continue
+                    self._store(resource)
+                    stored += 1
+                    # Compared as instants: the server may write offsets other than Z
+                    last_updated = resource.get('meta', {}).get('lastUpdated')
+                    instant = parse_instant(last_updated)
+                    if instant and (latest_instant is None or instant > latest_instant):
+                        latest, latest_instant = last_updated, instant
+                # Without meta.lastUpdated on the resources, the next sync asks for changes since this one started
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (resource_type, checkpoint, synced_at) "
+                    "VALUES (?, ?, datetime('now'))", (resource_type, latest or started))
+            counts[resource_type] = (stored, deleted)
+        return counts
+
+    def _delete(self, resource_type: str, resource_id: str):
+        for table in ('resources', 'names', 'tokens'):
+            self.conn.execute(f"DELETE FROM {table} WHERE resource_type = ? AND id = ?", (resource_type, resource_id))
+
+    def _store(self, resource: Dict):
+        resource_type = resource['resourceType']
+        resource_id = resource.get('id')
+        strings, tokens = index_entries(resource)
+        self.conn.execute("INSERT INTO resources (resource_type, id, last_updated, json) VALUES (?, ?, ?, ?)",
+                          (resource_type, resource_id, resource.get('meta', {}).get('lastUpdated'),
+                           json.dumps(resource, ensure_ascii=False)))
+        self.conn.executemany("INSERT INTO names (resource_type, id, param, raw, text) VALUES (?, ?, ?, ?, ?)",
+                              ((resource_type, resource_id, param, raw, normalize(raw)) for param, raw in strings))
+        self.conn.executemany("INSERT INTO tokens (resource_type, id, param, system, value) VALUES (?, ?, ?, ?, ?)",
+                              ((resource_type, resource_id, param, system, value) for param, system, value in tokens))
+
+    # Search
+
+    def _string_ids(self, resource_type: str, param: str, modifier: Optional[str], value: str) -> Set[str]:
+        text = normalize(value)
+        if modifier == 'exact':
+            sql, args = "raw = ?", [value]
+        elif modifier == 'contains':
+            sql, args = "text GLOB ?", [f'*{glob_escape(text)}*']
+        elif modifier is None:
+            # Starts with, at the start of the string or of any word in it
+            sql, args = "(text GLOB ? OR text GLOB ?)", [f'{glob_escape(text)}*', f'* {glob_escape(text)}*']
+        else:
+            raise ValueError(f"Unsupported modifier :{modifier} for {resource_type}.{param}")
+        rows = self.conn.execute(f"SELECT id FROM names WHERE resource_type = ? AND param = ? AND {sql}",
+                                 [resource_type, param] + args)
+        return {row[0] for row in rows}
+
+    def _token_ids(self, resource_type: str, param: str, value: str) -> Set[str]:
+        system = None
+        if param in REFERENCE_TARGETS:
+            value = value if '/' in value else f'{REFERENCE_TARGETS[param]}/{value}'
+        elif '|' in value:
+            system, value = value.split('|', 1)
+        if param == 'phone':
+            value = normalize_phone(value)
+        elif param == 'email':
+            value = value.lower()
+        sql = "SELECT id FROM tokens WHERE resource_type = ? AND param = ?"
+        args = [resource_type, param]
+        if value:
+            sql += " AND value = ?"
+            args.append(value)
+        # 'system|value' matches that system, '|value' only values without one
+        if system == '':
+            sql += " AND system IS NULL"
+        elif system is not None:
+            sql += " AND system = ?"
+            args.append(system)
+        return {row[0] for row in self.conn.execute(sql, args)}
+
+    def search(self, resource_type: str, params: Dict) -> Optional[Dict]:
+        """Same parameters and searchset Bundle as search_resources(); ValueError for parameters not indexed"""
+        if resource_type not in RESOURCE_TYPES:
+            raise ValueError(f"{resource_type} is not replicated")
+        count = int(params.get('_count', DEFAULT_COUNT))
+        include = params.get('_include')
+        matched: Optional[Set[str]] = None
+        for key, values in params.items():
+            if key in ('_count', '_include', '_total'):
+                continue
+            param, _, modifier = key.partition(':')
+            ids = set()
+            # Comma-separated values are OR
+            for value in values.split(','):
+                if param in STRING_PARAMS[resource_type]:
+                    ids |= self._string_ids(resource_type, param, modifier or None, value)
+                elif param in TOKEN_PARAMS[resource_type] and not modifier:
+                    ids |= self._token_ids(resource_type, param, value)
+                else:
+                    raise ValueError(f"Unsupported search parameter {key} for {resource_type}")
+            # Different parameters are AND
+            matched = ids if matched is None else matched & ids
+            if not matched:
+                break
+
+        if matched is None:
+            rows = self.conn.execute("SELECT json FROM resources WHERE resource_type = ? ORDER BY id LIMIT ?",
+                                     (resource_type, count)).fetchall()
+            total = self.conn.execute("SELECT COUNT(*) FROM resources WHERE resource_type = ?",
+                                      (resource_type,)).fetchone()[0]
+        else:
+            page = sorted(matched)[:count]
+            rows = self._rows(resource_type, page)
+            total = len(matched)
+        resources = [json.loads(row[0]) for row in rows]
+        entries = [{'fullUrl': f"{BASE_URL}/{resource_type}/{r['id']}", 'resource': r, 'search': {'mode': 'match'}}
+                   for r in resources]
+        if include:
+            entries += self._includes(resources, include)
+        return {'resourceType': 'Bundle', 'type': 'searchset', 'total': total, 'entry': entries}
+
+    def _rows(self, resource_type: str, ids: List[str]) -> List[Tuple[str]]:
+        if not ids:
+            return []
+        marks = ','.join('?' * len(ids))
+        return self.conn.execute(f"SELECT json FROM resources WHERE resource_type = ? AND id IN ({marks}) ORDER BY id",
+                                 [resource_type] + ids).fetchall()
+
+    def _includes(self, resources: List[Dict], include: str) -> List[Dict]:
+        param = INCLUDES.get(include)
+        if param is None:
+            raise ValueError(f"Unsupported _include {include}")
+        element = {'partof': 'partOf'}.get(param, param)
+        target_type = REFERENCE_TARGETS[param]
+        ids = sorted({r.get(element, {}).get('reference', '').split('/')[-1]
+                      for r in resources if r.get(element, {}).get('reference')})
+        return [{'fullUrl': f"{BASE_URL}/{target_type}/{r['id']}", 'resource': r, 'search': {'mode': 'include'}}
+                for r in (json.loads(row[0]) for row in self._rows(target_type, ids))]
+
+    def typeahead(self, text: str, resource_types: Tuple[str, ...] = ('Organization', 'Practitioner'),
+                  limit: int = 10) -> List[Dict]:
+        """Organizations and practitioners with a name word starting with text, shortest names first"""
+        prefix = glob_escape(normalize(text))
+        marks = ','.join('?' * len(resource_types))
+        rows = self.conn.execute(
+            f"SELECT resource_type, id, MIN(raw) FROM names WHERE param = 'name' AND resource_type IN ({marks}) "
+            f"AND (text GLOB ? OR text GLOB ?) GROUP BY resource_type, id ORDER BY length(MIN(raw)), MIN(raw) LIMIT ?",
+            list(resource_types) + [f'{prefix}*', f'* {prefix}*', limit])
+        return [dict(zip(('resourceType', 'id', 'name'), row)) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        return {resource_type: self.conn.execute("SELECT COUNT(*) FROM resources WHERE resource_type = ?",
+                                                 (resource_type,)).fetchone()[0]
+                for resource_type in RESOURCE_TYPES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local replica of the provider directory')
+    parser.add_argument('--db', default=DIRECTORY_DB, help=f'Replica database (default: {DIRECTORY_DB})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync = commands.add_parser('sync', help='Apply changes since the last sync (everything on first use)')
+    sync.add_argument('--full', action='store_true', help='Ignore the checkpoints and copy everything')
+    sync.add_argument('--watch', type=int, metavar='SECONDS', help='Keep polling the change feed at this interval')
+    search = commands.add_parser('search', help='Search the replica like the server')
+    search.add_argument('resource_type', choices=RESOURCE_TYPES)
+    search.add_argument('params', nargs='*', help='name=value pairs, e.g. name:contains=fergana')
+    typeahead = commands.add_parser('typeahead', help='Names starting with a prefix')
+    typeahead.add_argument('text')
+    commands.add_parser('stats', help='Resource counts and checkpoints')
+    args = parser.parse_args()
+
+    replica = DirectoryReplica(args.db)
+    if args.command == 'sync':
+        test_utils.VERBOSE = False
+        while True:
+            start = time.perf_counter()
+            try:
+                changes = replica.sync(args.full)
+            except requests.exceptions.RequestException as e:
+                print(f"{Colors.RED}Sync failed, checkpoints unchanged: {e}{Colors.RESET}")
+                if not args.watch:
+                    exit(1)
+                time.sleep(args.watch)
+                continue
+            summary = ', '.join(f"{t}: {stored} stored, {deleted} deleted" for t, (stored, deleted) in changes.items())
+            print(f"{Colors.GREEN}Synced in {time.perf_counter() - start:.1f}s{Colors.RESET} ({summary})")
+            if not args.watch:
+                break
+            args.full = False
+            time.sleep(args.watch)
+    elif args.command == 'search':
+        start = time.perf_counter()
+        bundle = replica.search(args.resource_type, dict(p.split('=', 1) for p in args.params))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for entry in bundle['entry']:
+            resource = entry['resource']
+            names = [raw for param, raw in index_entries(resource)[0] if param == 'name']
+            print(f"  {resource['resourceType']}/{resource['id']}  {names[0] if names else ''}")
+        print(f"{Colors.CYAN}{bundle['total']} match(es) in {elapsed_ms:.2f}ms{Colors.RESET}")
+    elif args.command == 'typeahead':
+        start = time.perf_counter()
+        found = replica.typeahead(args.text)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for item in found:
+            print(f"  {item['resourceType']}/{item['id']}  {item['name']}")
+        print(f"{Colors.CYAN}{len(found)} suggestion(s) in {elapsed_ms:.2f}ms{Colors.RESET}")
+    else:
+        for resource_type, count in replica.stats().items():
+            print(f"  {resource_type}: {count} (checkpoint {replica.checkpoint(resource_type) or '-'})")
+    replica.close()
+
+
+if __name__ == '__main__':
+    main()
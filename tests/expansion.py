@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Paged ValueSet expansion for very large ValueSets
+Reads expansion.total from the first page, then fetches the remaining offset/count pages
+concurrently (at most `workers` in flight) and yields the codes in expansion order, so an
+ICD-10 sized expansion streams to a consumer or a file instead of one huge response.
+Pages step by the size of the first page (servers may cap count below page_size), and an
+expansion that does not add up to expansion.total raises ExpansionError.
+
+Usage:
+    python expansion.py --url https://terminology.dhp.uz/fhir/core/ValueSet/position-and-profession-vs --out codes.ndjson
+    python expansion.py --id position-and-profession-vs --page-size 500 -j 8 --out codes.ndjson
+"""
+import argparse
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+import test_utils
+from test_utils import Colors, make_request
+
+# Codes per $expand page
+PAGE_SIZE = 1000
+
+# Attempts per page before the expansion fails
+PAGE_ATTEMPTS = 3
+
+
+class ExpansionError(Exception):
+    """A page could not be fetched, or the pages do not add up to expansion.total"""
+
+
+def flatten(contains: List[Dict]) -> Iterator[Dict]:
+    """Codes of a (possibly hierarchical) expansion, parents before their children"""
+    for item in contains:
+        children = item.get('contains')
+        if 'code' in item:
+            yield {k: v for k, v in item.items() if k != 'contains'} if children else item
+        if children:
+            yield from flatten(children)
+
+
+class PagedExpansion:
+    """
+    Expansion of one ValueSet, fetched in offset/count pages
+
+    Usage:
+        expansion = PagedExpansion(url='http://hl7.org/fhir/ValueSet/icd-10', workers=8)
+        for code in expansion:
+            ...
+        expansion.total, expansion.pages
+    """
+    def __init__(self, url: Optional[str] = None, value_set_id: Optional[str] = None,
+                 params: Optional[Dict] = None, page_size: int = PAGE_SIZE, workers: int = 4):
+        if not url and not value_set_id:
+            raise ValueError("url or value_set_id is required")
+        self.endpoint = f'/ValueSet/{value_set_id}/$expand' if value_set_id else '/ValueSet/$expand'
+        self.params = dict(params or {})
+        if url and not value_set_id:
+            self.params['url'] = url
+        self.page_size = page_size
+        self.workers = workers
+        self.total: Optional[int] = None
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    def fetch_page(self, offset: int) -> Dict:
+        """The expansion element of one page"""
+        params = dict(self.params, offset=str(offset), count=str(self.page_size))
+        for attempt in range(PAGE_ATTEMPTS):
+            response = make_request('GET', self.endpoint, params=params)
+            if response.status_code == 200:
+                with self._lock:
+                    self.pages += 1
+                return response.json().get('expansion', {})
+            # Client errors will not go away on retry
+            if response.status_code < 500 or attempt == PAGE_ATTEMPTS - 1:
+                raise ExpansionError(f"$expand offset {offset}: status {response.status_code}")
+            time.sleep(2 ** attempt)
+
+    def __iter__(self) -> Iterator[Dict]:
+        first = self.fetch_page(0)
+        first_codes = list(flatten(first.get('contains', [])))
+        self.total = first.get('total')
+        yield from first_codes
+        # The server may cap count below page_size: step by what it actually returned
+        stride = len(first_codes)
+
+        if self.total is None:
+            # No total reported: read page by page until a short page
+            if stride:
+                yield from self._sequential(stride, stride, first_codes[0].get('code'))
+            return
+        yielded = stride
+        if stride < self.total:
+            if not stride:
+                raise ExpansionError(f"First page is empty but expansion.total is {self.total}")
+            for code in self._parallel(stride, first_codes[0].get('code')):
+                yielded += 1
+                yield code
+        # Short or missing pages would otherwise end the expansion early without a sign
+        if yielded != self.total:
+            raise ExpansionError(f"Got {yielded} codes, expansion.total is {self.total}")
+
+    def _check_offset(self, page: List[Dict], first_code: Optional[str], offset: int):
+        # A server that ignores offset returns the first page again
+        if page and page[0].get('code') == first_code:
+            raise ExpansionError(f"Server ignored offset={offset} (paging not supported for this expansion)")
+
+    def _sequential(self, offset: int, stride: int, first_code: Optional[str]) -> Iterator[Dict]:
+        while True:
+            page = list(flatten(self.fetch_page(offset).get('contains', [])))
+            self._check_offset(page, first_code, offset)
+            yield from page
+            if len(page) < stride:
+                return
+            offset += len(page)
+
+    def _parallel(self, stride: int, first_code: Optional[str]) -> Iterator[Dict]:
+        offsets = iter(range(stride, self.total, stride))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Futures in offset order; the head is yielded once done, keeping at most `workers` pages in memory
+            in_flight = deque()
+
+            def submit_next() -> bool:
+                next_offset = next(offsets, None)
+                if next_offset is None:
+                    return False
+                context = contextvars.copy_context()
+                in_flight.append((next_offset, executor.submit(context.run, self.fetch_page, next_offset)))
+                return True
+
+            for _ in range(self.workers):
+                if not submit_next():
+                    break
+            while in_flight:
+                page_offset, future = in_flight.popleft()
+                page = list(flatten(future.result().get('contains', [])))
+                submit_next()
+                self._check_offset(page, first_code, page_offset)
+                yield from page
+
+
+def expand_to_file(expansion: PagedExpansion, path: str,
+                   progress: Optional[Callable[[int, Optional[int]], None]] = None) -> int:
+    """Write the codes as NDJSON (one contains item per line); returns the number written"""
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for code in expansion:
+            f.write(json.dumps(code, ensure_ascii=False) + '\n')
+            written += 1
+            if progress and written % expansion.page_size == 0:
+                progress(written, expansion.total)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Expand a large ValueSet in parallel pages')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='ValueSet canonical url')
+    target.add_argument('--id', dest='value_set_id', help='ValueSet resource id')
+    parser.add_argument('--filter', help='Text filter passed to $expand')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help=f'Codes per page (default: {PAGE_SIZE})')
+    parser.add_argument('-j', '--workers', type=int, default=4, help='Pages fetched in parallel (default: 4)')
+    parser.add_argument('--out', required=True, help='NDJSON file for the codes')
+    args = parser.parse_args()
+
+    # One progress line per page instead of every response body
+    test_utils.VERBOSE = False
+
+    params = {'filter': args.filter} if args.filter else None
+    expansion = PagedExpansion(args.url, args.value_set_id, params, args.page_size, args.workers)
+    start = time.perf_counter()
+
+    def progress(done, total):
+        print(f"\r  {done}/{total if total is not None else '?'} codes", end='', flush=True)
+
+    try:
+        written = expand_to_file(expansion, args.out, progress)
+    except ExpansionError as e:
+        print(f"\n{Colors.RED}{e}{Colors.RESET}")
+        raise SystemExit(1)
+    elapsed = time.perf_counter() - start
+    print(f"\n{Colors.GREEN}{written} codes in {expansion.pages} page(s), {elapsed:.1f}s{Colors.RESET} → {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,508 @@
+"""
+Fixture management for FHIR API tests
+Tracks every resource a scenario creates and deletes them in bulk, even when the scenario fails
+"""
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+import test_utils
+from test_utils import (
+    TestResults, make_request, search_resources, extract_entries,
+    add_request_listener, Colors
+)
+from config import (
+    CLEANUP_AFTER_TESTS, CLEANUP_MODE, CLEANUP_WORKERS, TEST_IDENTIFIER_PREFIX, INDEXING_WAIT
+)
+
+
+# Fixture manager of the scenario currently running in this context
+_current_manager = contextvars.ContextVar('current_fixture_manager', default=None)
+
+# Resource types swept for leftovers, with the string search parameter that matches the prefix.
+# PractitionerRole has no name, so roles are found through SWEEP_DEPENDENTS instead.
+SWEEP_SEARCHES = [
+    ('Patient', 'name'),
+    ('Practitioner', 'name'),
+    ('Organization', 'name'),
+]
+
+# Resources that reference a leftover and must be deleted before it:
+# (referenced type, dependent type, search parameter, reference element of the dependent).
+# Only dependents that are test data themselves are deleted (see is_test_dependent); any other
+# reference keeps its leftover in place.
+SWEEP_DEPENDENTS = [
+    ('Practitioner', 'PractitionerRole', 'practitioner', 'practitioner'),
+    ('Organization', 'PractitionerRole', 'organization', 'organization'),
+    ('Organization', 'Patient', 'organization', 'managingOrganization'),
+]
+
+# Elements read from a dependent to decide whether it is test data and which leftover it references
+DEPENDENT_ELEMENTS = {
+    'PractitionerRole': ['id', 'practitioner', 'organization'],
+    'Patient': ['id', 'name', 'managingOrganization'],
+}
+
+# Maximum number of references per dependent search (e.g. PractitionerRole?practitioner=) during a sweep
+SWEEP_REFERENCE_CHUNK = 20
+
+
+def parse_location(location: str) -> Optional[Tuple[str, str]]:
+    """
+    Extract (resource_type, id) from a Location header or Bundle response location
+    Example: 'Patient/123/_history/1' -> ('Patient', '123')
+    """
+    if not location:
+        return None
+    parts = location.split('?')[0].rstrip('/').split('/')
+    if '_history' in parts:
+        parts = parts[:parts.index('_history')]
+    if len(parts) < 2:
+        return None
+    return parts[-2], parts[-1]
+
+
+def is_success_status(status: str) -> bool:
+    """Check a Bundle entry response status such as '200 OK' or '204 No Content'"""
+    return str(status).strip().startswith('2')
+
+
+class FixtureManager:
+    """
+    Track resources created while the manager is active and tear them down in bulk
+
+    Usage:
+        with FixtureManager('Patient', results) as fixtures:
+            ...  # every resource created through make_request is recorded in fixtures.created
+    """
+    def __init__(self, name: str, results: Optional[TestResults] = None):
+        self.name = name
+        self.results = results
+        self.created: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_manager.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_manager.reset(self._token)
+        if CLEANUP_AFTER_TESTS:
+            self.teardown()
+        return False
+
+    def register(self, resource_type: str, resource_id: str):
+        """Record a created resource for teardown"""
+        with self._lock:
+            if (resource_type, resource_id) not in self.created:
+                self.created.append((resource_type, resource_id))
+
+    def unregister(self, resource_type: str, resource_id: str):
+        """Forget a resource that was already deleted"""
+        with self._lock:
+            if (resource_type, resource_id) in self.created:
+                self.created.remove((resource_type, resource_id))
+
+    def teardown(self):
+        """Delete all tracked resources, newest first (e.g. roles before practitioners)"""
+        if not self.created:
+            return
+        print(f"\n{Colors.BOLD}Cleanup ({len(self.created)} resources){Colors.RESET}")
+        resources = list(reversed(self.created))
+        if CLEANUP_MODE == 'concurrent':
+            outcomes = delete_concurrently(resources)
+        else:
+            outcomes = delete_in_bundle(resources, CLEANUP_MODE)
+            if outcomes is None:
+                print(f"{Colors.YELLOW}Bundle delete not accepted, deleting one by one{Colors.RESET}")
+                outcomes = delete_concurrently(resources)
+
+        for (resource_type, resource_id), (deleted, reason) in zip(resources, outcomes):
+            test_name = f"Delete {resource_type}/{resource_id}"
+            if deleted:
+                self.unregister(resource_type, resource_id)
+            if self.results is None:
+                continue
+            if deleted:
+                self.results.add_pass(test_name)
+            else:
+                self.results.add_fail(test_name, reason)
+
+
+def current_fixtures() -> Optional[FixtureManager]:
+    """Return the fixture manager of the running scenario, if any"""
+    return _current_manager.get()
+
+
+def _track_created_resources(method: str, endpoint: str, response):
+    """Request listener: register created resources with the active fixture manager"""
+    manager = _current_manager.get()
+    if manager is None:
+        return
+
+    path = endpoint.strip('/')
+    if method == 'POST' and response.status_code == 201 and path and '/' not in path:
+        created = None
+        try:
+            body = response.json()
+            if body.get('id'):
+                created = (body.get('resourceType', path), body['id'])
+        except (ValueError, AttributeError):
+            pass
+        created = created or parse_location(response.headers.get('Location'))
+        if created:
+            manager.register(*created)
+    elif method == 'POST' and not path and response.status_code == 200:
+        # batch/transaction responses: register every entry the server created
+        try:
+            bundle = response.json()
+        except ValueError:
+            return
+        for entry in bundle.get('entry', []):
+            entry_response = entry.get('response', {})
+            if str(entry_response.get('status', '')).startswith('201'):
+                created = parse_location(entry_response.get('location'))
+                if created:
+                    manager.register(*created)
+    elif method == 'DELETE' and response.status_code in (200, 204):
+        target = parse_location(path)
+        if target:
+            manager.unregister(*target)
+
+
+add_request_listener(_track_created_resources)
+
+
+def delete_in_bundle(resources: List[Tuple[str, str]], bundle_type: str = 'batch') -> Optional[List[Tuple[bool, str]]]:
+    """
+    Delete resources with a single batch or transaction Bundle
+    Returns one (deleted, reason) tuple per resource, or None if the server rejected the Bundle
+    """
+    bundle = {
+        "resourceType": "Bundle",
+        "type": bundle_type,
+        "entry": [
+            {"request": {"method": "DELETE", "url": f"{resource_type}/{resource_id}"}}
+            for resource_type, resource_id in resources
+        ]
+    }
+    response = make_request('POST', '/', data=bundle)
+    if response.status_code != 200:
+        return None
+
+    entries = response.json().get('entry', [])
+    if len(entries) != len(resources):
+        return None
+
+    outcomes = []
+    for entry in entries:
+        status = entry.get('response', {}).get('status', '')
+        outcomes.append((is_success_status(status), f"Status {status}"))
+    return outcomes
+
+
+def delete_concurrently(resources: List[Tuple[str, str]]) -> List[Tuple[bool, str]]:
+    """Delete resources with parallel DELETE requests; returns (deleted, reason) per resource"""
+    def delete(resource):
+        resource_type, resource_id = resource
+        response = make_request('DELETE', f'/{resource_type}/{resource_id}')
+        return response.status_code in (200, 204), f"Status {response.status_code}"
+
+    # Under the adaptive controller the limiter, not the pool size, decides how many run at once
+    limiter = test_utils.request_limiter
+    workers = max(CLEANUP_WORKERS, limiter.max_limit) if limiter else CLEANUP_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(delete, resources))
+
+
+def is_test_dependent(resource: Dict, leftovers: Set[Tuple[str, str]]) -> bool:
+    """
+    Whether a resource referencing a leftover is test data itself: a Patient named with
+    TEST_IDENTIFIER_PREFIX, or a PractitionerRole (which has no name) all of whose references are leftovers
+    """
+    if resource.get('resourceType') == 'PractitionerRole':
+        references = [parse_location(resource[element].get('reference'))
+                      for element in ('practitioner', 'organization') if resource.get(element)]
+        return bool(references) and all(reference in leftovers for reference in references)
+    names = [name.get('family', '') for name in resource.get('name', [])]
+    names += [given for name in resource.get('name', []) for given in name.get('given', [])]
+    return any(name.startswith(TEST_IDENTIFIER_PREFIX) for name in names)
+
+
+def find_leftovers(page_size: int = 100) -> Tuple[List[Tuple[str, str]], Dict[Tuple[str, str], List[Tuple[str, str]]]]:
+    """
+    Find test resources whose names start with TEST_IDENTIFIER_PREFIX, in deletion order.
+    Returns them and the leftovers left out because a resource that is not test data references them
+    (leftover -> referencing resources).
+    """
+    leftovers = []
+    for resource_type, param in SWEEP_SEARCHES:
+        bundle = search_resources(resource_type, {param: TEST_IDENTIFIER_PREFIX, '_count': str(page_size)},
+                                  elements=['id'])
+        for resource in extract_entries(bundle, resource_type):
+            leftovers.append((resource_type, resource['id']))
+    found = set(leftovers)
+
+    # Test roles and patients pointing at leftover practitioners or organizations must go first
+    dependents = []
+    blocked: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+    for target_type, dependent_type, param, element in SWEEP_DEPENDENTS:
+        refs = [f"{target_type}/{rid}" for rtype, rid in leftovers if rtype == target_type]
+        for i in range(0, len(refs), SWEEP_REFERENCE_CHUNK):
+            chunk = refs[i:i + SWEEP_REFERENCE_CHUNK]
+            bundle = search_resources(dependent_type, {param: ','.join(chunk), '_count': str(page_size)},
+                                      elements=DEPENDENT_ELEMENTS[dependent_type])
+            for resource in extract_entries(bundle, dependent_type):
+                key = (dependent_type, resource['id'])
+                if is_test_dependent(resource, found):
+                    dependents.append(key)
+                else:
+                    target = parse_location(resource.get(element, {}).get('reference'))
+                    blocked.setdefault(target, []).append(key)
+    deletable = [key for key in dict.fromkeys(dependents + leftovers) if key not in blocked]
+    return deletable, blocked
+
+
+def sweep(max_rounds: int = 50) -> int:
+    """
+    Delete leftover test resources tagged with TEST_IDENTIFIER_PREFIX
+    Searches one page per resource type, deletes it in bulk and repeats until nothing is left.
+    Returns the number of resources deleted.
+    """
+    if not TEST_IDENTIFIER_PREFIX:
+        print(f"{Colors.RED}Refusing to sweep: TEST_IDENTIFIER_PREFIX is empty{Colors.RESET}")
+        return 0
+
+    print(f"\n{Colors.BOLD}Sweeping test resources with prefix '{TEST_IDENTIFIER_PREFIX}'{Colors.RESET}")
+    deleted_total = 0
+    blocked = {}
+    for _ in range(max_rounds):
+        leftovers, blocked = find_leftovers()
+        if not leftovers:
+            break
+        if CLEANUP_MODE == 'concurrent':
+            outcomes = delete_concurrently(leftovers)
+        else:
+            outcomes = delete_in_bundle(leftovers, 'batch') or delete_concurrently(leftovers)
+        deleted = sum(1 for ok, _ in outcomes if ok)
+        deleted_total += deleted
+        print(f"  {Colors.CYAN}→ Deleted {deleted} of {len(leftovers)} leftover resource(s){Colors.RESET}")
+        if deleted == 0:
+            print(f"{Colors.YELLOW}Remaining resources could not be deleted, stopping sweep{Colors.RESET}")
+            break
+
+    for (resource_type, resource_id), referrers in blocked.items():
+        print(f"{Colors.YELLOW}Skipped {resource_type}/{resource_id}: referenced by "
+              f"{', '.join(f'{t}/{i}' for t, i in referrers[:3])}, which is not test data{Colors.RESET}")
+    print(f"{Colors.GREEN}Sweep finished: {deleted_total} resource(s) deleted{Colors.RESET}")
+    return deleted_total
+
+
+# Identifiers of the shared fixtures, used by the scenario search tests
+SHARED_ORGANIZATION_NAME = f"{TEST_IDENTIFIER_PREFIX}Fergana Regional Hospital"
+SHARED_ORGANIZATION_SOLIQ = f"{TEST_IDENTIFIER_PREFIX}fergana-test-999"
+SHARED_PRACTITIONER_ARGOS = f"{TEST_IDENTIFIER_PREFIX}argos-12345678"
+SHARED_PRACTITIONER_PHONE = f"{TEST_IDENTIFIER_PREFIX}+998901234567"
+SHARED_PRACTITIONER_EMAIL = f"{TEST_IDENTIFIER_PREFIX}doctor@example.com"
+SHARED_PATIENT_PINFL = f"{TEST_IDENTIFIER_PREFIX}search-12345678901234"
+
+
+def shared_organization() -> Dict:
+    """Organization used by the organization name searches and as PractitionerRole employer"""
+    return {
+        "resourceType": "Organization",
+        "meta": {
+            "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-organization"]
+        },
+        "identifier": [
+            {
+                "system": "https://dhp.uz/fhir/core/sid/org/uz/soliq",
+                "type": {
+                    "coding": [
+                        {"system": "http://terminology.hl7.org/CodeSystem/v2-0203", "code": "TAX"}
+                    ]
+                },
+                "value": SHARED_ORGANIZATION_SOLIQ
+            }
+        ],
+        "active": True,
+        "type": [
+            {
+                "coding": [
+                    {
+                        "system": "http://terminology.hl7.org/CodeSystem/organization-type",
+                        "code": "prov",
+                        "display": "Healthcare Provider"
+                    }
+                ]
+            }
+        ],
+        "language": "uz",
+        "name": SHARED_ORGANIZATION_NAME
+    }
+
+
+def shared_practitioner() -> Dict:
+    """Practitioner used by the identifier, phone and email searches"""
+    return {
+        "resourceType": "Practitioner",
+        "meta": {
+            "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-practitioner"]
+        },
+        "language": "uz",
+        "identifier": [
+            {
+                "use": "official",
+                "type": {
+                    "coding": [
+                        {
+                            "system": "http://terminology.hl7.org/CodeSystem/v2-0203",
+                            "code": "NI"
+                        }
+                    ]
+                },
+                "system": "https://dhp.uz/fhir/core/sid/pro/uz/argos",
+                "value": SHARED_PRACTITIONER_ARGOS
+            }
+        ],
+        "active": True,
+        "name": [
+            {
+                "use": "official",
+                "family": f"{TEST_IDENTIFIER_PREFIX}TestPractitioner",
+                "given": ["Test", "Search"]
+            }
+        ],
+        "telecom": [
+            {
+                "system": "phone",
+                "value": SHARED_PRACTITIONER_PHONE,
+                "use": "work"
+            },
+            {
+                "system": "email",
+                "value": SHARED_PRACTITIONER_EMAIL,
+                "use": "work"
+            }
+        ],
+        "gender": "male"
+    }
+
+
+def shared_patient() -> Dict:
+    """Patient used by the PINFL and name searches"""
+    return {
+        "resourceType": "Patient",
+        "meta": {
+            "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-patient"]
+        },
+        "language": "uz",
+        "identifier": [
+            {
+                "use": "official",
+                "type": {
+                    "coding": [
+                        {
+                            "system": "http://terminology.hl7.org/CodeSystem/v2-0203",
+                            "code": "NI"
+                        }
+                    ]
+                },
+                "system": "https://dhp.uz/fhir/core/sid/pid/uz/ni",
+                "value": SHARED_PATIENT_PINFL
+            }
+        ],
+        "active": True,
+        "name": [
+            {
+                "use": "official",
+                "family": f"{TEST_IDENTIFIER_PREFIX}SearchTest",
+                "given": ["Test", "Patient"]
+            }
+        ],
+        "gender": "male",
+        "birthDate": "1985-05-15"
+    }
+
+
+class SharedFixtures:
+    """Organization, Practitioner and Patient created once per run and shared by all scenarios"""
+    def __init__(self):
+        self.organization: Optional[Dict] = None
+        self.practitioner: Optional[Dict] = None
+        self.patient: Optional[Dict] = None
+
+
+def create_shared_fixtures(results: TestResults) -> SharedFixtures:
+    """
+    Create the shared fixtures in a single transaction Bundle and wait once for indexing.
+    Falls back to one POST per resource if the server rejects the transaction.
+    Resources are registered with the active fixture manager for teardown.
+    """
+    print(f"\n{Colors.BOLD}Shared Fixtures Setup{Colors.RESET}")
+    shared = SharedFixtures()
+    fixtures = [
+        ('organization', shared_organization()),
+        ('practitioner', shared_practitioner()),
+        ('patient', shared_patient()),
+    ]
+
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {
+                "fullUrl": f"urn:uuid:{uuid.uuid4()}",
+                "resource": resource,
+                "request": {"method": "POST", "url": resource['resourceType']}
+            }
+            for _, resource in fixtures
+        ]
+    }
+    response = make_request('POST', '/', data=bundle, headers={'Prefer': 'return=representation'})
+
+    entries = response.json().get('entry', []) if response.status_code == 200 else []
+    if len(entries) == len(fixtures):
+        for (attr, resource), entry in zip(fixtures, entries):
+            created = entry.get('resource')
+            if not created:
+                location = parse_location(entry.get('response', {}).get('location'))
+                created = dict(resource, id=location[1]) if location else None
+            setattr(shared, attr, created)
+        results.add_pass("Create shared test fixtures (transaction)")
+    else:
+        print(f"{Colors.YELLOW}Transaction not accepted (status {response.status_code}), "
+              f"creating fixtures one by one{Colors.RESET}")
+        for attr, resource in fixtures:
+            response = make_request('POST', f"/{resource['resourceType']}", data=resource)
+            if response.status_code == 201:
+                setattr(shared, attr, response.json())
+                results.add_pass(f"Create shared test {resource['resourceType']}")
+            else:
+                results.add_fail(f"Create shared test {resource['resourceType']}", f"Status {response.status_code}")
+
+    if shared.organization or shared.practitioner or shared.patient:
+        print(f"{Colors.BLUE}Waiting {INDEXING_WAIT} seconds for server indexing...{Colors.RESET}")
+        time.sleep(INDEXING_WAIT)
+    return shared
+
+
+@contextmanager
+def shared_fixture_session(results: TestResults, shared: Optional[SharedFixtures] = None):
+    """
+    Yield the shared fixtures. When none are given (e.g. a scenario run on its own),
+    create them and tear them down when the block exits.
+    """
+    if shared is not None:
+        yield shared
+        return
+    with FixtureManager('Shared', results):
+        yield create_shared_fixtures(results)
+
+
+if __name__ == '__main__':
+    sweep()
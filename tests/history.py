@@ -0,0 +1,212 @@
+"""
+Historical run database and latency regression report (--compare)
+Every run appends its request and check timings to a SQLite file (HISTORY_DB), keyed by
+server URL, server software version (from /metadata) and start time
+"""
+import math
+import sqlite3
+import statistics
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from test_utils import (
+    Colors, TestResults, FHIRResponse, make_request, endpoint_label,
+    add_request_listener, remove_request_listener
+)
+from config import BASE_URL, HISTORY_DB, HISTORY_BASELINE_RUNS
+
+# One-sided significance level for flagging a regression, Bonferroni-corrected for the
+# number of endpoints (or checks) compared so a long report does not flag noise
+REGRESSION_ALPHA = 0.01
+
+# Ignore significant but small slowdowns (ratio of geometric mean latencies)
+MIN_SLOWDOWN = 1.2
+
+# Fewer baseline samples than this are not compared
+MIN_BASELINE_SAMPLES = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_url TEXT NOT NULL,
+    server_version TEXT,
+    started_at TEXT NOT NULL,
+    elapsed_seconds REAL NOT NULL,
+    passed INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    selection TEXT
+);
+CREATE TABLE IF NOT EXISTS request_timings (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    endpoint TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    client_ms REAL NOT NULL,
+    server_ms REAL
+);
+CREATE TABLE IF NOT EXISTS check_timings (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    scenario TEXT NOT NULL,
+    name TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    passed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_server ON runs(server_url, started_at);
+CREATE INDEX IF NOT EXISTS idx_request_timings_run ON request_timings(run_id, endpoint);
+CREATE INDEX IF NOT EXISTS idx_check_timings_run ON check_timings(run_id);
+"""
+
+
+def connect(path: str = HISTORY_DB) -> sqlite3.Connection:
+    """Open the history database, creating the tables on first use"""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def fetch_server_version() -> Optional[str]:
+    """'name version' of the server software from /metadata, or None if unavailable"""
+    try:
+        response = make_request('GET', '/metadata', elements=['software'])
+        software = response.json().get('software', {}) if response.status_code == 200 else {}
+    except Exception:
+        return None
+    version = ' '.join(v for v in (software.get('name'), software.get('version')) if v)
+    return version or None
+
+
+class RunRecorder:
+    """
+    Collects the timing of every request made while active and saves the run
+
+    Usage:
+        with RunRecorder() as recorder:
+            ...run scenarios...
+        run_id = recorder.save(total_results, elapsed, check_timings)
+    """
+    def __init__(self, path: str = HISTORY_DB):
+        self.path = path
+        self.started_at = datetime.now(timezone.utc)
+        self.requests: List[Tuple[str, int, float, Optional[float]]] = []
+
+    def __enter__(self):
+        add_request_listener(self._record)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        remove_request_listener(self._record)
+        return False
+
+    def _record(self, method: str, endpoint: str, response: FHIRResponse):
+        # The listener gets no params, so take the search parameter names from the final URL
+        query = urlsplit(response.url).query
+        label = endpoint_label(method, f"{endpoint.split('?')[0]}?{query}" if query else endpoint)
+        self.requests.append((label, response.status_code, response.latency_ms, response.server_time_ms))
+
+    def save(self, results: TestResults, elapsed: float, check_timings: List[Tuple[str, str, float, bool]],
+             selection: Optional[str] = None) -> int:
+        """Store the run with its request and check timings; returns the run id"""
+        version = fetch_server_version()
+        with connect(self.path) as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (server_url, server_version, started_at, elapsed_seconds, passed, failed, skipped, selection) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (BASE_URL, version, self.started_at.isoformat(), elapsed,
+                 results.passed, results.failed, results.skipped, selection)
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO request_timings (run_id, endpoint, status, client_ms, server_ms) VALUES (?, ?, ?, ?, ?)",
+                [(run_id,) + request for request in self.requests]
+            )
+            conn.executemany(
+                "INSERT INTO check_timings (run_id, scenario, name, seconds, passed) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, scenario, name, seconds, int(passed)) for scenario, name, seconds, passed in check_timings]
+            )
+        conn.close()
+        return run_id
+
+
+def regression(current: List[float], baseline: List[float]) -> Optional[Tuple[float, float]]:
+    """
+    Compare latencies on a log scale (they are roughly log-normal).
+    Returns (slowdown ratio of geometric means, one-sided p-value) or None without enough baseline data.
+    With a single current sample this is a prediction-interval test against the baseline spread.
+    """
+    if not current or len(baseline) < MIN_BASELINE_SAMPLES:
+        return None
+    log_current = [math.log(max(v, 1e-3)) for v in current]
+    log_baseline = [math.log(max(v, 1e-3)) for v in baseline]
+    mean_current = statistics.fmean(log_current)
+    mean_baseline = statistics.fmean(log_baseline)
+    var_baseline = statistics.variance(log_baseline)
+    var_current = statistics.variance(log_current) if len(log_current) > 1 else var_baseline
+    se = math.sqrt(var_current / len(log_current) + var_baseline / len(log_baseline))
+    ratio = math.exp(mean_current - mean_baseline)
+    if se == 0:
+        return ratio, 0.0 if mean_current > mean_baseline else 1.0
+    z = (mean_current - mean_baseline) / se
+    return ratio, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _samples(conn: sqlite3.Connection, query: str, run_ids: List[int]) -> Dict[str, List[float]]:
+    samples: Dict[str, List[float]] = {}
+    if not run_ids:
+        return samples
+    placeholders = ','.join('?' * len(run_ids))
+    for key, value in conn.execute(query.format(placeholders), run_ids):
+        samples.setdefault(key, []).append(value)
+    return samples
+
+
+def print_comparison(run_id: int, path: str = HISTORY_DB, baseline_runs: int = HISTORY_BASELINE_RUNS):
+    """Compare a run's endpoint and check latencies with the previous runs against the same server"""
+    conn = connect(path)
+    server_url, version = conn.execute("SELECT server_url, server_version FROM runs WHERE id = ?", (run_id,)).fetchone()
+    baseline_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM runs WHERE server_url = ? AND id < ? ORDER BY id DESC LIMIT ?",
+        (server_url, run_id, baseline_runs)
+    )]
+    baseline_versions = sorted({row[0] or 'unknown' for row in conn.execute(
+        f"SELECT server_version FROM runs WHERE id IN ({','.join('?' * len(baseline_ids))})", baseline_ids
+    )}) if baseline_ids else []
+
+    endpoint_query = "SELECT endpoint, client_ms FROM request_timings WHERE run_id IN ({})"
+    check_query = "SELECT scenario || '/' || name, seconds * 1000 FROM check_timings WHERE run_id IN ({})"
+    comparisons = [
+        ('Endpoint', _samples(conn, endpoint_query, [run_id]), _samples(conn, endpoint_query, baseline_ids)),
+        ('Check', _samples(conn, check_query, [run_id]), _samples(conn, check_query, baseline_ids)),
+    ]
+    conn.close()
+
+    print(f"\n{Colors.BOLD}Performance Comparison{Colors.RESET}")
+    print(f"{'='*60}")
+    print(f"Server:   {server_url} ({version or 'version unknown'})")
+    if not baseline_ids:
+        print(f"Baseline: none yet - run again to build a history in {path}")
+        return
+    print(f"Baseline: {len(baseline_ids)} previous run(s), version(s): {', '.join(baseline_versions)}")
+
+    regressions = 0
+    for kind, current, baseline in comparisons:
+        rows = []
+        for key, values in current.items():
+            result = regression(values, baseline.get(key, []))
+            if result:
+                ratio, p_value = result
+                rows.append((key, statistics.median(baseline[key]), statistics.median(values), ratio, p_value))
+        threshold = REGRESSION_ALPHA / max(len(rows), 1)
+        flagged = [row for row in rows if row[4] < threshold and row[3] >= MIN_SLOWDOWN]
+        regressions += len(flagged)
+        print(f"\n{Colors.BOLD}{kind} latency{Colors.RESET} ({len(rows)} compared, "
+              f"{len(current) - len(rows)} without enough baseline data)")
+        if not flagged:
+            print(f"  {Colors.GREEN}No significant regressions{Colors.RESET}")
+            continue
+        print(f"  {kind:<48} {'Base ms':>8} {'Now ms':>8} {'Ratio':>6} {'p':>8}")
+        for key, base_ms, now_ms, ratio, p_value in sorted(flagged, key=lambda row: row[3], reverse=True):
+            print(f"  {Colors.RED}{key[:48]:<48}{Colors.RESET} {base_ms:>8.1f} {now_ms:>8.1f} {ratio:>5.2f}x {p_value:>8.1e}")
+
+    if regressions:
+        print(f"\n{Colors.RED}{regressions} latency regression(s) (p < {REGRESSION_ALPHA} after Bonferroni "
+              f"correction, at least {MIN_SLOWDOWN:.1f}x slower){Colors.RESET}")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Synthetic monitoring for the FHIR server (run_all_tests.py --monitor)
+Runs a few cheap read-only probes on a schedule and serves their latency histograms,
+rolling quantiles and success counters on a local OpenMetrics /metrics endpoint
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import test_utils
+from test_utils import Colors, make_request, FHIRResponse
+from config import BASE_URL, MONITOR_PORT, MONITOR_WINDOW, MONITOR_PATIENT_PINFL
+
+# Histogram bucket bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Quantiles reported over the rolling window
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def is_bundle(response: FHIRResponse) -> bool:
+    return response.json().get('resourceType') == 'Bundle'
+
+
+def is_capability_statement(response: FHIRResponse) -> bool:
+    return response.json().get('resourceType') == 'CapabilityStatement'
+
+
+def is_valid_code(response: FHIRResponse) -> bool:
+    parameters = response.json().get('parameter', [])
+    return any(p.get('name') == 'result' and p.get('valueBoolean') for p in parameters)
+
+
+# Probes: (name, endpoint, params, check of a 200 response)
+PROBES: List[Tuple[str, str, Optional[Dict], Callable[[FHIRResponse], bool]]] = [
+    ('metadata', '/metadata', None, is_capability_statement),
+    ('patient_by_pinfl', '/Patient', {
+        'identifier': f'https://dhp.uz/fhir/core/sid/pid/uz/ni|{MONITOR_PATIENT_PINFL}'
+    }, is_bundle),
+    ('validate_code', '/ValueSet/$validate-code', {
+        'url': 'http://hl7.org/fhir/ValueSet/administrative-gender',
+        'code': 'male',
+        'system': 'http://hl7.org/fhir/administrative-gender'
+    }, is_valid_code),
+    ('organization_by_soliq', '/Organization', {
+        'identifier': 'https://dhp.uz/fhir/core/sid/org/uz/soliq|123456789'
+    }, is_bundle),
+]
+
+
+class ProbeMetrics:
+    """Cumulative histograms and counters plus a rolling window of recent latencies, per probe"""
+    def __init__(self, window: int = MONITOR_WINDOW):
+        self.window = window
+        self.probes: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, probe: str, seconds: float, outcome: str, server_ms: Optional[float] = None):
+        now = time.time()
+        with self._lock:
+            stats = self.probes.setdefault(probe, {
+                'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0,
+                'outcomes': {'success': 0, 'failure': 0, 'error': 0},
+                'recent': deque(), 'up': 0, 'last_run': 0.0, 'server_seconds': None
+            })
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['outcomes'][outcome] += 1
+            stats['up'] = 1 if outcome == 'success' else 0
+            stats['last_run'] = now
+            stats['server_seconds'] = server_ms / 1000 if server_ms is not None else None
+            stats['recent'].append((now, seconds))
+            while stats['recent'] and stats['recent'][0][0] < now - self.window:
+                stats['recent'].popleft()
+
+    def render(self) -> str:
+        """All metrics in OpenMetrics text format"""
+        with self._lock:
+            probes = sorted(self.probes.items())
+            lines = [
+                '# TYPE fhir_probe_duration_seconds histogram',
+                '# UNIT fhir_probe_duration_seconds seconds',
+                '# HELP fhir_probe_duration_seconds Client-measured probe latency.'
+            ]
+            for name, stats in probes:
+                for bound, count in zip(BUCKETS, stats['buckets']):
+                    lines.append(f'fhir_probe_duration_seconds_bucket{{probe="{name}",le="{bound}"}} {count}')
+                lines.append(f'fhir_probe_duration_seconds_bucket{{probe="{name}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'fhir_probe_duration_seconds_count{{probe="{name}"}} {stats["count"]}')
+                lines.append(f'fhir_probe_duration_seconds_sum{{probe="{name}"}} {stats["sum"]:.6f}')
+
+            lines += [
+                '# TYPE fhir_probe_window_duration_seconds gauge',
+                '# UNIT fhir_probe_window_duration_seconds seconds',
+                f'# HELP fhir_probe_window_duration_seconds Probe latency quantiles over the last {self.window} seconds.'
+            ]
+            for name, stats in probes:
+                values = sorted(seconds for _, seconds in stats['recent'])
+                for q in QUANTILES:
+                    if values:
+                        value = values[min(int(q * len(values)), len(values) - 1)]
+                        lines.append(f'fhir_probe_window_duration_seconds{{probe="{name}",quantile="{q}"}} {value:.6f}')
+
+            lines += [
+                '# TYPE fhir_probe_checks counter',
+                '# HELP fhir_probe_checks Probe runs by outcome (failure: unexpected response, error: no response).'
+            ]
+            for name, stats in probes:
+                for outcome, count in stats['outcomes'].items():
+                    lines.append(f'fhir_probe_checks_total{{probe="{name}",outcome="{outcome}"}} {count}')
+
+            lines += ['# TYPE fhir_probe_up gauge', '# HELP fhir_probe_up 1 if the last probe run succeeded.']
+            lines += [f'fhir_probe_up{{probe="{name}"}} {stats["up"]}' for name, stats in probes]
+
+            lines += [
+                '# TYPE fhir_probe_server_duration_seconds gauge',
+                '# UNIT fhir_probe_server_duration_seconds seconds',
+                '# HELP fhir_probe_server_duration_seconds Server-reported time of the last probe run.'
+            ]
+            lines += [f'fhir_probe_server_duration_seconds{{probe="{name}"}} {stats["server_seconds"]:.6f}'
+                      for name, stats in probes if stats['server_seconds'] is not None]
+
+            lines += [
+                '# TYPE fhir_probe_last_run_timestamp_seconds gauge',
+                '# UNIT fhir_probe_last_run_timestamp_seconds seconds',
+                '# HELP fhir_probe_last_run_timestamp_seconds Unix time of the last probe run.'
+            ]
+            lines += [f'fhir_probe_last_run_timestamp_seconds{{probe="{name}"}} {stats["last_run"]:.3f}'
+                      for name, stats in probes]
+        if test_utils.request_limiter:
+            lines += test_utils.request_limiter.render()
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves ProbeMetrics.render() on /metrics"""
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(metrics: ProbeMetrics, port: int = MONITOR_PORT) -> ThreadingHTTPServer:
+    """Serve /metrics on localhost from a background thread"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def run_probes(metrics: ProbeMetrics) -> List[str]:
+    """Run every probe once, record the results and return one status line part per probe"""
+    parts = []
+    for name, endpoint, params, check in PROBES:
+        start = time.perf_counter()
+        try:
+            response = make_request('GET', endpoint, params=params)
+        except Exception:
+            metrics.observe(name, time.perf_counter() - start, 'error')
+            parts.append(f"{Colors.RED}✗{Colors.RESET} {name} error")
+            continue
+        seconds = response.latency_ms / 1000
+        try:
+            ok = response.status_code == 200 and check(response)
+        except (ValueError, AttributeError):
+            ok = False
+        metrics.observe(name, seconds, 'success' if ok else 'failure', response.server_time_ms)
+        mark = f"{Colors.GREEN}✓{Colors.RESET}" if ok else f"{Colors.RED}✗{Colors.RESET}"
+        parts.append(f"{mark} {name} {response.status_code} {response.latency_ms:.0f}ms")
+    return parts
+
+
+def run_monitor(interval: int = 60, port: int = MONITOR_PORT):
+    """Probe the server every interval seconds until interrupted"""
+    # One status line per cycle instead of every request and response body
+    test_utils.VERBOSE = False
+
+    metrics = ProbeMetrics()
+    server = start_metrics_server(metrics, port)
+    print(f"\n{Colors.BOLD}FHIR API Monitor{Colors.RESET}")
+    print(f"Probing {Colors.BLUE}{BASE_URL}{Colors.RESET} every {interval}s")
+    print(f"Metrics: {Colors.CYAN}http://127.0.0.1:{port}/metrics{Colors.RESET} (Ctrl+C to stop)\n")
+
+    try:
+        while True:
+            started = time.monotonic()
+            parts = run_probes(metrics)
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] " + '  '.join(parts))
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        print(f"\n{Colors.YELLOW}Monitor stopped{Colors.RESET}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    run_monitor()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Organization hierarchy fetcher with a cached closure table
+A whole tree under a root Organization is loaded with one _revinclude:iterate=Organization:partof
+search where the server supports it, otherwise breadth-first with one partof search per level
+(the level's ids joined into comma-separated OR values). The tree is stored in DIRECTORY_DB as an
+ancestor/descendant closure table, so "all departments under hospital X" is a local query.
+
+Usage:
+    python org_hierarchy.py load <root-org-id>
+    python org_hierarchy.py descendants <org-id> --type dept
+    python org_hierarchy.py ancestors <org-id>
+"""
+import argparse
+import json
+import sqlite3
+import time
+import requests
+from typing import Dict, List, Optional, Tuple
+import test_utils
+from test_utils import Colors, search_all, add_request_listener, remove_request_listener
+from config import DIRECTORY_DB, ORG_TREE_MAX_AGE
+
+# partof references per breadth-first search (keeps the URL well under server limits)
+PARTOF_BATCH_SIZE = 50
+
+# Organizations per page while fetching
+TREE_PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS org_trees (
+    root_id TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    nodes INTEGER NOT NULL,
+    requests INTEGER NOT NULL,
+    method TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS org_nodes (
+    root_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    parent TEXT,
+    name TEXT,
+    types TEXT,
+    json TEXT NOT NULL,
+    PRIMARY KEY (root_id, id)
+);
+CREATE TABLE IF NOT EXISTS org_closure (
+    root_id TEXT NOT NULL,
+    ancestor TEXT NOT NULL,
+    descendant TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (root_id, ancestor, descendant)
+);
+CREATE INDEX IF NOT EXISTS idx_org_closure_ancestor ON org_closure(ancestor, depth);
+CREATE INDEX IF NOT EXISTS idx_org_closure_descendant ON org_closure(descendant, depth);
+"""
+
+
+def parent_id(organization: Dict) -> Optional[str]:
+    reference = organization.get('partOf', {}).get('reference')
+    return reference.split('/')[-1] if reference else None
+
+
+def fetch_with_revinclude(root_id: str) -> Dict[str, Dict]:
+    """The root and whatever the server returns for _revinclude:iterate=Organization:partof"""
+    organizations = {}
+    for organization in search_all('Organization', {
+        '_id': root_id, '_revinclude:iterate': 'Organization:partof', '_count': str(TREE_PAGE_SIZE)
+    }):
+        organizations[organization['id']] = organization
+    return organizations
+
+
+def fetch_level(parent_ids: List[str]) -> List[Dict]:
+    """Direct children of several Organizations, PARTOF_BATCH_SIZE parents per search"""
+    children = []
+    for i in range(0, len(parent_ids), PARTOF_BATCH_SIZE):
+        chunk = parent_ids[i:i + PARTOF_BATCH_SIZE]
+        # A failed level would silently cut the tree off below it
+        children += search_all('Organization', {
+            'partof': ','.join(f'Organization/{org_id}' for org_id in chunk), '_count': str(TREE_PAGE_SIZE)
+        }, required=True)
+    return children
+
+
+def fetch_breadth_first(organizations: Dict[str, Dict], frontier: List[str]) -> Dict[str, Dict]:
+    """Extend a partial tree level by level from frontier; ids already seen are not revisited (cycles)"""
+    while frontier:
+        next_frontier = []
+        for child in fetch_level(frontier):
+            if child['id'] not in organizations:
+                organizations[child['id']] = child
+                next_frontier.append(child['id'])
+        frontier = next_frontier
+    return organizations
+
+
+def levels(organizations: Dict[str, Dict], root_id: str) -> List[List[str]]:
+    """Ids of a fetched tree by depth from the root (organizations not connected to it are left out)"""
+    children: Dict[str, List[str]] = {}
+    for org_id, organization in organizations.items():
+        children.setdefault(parent_id(organization), []).append(org_id)
+    result = [[root_id]]
+    seen = {root_id}
+    while True:
+        level = [c for org_id in result[-1] for c in children.get(org_id, []) if c not in seen]
+        if not level:
+            return result
+        seen.update(level)
+        result.append(level)
+
+
+def fetch_tree(root_id: str) -> Tuple[Dict[str, Dict], str]:
+    """
+    Every Organization under root_id (root included) and how the tree was fetched:
+    'revinclude' if one _revinclude:iterate search returned all of it, else 'breadth-first'.
+    Returns no organizations when the root does not exist; raises HTTPError when a search fails.
+    """
+    organizations = fetch_with_revinclude(root_id)
+    if root_id not in organizations:
+        # The server may reject _revinclude:iterate outright (e.g. 400): read the root and walk down
+        organizations = {o['id']: o for o in search_all('Organization', {'_id': root_id}, required=True)}
+        if root_id not in organizations:
+            return {}, 'breadth-first'
+        return fetch_breadth_first(organizations, [root_id]), 'breadth-first'
+    # A server that ignores :iterate (or _revinclude) stops after one level (or none). Searching
+    # the children of the deepest level returned either confirms it is complete or walks on
+    deepest = levels(organizations, root_id)[-1]
+    before = len(organizations)
+    fetch_breadth_first(organizations, deepest)
+    return organizations, 'revinclude' if len(organizations) == before else 'breadth-first'
+
+
+def closure_rows(organizations: Dict[str, Dict], root_id: str) -> List[Tuple[str, str, int]]:
+    """(ancestor, descendant, depth) for every pair in the tree, each node its own ancestor at depth 0"""
+    rows = []
+    for org_id in organizations:
+        ancestor, depth, seen = org_id, 0, set()
+        while ancestor in organizations and ancestor not in seen:
+            seen.add(ancestor)
+            rows.append((ancestor, org_id, depth))
+            if ancestor == root_id:
+                break
+            ancestor = parent_id(organizations[ancestor])
+            depth += 1
+    return rows
+
+
+def type_codes(organization: Dict) -> str:
+    return ','.join(coding['code'] for concept in organization.get('type', [])
+                    for coding in concept.get('coding', []) if coding.get('code'))
+
+
+class OrgHierarchy:
+    """
+    Organization trees cached as closure tables
+
+    Usage:
+        hierarchy = OrgHierarchy()
+        hierarchy.load(hospital_id)
+        hierarchy.descendants(hospital_id, type_code='dept')
+        hierarchy.ancestors(department_id)
+    """
+    def __init__(self, path: str = DIRECTORY_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def load(self, root_id: str, refresh: bool = False) -> Optional[Dict]:
+        """
+        Fetch the tree under root_id unless a copy younger than ORG_TREE_MAX_AGE is cached; returns its
+        org_trees row, or None when the root does not exist. A failed fetch raises and caches nothing.
+        """
+        row = self.tree_info(root_id)
+        if row and not refresh and time.time() - row['fetched_at'] < ORG_TREE_MAX_AGE:
+            return row
+
+        sent = []
+
+        def count(method, endpoint, response):
+            sent.append(endpoint)
+        add_request_listener(count)
+        try:
+            organizations, method = fetch_tree(root_id)
+        finally:
+            remove_request_listener(count)
+        if root_id not in organizations:
+            return None
+
+        with self.conn:
+            for table in ('org_trees', 'org_nodes', 'org_closure'):
+                self.conn.execute(f"DELETE FROM {table} WHERE root_id = ?", (root_id,))
+            self.conn.executemany(
+                "INSERT INTO org_nodes (root_id, id, parent, name, types, json) VALUES (?, ?, ?, ?, ?, ?)",
+                ((root_id, org_id, parent_id(o), o.get('name'), type_codes(o), json.dumps(o, ensure_ascii=False))
+                 for org_id, o in organizations.items()))
+            self.conn.executemany(
+                "INSERT INTO org_closure (root_id, ancestor, descendant, depth) VALUES (?, ?, ?, ?)",
+                ((root_id,) + row for row in closure_rows(organizations, root_id)))
+            self.conn.execute(
+                "INSERT INTO org_trees (root_id, fetched_at, nodes, requests, method) VALUES (?, ?, ?, ?, ?)",
+                (root_id, time.time(), len(organizations), len(sent), method))
+        return self.tree_info(root_id)
+
+    def tree_info(self, root_id: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT root_id, fetched_at, nodes, requests, method FROM org_trees WHERE root_id = ?",
+                                (root_id,)).fetchone()
+        return dict(zip(('root_id', 'fetched_at', 'nodes', 'requests', 'method'), row)) if row else None
+
+    def descendants(self, org_id: str, type_code: Optional[str] = None, max_depth: Optional[int] = None) -> List[Dict]:
+        """Organizations below org_id in any cached tree (nearest first), optionally of one type code"""
+        sql = ("SELECT n.id, n.name, n.parent, MIN(c.depth) FROM org_closure c "
+               "JOIN org_nodes n ON n.root_id = c.root_id AND n.id = c.descendant "
+               "WHERE c.ancestor = ? AND c.depth > 0")
+        args: List = [org_id]
+        if max_depth is not None:
+            sql += " AND c.depth <= ?"
+            args.append(max_depth)
+        if type_code:
+            sql += " AND ',' || n.types || ',' LIKE ?"
+            args.append(f'%,{type_code},%')
+        rows = self.conn.execute(sql + " GROUP BY n.id ORDER BY MIN(c.depth), n.name", args)
+        return [dict(zip(('id', 'name', 'parent', 'depth'), row)) for row in rows]
+
+    def ancestors(self, org_id: str) -> List[Dict]:
+        """Path from org_id's parent up to the root of its cached tree"""
+        rows = self.conn.execute(
+            "SELECT n.id, n.name, MIN(c.depth) FROM org_closure c "
+            "JOIN org_nodes n ON n.root_id = c.root_id AND n.id = c.ancestor "
+            "WHERE c.descendant = ? AND c.depth > 0 GROUP BY n.id ORDER BY MIN(c.depth)", (org_id,))
+        return [dict(zip(('id', 'name', 'depth'), row)) for row in rows]
+
+    def organization(self, org_id: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT json FROM org_nodes WHERE id = ? LIMIT 1", (org_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load Organization trees into a local closure table')
+    parser.add_argument('--db', default=DIRECTORY_DB, help=f'Database file (default: {DIRECTORY_DB})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    load = commands.add_parser('load', help='Fetch the tree under a root Organization')
+    load.add_argument('root_id')
+    load.add_argument('--refresh', action='store_true', help=f'Fetch even if cached less than {ORG_TREE_MAX_AGE}s ago')
+    descendants = commands.add_parser('descendants', help='Organizations below one in a cached tree')
+    descendants.add_argument('org_id')
+    descendants.add_argument('--type', dest='type_code', help='Only this Organization.type code (e.g. dept)')
+    descendants.add_argument('--depth', type=int, help='At most this many levels down')
+    ancestors = commands.add_parser('ancestors', help='Path from an Organization up to its root')
+    ancestors.add_argument('org_id')
+    args = parser.parse_args()
+
+    hierarchy = OrgHierarchy(args.db)
+    if args.command == 'load':
+        test_utils.VERBOSE = False
+        start = time.perf_counter()
+        try:
+            info = hierarchy.load(args.root_id, args.refresh)
+        except requests.exceptions.RequestException as e:
+            print(f"{Colors.RED}Could not fetch the tree, nothing cached: {e}{Colors.RESET}")
+            raise SystemExit(1)
+        if info is None:
+            print(f"{Colors.RED}Organization/{args.root_id} not found{Colors.RESET}")
+            raise SystemExit(1)
+        print(f"{Colors.GREEN}{info['nodes']} organization(s){Colors.RESET} with {info['requests']} request(s) "
+              f"({info['method']}, {time.perf_counter() - start:.1f}s)")
+    elif args.command == 'descendants':
+        for org in hierarchy.descendants(args.org_id, args.type_code, args.depth):
+            print(f"  {'  ' * (org['depth'] - 1)}{org['id']}  {org['name'] or ''}")
+    else:
+        for org in hierarchy.ancestors(args.org_id):
+            print(f"  {org['depth']}  {org['id']}  {org['name'] or ''}")
+    hierarchy.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Offline validation of resources against the uz-core profiles
+StructureDefinitions from PROFILE_SOURCES (the uz.dhp.core package and sushi output) are compiled
+once into rule tables - cardinality, fixed/pattern values, required bindings, must-support and
+value/pattern slicing - cached in PROFILE_CACHE_DIR and applied to NDJSON or Bundle files in
+worker processes, so bulk data can be checked before it is submitted.
+
+Usage:
+    python profile_validator.py data/*.ndjson
+    python profile_validator.py bundles/*.json -j 8 --report issues.ndjson
+    python profile_validator.py --from-server data/Patient.ndjson
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from test_utils import Colors, decode_json, make_request
+from config import PROFILE_SOURCES, PROFILE_CACHE_DIR
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Bump when the rule table layout changes so stale caches are recompiled
+RULES_VERSION = 1
+
+# uz-core profiles fetched with --from-server and used for resources without meta.profile
+PROFILE_BASE = 'https://dhp.uz/fhir/core/StructureDefinition/'
+DEFAULT_PROFILES = {
+    'Patient': PROFILE_BASE + 'uz-core-patient',
+    'Organization': PROFILE_BASE + 'uz-core-organization',
+    'Practitioner': PROFILE_BASE + 'uz-core-practitioner',
+    'PractitionerRole': PROFILE_BASE + 'uz-core-practitionerrole',
+}
+
+# NDJSON lines per work unit sent to a worker process
+CHUNK_LINES = 2000
+
+# Severity of rule violations (missing must-support elements are only counted)
+ERROR = 'error'
+
+
+def source_dirs() -> List[str]:
+    dirs = []
+    for entry in PROFILE_SOURCES.split(','):
+        path = os.path.expanduser(entry.strip())
+        if path and not os.path.isabs(path):
+            path = os.path.join(TESTS_DIR, path)
+        if os.path.isdir(path):
+            dirs.append(path)
+    fetched = os.path.join(PROFILE_CACHE_DIR, 'definitions')
+    if os.path.isdir(fetched):
+        dirs.append(fetched)
+    return dirs
+
+
+def load_definitions(dirs: List[str]) -> Dict[str, Dict[str, Dict]]:
+    """StructureDefinition, ValueSet and CodeSystem resources by type and canonical url"""
+    definitions: Dict[str, Dict[str, Dict]] = {'StructureDefinition': {}, 'ValueSet': {}, 'CodeSystem': {}}
+    for directory in dirs:
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            try:
+                with open(path, 'rb') as f:
+                    resource = decode_json(f.read())
+            except (OSError, ValueError):
+                continue
+            if not isinstance(resource, dict):
+                continue
+            by_url = definitions.get(resource.get('resourceType'))
+            if by_url is not None and resource.get('url'):
+                by_url.setdefault(resource['url'], resource)
+    return definitions
+
+
+def fetch_definitions(urls: List[str]) -> int:
+    """Download StructureDefinitions by canonical url into the cache so later runs are offline"""
+    directory = os.path.join(PROFILE_CACHE_DIR, 'definitions')
+    os.makedirs(directory, exist_ok=True)
+    fetched = 0
+    for url in urls:
+        response = make_request('GET', '/StructureDefinition', params={'url': url})
+        if response.status_code != 200:
+            continue
+        for entry in response.json().get('entry', []):
+            resource = entry.get('resource', {})
+            if resource.get('resourceType') == 'StructureDefinition':
+                with open(os.path.join(directory, f"StructureDefinition-{resource.get('id', fetched)}.json"), 'w',
+                          encoding='utf-8') as f:
+                    json.dump(resource, f)
+                fetched += 1
+    return fetched
+
+
+def _value_of(element: Dict, prefix: str) -> Any:
+    """The fixed[x] or pattern[x] value of an element definition"""
+    for key, value in element.items():
+        if key.startswith(prefix) and key[len(prefix):len(prefix) + 1].isupper():
+            return value
+    return None
+
+
+def _flatten_concepts(system: str, concepts: List[Dict], codes: Set[Tuple[str, str]]):
+    for concept in concepts:
+        codes.add((system, concept.get('code')))
+        _flatten_concepts(system, concept.get('concept', []), codes)
+
+
+def expand_value_set(url: str, definitions: Dict[str, Dict[str, Dict]],
+                     use_server: bool = False) -> Optional[frozenset]:
+    """
+    Codes of a value set as (system, code) pairs, from its local expansion or enumerated compose,
+    falling back to the server's $expand; None when it cannot be resolved
+    """
+    value_set = definitions['ValueSet'].get(url.split('|')[0])
+    codes: Set[Tuple[str, str]] = set()
+    if value_set:
+        contains = value_set.get('expansion', {}).get('contains')
+        if contains:
+            stack = list(contains)
+            while stack:
+                item = stack.pop()
+                codes.add((item.get('system'), item.get('code')))
+                stack.extend(item.get('contains', []))
+            return frozenset(codes)
+        resolved = True
+        for include in value_set.get('compose', {}).get('include', []):
+            system = include.get('system')
+            if include.get('concept'):
+                codes.update((system, c.get('code')) for c in include['concept'])
+            elif system and not include.get('filter') and not include.get('valueSet') \
+                    and system in definitions['CodeSystem']:
+                _flatten_concepts(system, definitions['CodeSystem'][system].get('concept', []), codes)
+            else:
+                resolved = False
+        if resolved and codes:
+            return frozenset(codes)
+    if use_server:
+        response = make_request('GET', '/ValueSet/$expand', params={'url': url, 'count': '10000'})
+        if response.status_code == 200:
+            contains = response.json().get('expansion', {}).get('contains', [])
+            return frozenset((item.get('system'), item.get('code')) for item in contains)
+    return None
+
+
+def _new_node(name: str) -> Dict:
+    return {'name': name, 'min': 0, 'max': None, 'fixed': None, 'pattern': None, 'binding': None,
+            'ms': False, 'discriminators': None, 'type_profile': None, 'children': {}, 'slices': {}}
+
+
+def compile_profile(structure: Dict, definitions: Dict[str, Dict[str, Dict]], use_server: bool,
+                    unresolved: Set[str]) -> Dict:
+    """
+    Turn a StructureDefinition (snapshot, or differential when there is none) into a rule tree:
+    one node per element id, with value-set bindings already expanded to code sets
+    """
+    elements = structure.get('snapshot', {}).get('element') or structure.get('differential', {}).get('element', [])
+    root = _new_node(structure.get('type'))
+    nodes = {structure.get('type'): root}
+
+    def node_for(element_id: str) -> Dict:
+        # A differential may skip ancestors (Patient.address.country without Patient.address)
+        if element_id not in nodes:
+            parent_id, _, last = element_id.rpartition('.')
+            parent = node_for(parent_id) if parent_id else root
+            name, _, slice_name = last.partition(':')
+            node = parent['children'].setdefault(name, _new_node(name))
+            if slice_name:
+                # A slice hangs off its unsliced element, e.g. identifier:pinfl under identifier
+                node = node['slices'].setdefault(slice_name, _new_node(name))
+            nodes[element_id] = node
+        return nodes[element_id]
+
+    for element in elements:
+        node = node_for(element.get('id') or element.get('path'))
+        if 'min' in element:
+            node['min'] = element['min']
+        if 'max' in element:
+            node['max'] = None if element['max'] == '*' else int(element['max'])
+        node['fixed'] = _value_of(element, 'fixed') if node['fixed'] is None else node['fixed']
+        node['pattern'] = _value_of(element, 'pattern') if node['pattern'] is None else node['pattern']
+        node['ms'] = node['ms'] or element.get('mustSupport', False)
+        slicing = element.get('slicing')
+        if slicing:
+            node['discriminators'] = [(d.get('type'), d.get('path')) for d in slicing.get('discriminator', [])]
+        profiles = [p for t in element.get('type', []) for p in t.get('profile', [])]
+        if profiles:
+            node['type_profile'] = profiles[0]
+        binding = element.get('binding', {})
+        if binding.get('strength') == 'required' and binding.get('valueSet'):
+            codes = expand_value_set(binding['valueSet'], definitions, use_server)
+            if codes is None:
+                unresolved.add(binding['valueSet'])
+            else:
+                node['binding'] = codes
+    _prune(root)
+    return root
+
+
+def _prune(node: Dict) -> bool:
+    """Drop nodes that constrain nothing; returns whether the node is kept"""
+    node['children'] = {name: child for name, child in node['children'].items() if _prune(child)}
+    # Slices are always kept: their cardinality is a constraint even without child rules
+    for child in node['slices'].values():
+        _prune(child)
+    return bool(node['min'] or node['max'] is not None or node['fixed'] is not None or node['pattern'] is not None
+                or node['binding'] or node['ms'] or node['slices'] or node['children'])
+
+
+def compile_rules(use_server: bool = False, verbose: bool = True) -> Dict[str, Any]:
+    """
+    Compile every constraint profile in the sources, reusing the cached rule table when
+    no source file changed. Returns {'profiles': {url: tree}, 'types': {url: type}, 'unresolved': [...]}
+    """
+    dirs = source_dirs()
+    fingerprint = hashlib.sha256(f"{RULES_VERSION}|{use_server}".encode())
+    for directory in dirs:
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            stat = os.stat(path)
+            fingerprint.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    cache_path = os.path.join(PROFILE_CACHE_DIR, f"rules-{fingerprint.hexdigest()[:16]}.pickle")
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            rules = pickle.load(f)
+        rules['cache_path'] = cache_path
+        return rules
+
+    start = time.perf_counter()
+    definitions = load_definitions(dirs)
+    unresolved: Set[str] = set()
+    profiles, types = {}, {}
+    for url, structure in definitions['StructureDefinition'].items():
+        if structure.get('kind') == 'resource' and structure.get('derivation') == 'constraint':
+            profiles[url] = compile_profile(structure, definitions, use_server, unresolved)
+            types[url] = structure.get('type')
+    rules = {'profiles': profiles, 'types': types, 'unresolved': sorted(unresolved), 'sources': dirs}
+    os.makedirs(PROFILE_CACHE_DIR, exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        pickle.dump(rules, f, protocol=pickle.HIGHEST_PROTOCOL)
+    rules['cache_path'] = cache_path
+    if verbose:
+        print(f"{Colors.CYAN}Compiled {len(profiles)} profile(s) in {time.perf_counter() - start:.2f}s "
+              f"→ {cache_path}{Colors.RESET}")
+    return rules
+
+
+def _children(value: Any, name: str) -> List[Any]:
+    """Values of a child element; 'value[x]' matches valueString, valueCoding, ..."""
+    if not isinstance(value, dict):
+        return []
+    if name.endswith('[x]'):
+        prefix = name[:-3]
+        found = [v for k, v in value.items() if k.startswith(prefix) and k[len(prefix):len(prefix) + 1].isupper()]
+        return found[0] if found and isinstance(found[0], list) else found
+    child = value.get(name)
+    if child is None:
+        return []
+    return child if isinstance(child, list) else [child]
+
+
+def matches_pattern(value: Any, pattern: Any) -> bool:
+    """FHIR pattern[x] semantics: every field in the pattern is present in the value, lists match item-wise"""
+    if isinstance(pattern, dict):
+        return isinstance(value, dict) and all(matches_pattern(value.get(k), v) for k, v in pattern.items())
+    if isinstance(pattern, list):
+        return isinstance(value, list) and all(any(matches_pattern(item, p) for item in value) for p in pattern)
+    return value == pattern
+
+
+def in_value_set(value: Any, codes: frozenset) -> bool:
+    """A code, Coding or CodeableConcept (at least one coding) from the bound value set"""
+    if isinstance(value, str):
+        return any(code == value for _, code in codes)
+    if isinstance(value, dict):
+        if 'coding' in value:
+            return any(in_value_set(coding, codes) for coding in value['coding'])
+        if 'code' in value:
+            return (value.get('system'), value['code']) in codes
+        return True  # e.g. a CodeableConcept with text only
+    return True
+
+
+def _discriminator_values(slice_node: Dict, path: str) -> List[Tuple[str, Any]]:
+    """The ('fixed'|'pattern', value) a slice requires at a discriminator path"""
+    if path == 'url' and not any('url' == n for n in slice_node['children']) and slice_node['type_profile']:
+        return [('fixed', slice_node['type_profile'])]
+    node = slice_node
+    if path != '$this':
+        for name in path.split('.'):
+            node = node['children'].get(name)
+            if node is None:
+                return []
+    if node['fixed'] is not None:
+        return [('fixed', node['fixed'])]
+    if node['pattern'] is not None:
+        return [('pattern', node['pattern'])]
+    return []
+
+
+def _select_slice(values: List[Any], slice_node: Dict, discriminators: List[Tuple[str, str]]) -> Optional[List[Any]]:
+    """Items belonging to a slice, or None when the discriminators cannot be evaluated offline"""
+    tests = []
+    for kind, path in discriminators:
+        if kind not in ('value', 'pattern'):
+            return None
+        required = _discriminator_values(slice_node, path)
+        if not required:
+            return None
+        tests.append((path, required[0]))
+    selected = []
+    for item in values:
+        ok = True
+        for path, (kind, expected) in tests:
+            found = [item]
+            if path != '$this':
+                for name in path.split('.'):
+                    found = [child for value in found for child in _children(value, name)]
+            if kind == 'fixed':
+                ok = any(v == expected for v in found)
+            else:
+                ok = any(matches_pattern(v, expected) for v in found)
+            if not ok:
+                break
+        if ok:
+            selected.append(item)
+    return selected
+
+
+def _check(node: Dict, values: List[Any], location: str, issues: List[Tuple[str, str, str]],
+           missing_ms: Counter):
+    if len(values) < node['min']:
+        issues.append((ERROR, location, f"minimum cardinality {node['min']}, found {len(values)}"))
+    if node['max'] is not None and len(values) > node['max']:
+        issues.append((ERROR, location, f"maximum cardinality {node['max']}, found {len(values)}"))
+    for value in values:
+        if node['fixed'] is not None and value != node['fixed']:
+            issues.append((ERROR, location, f"value must be {json.dumps(node['fixed'], ensure_ascii=False)}"))
+        if node['pattern'] is not None and not matches_pattern(value, node['pattern']):
+            issues.append((ERROR, location, f"value must match {json.dumps(node['pattern'], ensure_ascii=False)}"))
+        if node['binding'] and not in_value_set(value, node['binding']):
+            issues.append((ERROR, location, "code is not in the required value set"))
+        for name, child in node['children'].items():
+            child_values = _children(value, name)
+            if child['ms'] and not child_values:
+                missing_ms[f"{location}.{name}"] += 1
+            _check(child, child_values, f"{location}.{name}", issues, missing_ms)
+    if node['slices'] and values:
+        for slice_name, slice_node in node['slices'].items():
+            selected = _select_slice(values, slice_node, node['discriminators'] or [])
+            if selected is not None:
+                _check(slice_node, selected, f"{location}:{slice_name}", issues, missing_ms)
+
+
+def validate_resource(resource: Dict, rules: Dict[str, Any], missing_ms: Optional[Counter] = None
+                      ) -> Tuple[Optional[str], List[Tuple[str, str, str]]]:
+    """
+    Validate one resource against its meta.profile (or the default uz-core profile for its type).
+    Returns (profile url or None if no compiled profile applies, [(severity, element, message)])
+    """
+    missing_ms = missing_ms if missing_ms is not None else Counter()
+    resource_type = resource.get('resourceType')
+    candidates = resource.get('meta', {}).get('profile', []) + [DEFAULT_PROFILES.get(resource_type)]
+    for url in candidates:
+        tree = rules['profiles'].get((url or '').split('|')[0])
+        if tree is not None:
+            break
+    else:
+        return None, []
+    issues: List[Tuple[str, str, str]] = []
+    if rules['types'][url.split('|')[0]] != resource_type:
+        issues.append((ERROR, resource_type, f"profile {url} is for {rules['types'][url.split('|')[0]]}"))
+        return url, issues
+    for name, child in tree['children'].items():
+        values = _children(resource, name)
+        if child['ms'] and not values:
+            missing_ms[f"{resource_type}.{name}"] += 1
+        _check(child, values, f"{resource_type}.{name}", issues, missing_ms)
+    return url, issues
+
+
+# Rule table of a worker process, loaded once by the pool initializer
+_worker_rules: Dict[str, Any] = {}
+
+
+def _init_worker(cache_path: str):
+    with open(cache_path, 'rb') as f:
+        _worker_rules.update(pickle.load(f))
+
+
+def _validate_chunk(chunk: Tuple[str, Any]) -> Dict[str, Any]:
+    """Validate a work unit: ('lines', [(source, ndjson line)]) or ('bundle', path)"""
+    kind, payload = chunk
+    if kind == 'bundle':
+        with open(payload, 'rb') as f:
+            bundle = decode_json(f.read())
+        items = [(f"{payload}#{i}", entry.get('resource', {})) for i, entry in enumerate(bundle.get('entry', []))] \
+            if bundle.get('resourceType') == 'Bundle' else [(payload, bundle)]
+    else:
+        items = []
+        for source, line in payload:
+            try:
+                items.append((source, decode_json(line)))
+            except ValueError as e:
+                items.append((source, {'resourceType': None, '_parse_error': str(e)}))
+
+    result = {'count': 0, 'invalid': 0, 'unprofiled': Counter(), 'issues': [], 'missing_ms': Counter(),
+              'by_profile': Counter()}
+    for source, resource in items:
+        result['count'] += 1
+        if '_parse_error' in resource:
+            result['invalid'] += 1
+            result['issues'].append((source, None, ERROR, '', f"invalid JSON: {resource['_parse_error']}"))
+            continue
+        url, issues = validate_resource(resource, _worker_rules, result['missing_ms'])
+        if url is None:
+            result['unprofiled'][resource.get('resourceType')] += 1
+            continue
+        result['by_profile'][url] += 1
+        if any(severity == ERROR for severity, _, _ in issues):
+            result['invalid'] += 1
+        resource_ref = f"{resource.get('resourceType')}/{resource.get('id', '?')}"
+        result['issues'].extend((source, resource_ref, severity, element, message)
+                                for severity, element, message in issues)
+    return result
+
+
+def work_units(paths: List[str]) -> Iterator[Tuple[str, Any]]:
+    """NDJSON files in chunks of CHUNK_LINES lines; other JSON files whole"""
+    for path in paths:
+        if not path.endswith('.ndjson'):
+            yield 'bundle', path
+            continue
+        chunk = []
+        with open(path, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    chunk.append((f"{path}:{number}", line))
+                if len(chunk) >= CHUNK_LINES:
+                    yield 'lines', chunk
+                    chunk = []
+        if chunk:
+            yield 'lines', chunk
+
+
+def validate_files(paths: List[str], rules: Dict[str, Any], workers: int = 1) -> Iterator[Dict[str, Any]]:
+    """Validate files with a pool of worker processes, each loading the cached rule table once"""
+    if workers <= 1:
+        _init_worker(rules['cache_path'])
+        for unit in work_units(paths):
+            yield _validate_chunk(unit)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(rules['cache_path'],)) as executor:
+        # Keep a bounded number of chunks in flight so large files are streamed
+        pending = []
+        for unit in work_units(paths):
+            pending.append(executor.submit(_validate_chunk, unit))
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate resources offline against the uz-core profiles')
+    parser.add_argument('files', nargs='+', help='NDJSON files, Bundles or single resources (JSON)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--report', metavar='FILE', help='Write every issue to FILE as NDJSON')
+    parser.add_argument('--from-server', action='store_true',
+                        help='Fetch missing uz-core profiles and unresolved value sets from FHIR_BASE_URL while compiling')
+    parser.add_argument('--show', type=int, default=20, help='Number of issues to print (default: 20)')
+    args = parser.parse_args()
+
+    if args.from_server:
+        fetch_definitions(list(DEFAULT_PROFILES.values()))
+    rules = compile_rules(use_server=args.from_server)
+    if not rules['profiles']:
+        print(f"{Colors.RED}No profiles found in {PROFILE_SOURCES} - run sushi, "
+              f"set PROFILE_SOURCES or use --from-server{Colors.RESET}")
+        sys.exit(2)
+    if rules['unresolved']:
+        print(f"{Colors.YELLOW}Required bindings not checked (value set not available offline): "
+              f"{', '.join(rules['unresolved'])}{Colors.RESET}")
+
+    start = time.perf_counter()
+    totals = {'count': 0, 'invalid': 0}
+    unprofiled, missing_ms, by_profile, messages = Counter(), Counter(), Counter(), Counter()
+    shown = []
+    report = open(args.report, 'w', encoding='utf-8') if args.report else None
+    try:
+        for result in validate_files(args.files, rules, args.workers):
+            totals['count'] += result['count']
+            totals['invalid'] += result['invalid']
+            unprofiled.update(result['unprofiled'])
+            missing_ms.update(result['missing_ms'])
+            by_profile.update(result['by_profile'])
+            for source, resource_ref, severity, element, message in result['issues']:
+                messages[(element, message)] += 1
+                if len(shown) < args.show:
+                    shown.append((source, resource_ref, element, message))
+                if report:
+                    report.write(json.dumps({'source': source, 'resource': resource_ref, 'severity': severity,
+                                             'element': element, 'message': message}, ensure_ascii=False) + '\n')
+    finally:
+        if report:
+            report.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{Colors.BOLD}Profile Validation{Colors.RESET}")
+    print(f"{'='*60}")
+    for url, count in by_profile.most_common():
+        print(f"  {url:<56} {count}")
+    for resource_type, count in unprofiled.items():
+        print(f"  {Colors.YELLOW}{resource_type}: {count} without a compiled profile (not checked){Colors.RESET}")
+
+    if messages:
+        print(f"\n{Colors.BOLD}Most frequent issues{Colors.RESET}")
+        for (element, message), count in messages.most_common(10):
+            print(f"  {count:>7}  {element} - {message}")
+        print(f"\n{Colors.BOLD}First issues{Colors.RESET}")
+        for source, resource_ref, element, message in shown:
+            print(f"  {Colors.RED}✗{Colors.RESET} {source} {resource_ref or ''} {element} - {message}")
+
+    if missing_ms:
+        print(f"\n{Colors.BOLD}Must-support elements missing{Colors.RESET}")
+        for element, count in missing_ms.most_common(10):
+            print(f"  {count:>7}  {element}")
+
+    valid = totals['count'] - totals['invalid']
+    color = Colors.GREEN if totals['invalid'] == 0 else Colors.RED
+    print(f"\n{color}{valid}/{totals['count']} valid{Colors.RESET} in {elapsed:.1f}s "
+          f"({totals['count'] / max(elapsed, 1e-9):,.0f} resources/s, {args.workers} worker(s))")
+    sys.exit(1 if totals['invalid'] else 0)
+
+
+if __name__ == '__main__':
+    main()
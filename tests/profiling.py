@@ -0,0 +1,165 @@
+"""
+Profiling hooks for the test runner (--profile)
+Writes one cProfile .pstats file per scenario, a merged collapsed-stack file for flamegraph
+tools, and reports how wall time splits into network wait, JSON decoding and output formatting
+"""
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List
+from test_utils import Colors, phase_timer
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+
+class StackSampler:
+    """
+    Samples the stacks of all threads running test code and counts them in collapsed form
+    ('root;file.py:func;file.py:func'). Unlike cProfile it also sees -j worker threads.
+    """
+    def __init__(self, root: str, interval: float = SAMPLE_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"sampler-{root}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                in_tests = False
+                while frame is not None:
+                    code = frame.f_code
+                    in_tests = in_tests or code.co_filename.startswith(TESTS_DIR)
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                # Idle pool threads and the sampler's neighbours never enter test code
+                if in_tests:
+                    frames.append(self.root)
+                    self.counts[';'.join(reversed(frames))] += 1
+
+
+class Profiler:
+    """
+    Profiles scenarios one at a time
+
+    Usage:
+        profiler = Profiler('profile')
+        with profiler.profile('patient'):
+            run_patient_tests()
+        profiler.write_stacks()
+        profiler.print_summary()
+    """
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.stacks: Counter = Counter()
+        self.files: List[str] = []
+        phase_timer.enabled = True
+
+    @contextmanager
+    def profile(self, key: str):
+        """Run the block under cProfile and the stack sampler; stats go to <output_dir>/<key>.pstats"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        profile = cProfile.Profile()
+        sampler = StackSampler(key)
+        sampler.start()
+        try:
+            with phase_timer.scope(key):
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+        finally:
+            sampler.stop()
+            path = os.path.join(self.output_dir, f"{key}.pstats")
+            profile.dump_stats(path)
+            self.files.append(path)
+            self.stacks.update(sampler.counts)
+
+    def write_stacks(self) -> str:
+        """Write the samples of all scenarios as one collapsed-stack file"""
+        path = os.path.join(self.output_dir, 'stacks.collapsed')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        self.files.append(path)
+        return path
+
+    def phase_rows(self) -> Dict[str, Dict[str, float]]:
+        """Wall time and phase totals per scope; scenario rows include their checks"""
+        rows = {}
+        for scope, wall in phase_timer.wall.items():
+            rows[scope] = {'wall': wall}
+        for scope, totals in phase_timer.totals.items():
+            targets = [scope]
+            if '/' in scope:
+                targets.append(scope.split('/', 1)[0])
+            for target in targets:
+                row = rows.setdefault(target, {'wall': 0.0})
+                for phase, elapsed in totals.items():
+                    row[phase] = row.get(phase, 0.0) + elapsed
+        for row in rows.values():
+            spent = sum(row.get(phase, 0.0) for phase in phase_timer.PHASES)
+            row['other'] = max(row['wall'] - spent, 0.0)
+        return rows
+
+    def write_phases(self, rows: Dict[str, Dict[str, float]]) -> str:
+        """Write the phase split as CSV (seconds)"""
+        path = os.path.join(self.output_dir, 'phases.csv')
+        columns = ('wall',) + phase_timer.PHASES + ('other',)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('scope,' + ','.join(columns) + '\n')
+            for scope, row in rows.items():
+                name = scope.replace('"', '""')
+                f.write(f'"{name}",' + ','.join(f"{row.get(c, 0.0):.6f}" for c in columns) + '\n')
+        self.files.append(path)
+        return path
+
+    def print_summary(self, top: int = 10):
+        """Print the phase split per scenario and for the slowest checks, then the files written"""
+        rows = self.phase_rows()
+        self.write_phases(rows)
+
+        def print_row(label, row):
+            print(f"  {label[:44]:<44} {row['wall']:>7.3f} {row.get('network', 0.0):>8.3f} "
+                  f"{row.get('json_decode', 0.0):>8.3f} {row.get('formatting', 0.0):>8.3f} {row['other']:>7.3f}")
+
+        header = f"  {'':<44} {'Wall':>7} {'Network':>8} {'JSON':>8} {'Format':>8} {'Other':>7}"
+        scenarios = [scope for scope in rows if '/' not in scope]
+        checks = sorted((scope for scope in rows if '/' in scope), key=lambda s: rows[s]['wall'], reverse=True)
+
+        print(f"\n{Colors.BOLD}Profile (seconds){Colors.RESET}")
+        print(f"{'='*60}")
+        print(header)
+        for scope in scenarios:
+            print_row(scope, rows[scope])
+
+        if checks:
+            print(f"\n{Colors.BOLD}Slowest checks{Colors.RESET}")
+            print(header)
+            for scope in checks[:top]:
+                print_row(scope, rows[scope])
+
+        print(f"\n{Colors.CYAN}Phases overlap when checks run with -j, so 'Other' is only exact for -j 1. "
+              f"cProfile only sees the main thread; stacks.collapsed covers all threads.{Colors.RESET}")
+        print(f"\n{Colors.BOLD}Profile files:{Colors.RESET}")
+        for path in self.files:
+            print(f"  {path}")
@@ -0,0 +1,253 @@
+"""
+Redundant-request detector (--detect-redundant / DETECT_REDUNDANT)
+Fingerprints every request made through make_request (method, path relative to BASE_URL,
+sorted query parameters) and reports, per scenario:
+- duplicate GETs: the same fingerprint again with no write to that resource type in between
+- refetches: a read, or a search by _id/url/identifier, of a resource an earlier request already
+  returned in full (and that was not written since), e.g. a search by canonical URL right after
+  the search that found it
+- sibling reads: several GET Type/id reads in a row in one check that one _id search could batch
+
+Usage outside the runner:
+    with RedundancyDetector() as detector:
+        ...integration code...
+    detector.print_report()
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from test_utils import Colors, FHIRResponse, add_request_listener, remove_request_listener
+from checks import current_check
+from config import BASE_URL
+
+# Instance reads of one type in a row (within one check) reported as batchable
+MIN_SIBLING_READS = 3
+
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+class RequestRecord(NamedTuple):
+    index: int
+    scenario: str
+    check: str
+    method: str
+    path: str
+    fingerprint: str
+    latency_ms: float
+
+
+class Finding(NamedTuple):
+    kind: str
+    scenario: str
+    message: str
+    wasted: int
+    wasted_ms: float
+
+
+def normalize_path(url: str) -> str:
+    path = urlsplit(url).path
+    base_path = urlsplit(BASE_URL).path.rstrip('/')
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    return path.rstrip('/') or '/'
+
+
+def fingerprint(method: str, url: str) -> str:
+    """'METHOD /path?sorted=params' of a request URL"""
+    params = sorted(parse_qsl(urlsplit(url).query, keep_blank_values=True))
+    path = normalize_path(url)
+    return f"{method} {path}?{urlencode(params)}" if params else f"{method} {path}"
+
+
+def instance_key(path: str) -> Optional[Tuple[str, str]]:
+    """(type, id) of a /Type/id path (not operations or history)"""
+    parts = path.strip('/').split('/')
+    if len(parts) == 2 and parts[0][:1].isupper() and not parts[1].startswith(('$', '_')):
+        return parts[0], parts[1]
+    return None
+
+
+# Search parameters that name one resource; a search by these for a resource already received is a refetch
+IDENTITY_PARAMS = {'_id', 'url', 'identifier'}
+
+# Parameters that do not change which resources a search returns
+PAGING_PARAMS = {'_count', '_format', '_pretty', '_total', '_sort'}
+
+
+def returned_resources(response: FHIRResponse, url: str) -> List[Dict]:
+    """The complete resources in a response; partial (_summary/_elements) ones are left out"""
+    query = dict(parse_qsl(urlsplit(url).query))
+    if '_summary' in query or '_elements' in query or response.status_code != 200:
+        return []
+    try:
+        body = response.json()
+    except Exception:
+        return []
+    if not isinstance(body, dict):
+        return []
+    if body.get('resourceType') == 'Bundle':
+        resources = [e['resource'] for e in body.get('entry', []) if isinstance(e.get('resource'), dict)]
+    else:
+        resources = [body]
+    return [r for r in resources if r.get('id') and r.get('resourceType')
+            and not any(tag.get('code') == 'SUBSETTED' for tag in r.get('meta', {}).get('tag', []))]
+
+
+def identities(resource: Dict) -> List[Tuple[str, str]]:
+    """(search parameter, value) pairs that find exactly this resource"""
+    found = [('_id', resource['id'])]
+    if resource.get('url'):
+        found.append(('url', resource['url']))
+    for identifier in resource.get('identifier', []) if isinstance(resource.get('identifier'), list) else []:
+        if identifier.get('value'):
+            found.append(('identifier', identifier['value']))
+            if identifier.get('system'):
+                found.append(('identifier', f"{identifier['system']}|{identifier['value']}"))
+    return found
+
+
+class RedundancyDetector:
+    """Request listener that finds duplicate, refetching and batchable requests"""
+    def __init__(self):
+        self.records: List[RequestRecord] = []
+        self.findings: List[Finding] = []
+        self._lock = threading.Lock()
+        # Writes bump the generation of their resource type (and '' for batches), invalidating earlier GETs
+        self._generation: Dict[str, int] = {}
+        self._gets: Dict[str, Tuple[RequestRecord, Tuple[int, int], int]] = {}
+        # (type, identity parameter, value) -> (id, request) of every complete resource received
+        self._seen: Dict[Tuple[str, str, str], Tuple[str, RequestRecord]] = {}
+        # check -> (type, [records]) of the current run of instance reads
+        self._reads: Dict[Tuple[str, str], Tuple[str, List[RequestRecord]]] = OrderedDict()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        add_request_listener(self.record)
+
+    def stop(self):
+        remove_request_listener(self.record)
+        with self._lock:
+            for key in list(self._reads):
+                self._close_reads(key)
+
+    def _generation_of(self, resource_type: str) -> Tuple[int, int]:
+        return self._generation.get(resource_type, 0), self._generation.get('', 0)
+
+    def record(self, method: str, endpoint: str, response: FHIRResponse):
+        check = current_check.get()
+        url = response.url
+        with self._lock:
+            record = RequestRecord(len(self.records), check.scenario if check else '', check.name if check else '',
+                                   method, normalize_path(url), fingerprint(method, url), response.latency_ms)
+            self.records.append(record)
+            if method in WRITE_METHODS and '$' not in record.path:
+                self._write(record)
+            elif method == 'GET':
+                self._read(record, response, url)
+
+    def _write(self, record: RequestRecord):
+        parts = record.path.strip('/').split('/')
+        if record.path == '/':
+            # Batch/transaction: anything may have changed
+            self._generation[''] = self._generation.get('', 0) + 1
+            self._seen.clear()
+            return
+        resource_type = parts[0]
+        self._generation[resource_type] = self._generation.get(resource_type, 0) + 1
+        key = instance_key(record.path)
+        if key:
+            # The resource changed: reading it again is no longer redundant
+            for seen in [k for k, (resource_id, _) in self._seen.items() if k[0] == key[0] and resource_id == key[1]]:
+                del self._seen[seen]
+
+    def _read(self, record: RequestRecord, response: FHIRResponse, url: str):
+        resource_type = record.path.strip('/').split('/')[0]
+        generation = self._generation_of(resource_type)
+        previous = self._gets.get(record.fingerprint)
+        if previous and previous[1] == generation and response.status_code == previous[2]:
+            first = previous[0]
+            self.findings.append(Finding(
+                'duplicate', record.scenario,
+                f"{record.fingerprint} repeated in \"{record.check or 'outside checks'}\" "
+                f"(first in \"{first.check or 'outside checks'}\")", 1, record.latency_ms))
+        else:
+            self._gets[record.fingerprint] = (record, generation, response.status_code)
+            source = self._refetched(record, resource_type, url)
+            if source:
+                kind = 'search-then-read' if instance_key(record.path) else 'search by identity'
+                self.findings.append(Finding(
+                    kind, record.scenario,
+                    f"{record.fingerprint} in \"{record.check or 'outside checks'}\" asked for a resource "
+                    f"{source.fingerprint} had already returned", 1, record.latency_ms))
+            for resource in returned_resources(response, url):
+                for param, value in identities(resource):
+                    self._seen[(resource['resourceType'], param, value)] = (resource['id'], record)
+
+        # Runs of instance reads of one type within a check
+        key = (record.scenario, record.check)
+        instance = instance_key(record.path)
+        run = self._reads.get(key)
+        if instance and run and run[0] == instance[0]:
+            run[1].append(record)
+            return
+        self._close_reads(key)
+        if instance:
+            self._reads[key] = (instance[0], [record])
+
+    def _refetched(self, record: RequestRecord, resource_type: str, url: str) -> Optional[RequestRecord]:
+        """The earlier request that returned the resource this read or identity search names, if any"""
+        instance = instance_key(record.path)
+        if instance:
+            earlier = self._seen.get((instance[0], '_id', instance[1]))
+        else:
+            if '$' in record.path or '/' in record.path.strip('/'):
+                return None
+            params = [(k, v) for k, v in parse_qsl(urlsplit(url).query) if k not in PAGING_PARAMS]
+            if not params or any(k not in IDENTITY_PARAMS or ',' in v for k, v in params):
+                return None
+            # Every identity parameter has to name the same resource already received
+            found = {self._seen.get((resource_type, k, v)) for k, v in params}
+            earlier = found.pop() if len(found) == 1 else None
+        return earlier[1] if earlier else None
+
+    def _close_reads(self, key: Tuple[str, str]):
+        run = self._reads.pop(key, None)
+        if not run:
+            return
+        resource_type, reads = run
+        ids = {instance_key(r.path)[1] for r in reads}
+        if len(ids) >= MIN_SIBLING_READS:
+            self.findings.append(Finding(
+                'sibling reads', reads[0].scenario,
+                f"{len(reads)} GET /{resource_type}/<id> in a row in \"{reads[0].check or 'outside checks'}\" "
+                f"could be one GET /{resource_type}?_id=<{len(ids)} ids>", len(reads) - 1,
+                sum(r.latency_ms for r in reads[1:])))
+
+    def scenario_findings(self, scenario: Optional[str] = None) -> List[Finding]:
+        with self._lock:
+            for key in [k for k in self._reads if scenario is None or k[0] == scenario]:
+                self._close_reads(key)
+            return [f for f in self.findings if scenario is None or f.scenario == scenario]
+
+    def print_report(self, scenario: Optional[str] = None):
+        findings = self.scenario_findings(scenario)
+        requests = [r for r in self.records if scenario is None or r.scenario == scenario]
+        title = f"Redundant Requests ({scenario})" if scenario else "Redundant Requests"
+        print(f"\n{Colors.BOLD}{title}{Colors.RESET}")
+        print(f"{'='*60}")
+        if not findings:
+            print(f"{Colors.GREEN}None found in {len(requests)} request(s){Colors.RESET}")
+            return
+        for finding in findings:
+            print(f"  {Colors.YELLOW}{finding.kind:<16}{Colors.RESET} {finding.message}")
+        wasted = sum(f.wasted for f in findings)
+        wasted_ms = sum(f.wasted_ms for f in findings)
+        print(f"{Colors.YELLOW}{wasted} of {len(requests)} request(s) avoidable ({wasted_ms:.0f} ms){Colors.RESET}")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Bulk reference resolver with a per-run identity map
+Instead of one read per reference, resolve() collects every unresolved reference of a page of
+resources and fetches them with one _id=a,b,c search per resource type (chunked so the URL stays
+under MAX_URL_LENGTH). Resources that arrive through _include are added to the same map, so
+nothing already fetched in the run is requested again.
+
+Usage:
+    python references.py PractitionerRole --count 500    # render a roster, counting requests
+"""
+import argparse
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+import test_utils
+from test_utils import Colors, search_all, search_resources, add_request_listener, remove_request_listener
+from config import BASE_URL
+
+# Longest search URL sent; many proxies reject request lines beyond 2-8 KB
+MAX_URL_LENGTH = 2000
+
+Key = Tuple[str, str]
+
+
+def parse_reference(reference: Optional[str]) -> Optional[Key]:
+    """(type, id) of a literal reference to this server, or None (contained, urn:uuid, other servers)"""
+    if not reference or reference.startswith('#') or reference.startswith('urn:'):
+        return None
+    if '://' in reference:
+        if not reference.startswith(BASE_URL + '/'):
+            return None
+        reference = reference[len(BASE_URL) + 1:]
+    parts = reference.split('/')
+    # Type/id or Type/id/_history/vid
+    if len(parts) not in (2, 4) or not parts[0][:1].isupper():
+        return None
+    return parts[0], parts[1]
+
+
+def find_references(value, paths: Optional[Set[str]] = None, path: str = '') -> Iterator[Key]:
+    """References anywhere in a resource, or only at the given element paths (e.g. {'practitioner'})"""
+    if isinstance(value, dict):
+        if 'reference' in value and (paths is None or path in paths):
+            key = parse_reference(value['reference'])
+            if key:
+                yield key
+        for name, child in value.items():
+            if name not in ('reference', 'contained'):
+                yield from find_references(child, paths, f'{path}.{name}' if path else name)
+    elif isinstance(value, list):
+        for item in value:
+            yield from find_references(item, paths, path)
+
+
+def id_chunks(resource_type: str, ids: List[str]) -> Iterator[List[str]]:
+    """Split ids so each _id search URL stays under MAX_URL_LENGTH"""
+    base = len(f"{BASE_URL}/{resource_type}?") + len('&_count=1000')
+    chunk: List[str] = []
+    for resource_id in ids:
+        if chunk and base + len(urlencode({'_id': ','.join(chunk + [resource_id])})) > MAX_URL_LENGTH:
+            yield chunk
+            chunk = []
+        chunk.append(resource_id)
+    if chunk:
+        yield chunk
+
+
+class ReferenceResolver:
+    """
+    Identity map of the resources read in a run, filled in bulk
+
+    Usage:
+        resolver = ReferenceResolver()
+        roles = resolver.search('PractitionerRole', {'_count': '500'}, include=['PractitionerRole:organization'])
+        resolver.resolve(roles, paths={'practitioner', 'organization'})
+        resolver.get(role['practitioner']['reference'])
+    """
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.resources: Dict[Key, Dict] = {}
+        # References that were searched for and not found (deleted, or not visible to us)
+        self.missing: Set[Key] = set()
+
+    def add(self, resources: Iterable[Dict]):
+        for resource in resources:
+            if resource.get('resourceType') and resource.get('id'):
+                self.resources[(resource['resourceType'], resource['id'])] = resource
+
+    def get(self, reference: Optional[str]) -> Optional[Dict]:
+        key = parse_reference(reference)
+        return self.resources.get(key) if key else None
+
+    def search(self, resource_type: str, params: Dict, include: Optional[List[str]] = None) -> List[Dict]:
+        """One search page with _include; the included resources go into the map, the matches are returned"""
+        params = dict(params)
+        if include:
+            # One _include parameter per path; a comma-separated value is not valid FHIR
+            params['_include'] = list(include)
+        bundle = search_resources(resource_type, params) or {}
+        matches = []
+        for entry in bundle.get('entry', []):
+            resource = entry.get('resource')
+            if not resource:
+                continue
+            self.add([resource])
+            if resource.get('resourceType') == resource_type and entry.get('search', {}).get('mode', 'match') == 'match':
+                matches.append(resource)
+        return matches
+
+    def unresolved(self, resources: Iterable[Dict], paths: Optional[Set[str]] = None) -> Dict[str, List[str]]:
+        """{type: ids} of the references not yet in the map (nor known to be missing)"""
+        wanted: Dict[str, Dict[str, None]] = {}
+        for resource in resources:
+            for key in find_references(resource, paths):
+                if key not in self.resources and key not in self.missing:
+                    wanted.setdefault(key[0], {})[key[1]] = None
+        return {resource_type: list(ids) for resource_type, ids in wanted.items()}
+
+    def resolve(self, resources: Iterable[Dict], paths: Optional[Set[str]] = None) -> int:
+        """Fetch every unresolved reference of the resources with _id searches; returns how many were found"""
+        wanted = self.unresolved(resources, paths)
+        jobs = [(resource_type, chunk) for resource_type, ids in wanted.items() for chunk in id_chunks(resource_type, ids)]
+        if not jobs:
+            return 0
+
+        def fetch(resource_type: str, chunk: List[str]) -> Tuple[str, List[str], List[Dict]]:
+            found = list(search_all(resource_type, {'_id': ','.join(chunk), '_count': str(len(chunk))}))
+            return resource_type, chunk, found
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, fetch, resource_type, chunk)
+                       for resource_type, chunk in jobs]
+            resolved = 0
+            for future in futures:
+                resource_type, chunk, found = future.result()
+                self.add(found)
+                resolved += len(found)
+                self.missing.update((resource_type, i) for i in chunk if (resource_type, i) not in self.resources)
+        return resolved
+
+
+def display_name(resource: Optional[Dict]) -> str:
+    if not resource:
+        return '?'
+    name = resource.get('name')
+    if isinstance(name, list) and name:
+        name = name[0].get('text') or ' '.join(name[0].get('given', []) + [name[0].get('family', '')])
+    return (name or resource.get('id', '?')).strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a PractitionerRole roster, resolving references in bulk')
+    parser.add_argument('resource_type', nargs='?', default='PractitionerRole')
+    parser.add_argument('--count', type=int, default=100, help='Resources in the page (default: 100)')
+    parser.add_argument('--include', action='store_true', help='Ask for the organizations with _include first')
+    args = parser.parse_args()
+
+    test_utils.VERBOSE = False
+    requests = []
+
+    def count(method, endpoint, response):
+        requests.append(endpoint)
+    add_request_listener(count)
+    start = time.perf_counter()
+    resolver = ReferenceResolver()
+    include = ['PractitionerRole:organization'] if args.include and args.resource_type == 'PractitionerRole' else None
+    resources = resolver.search(args.resource_type, {'_count': str(args.count)}, include)
+    references = sum(1 for r in resources for _ in find_references(r))
+    resolver.resolve(resources)
+    elapsed = time.perf_counter() - start
+    remove_request_listener(count)
+
+    for resource in resources:
+        targets = [display_name(resolver.resources.get(key)) for key in find_references(resource)]
+        print(f"  {resource['resourceType']}/{resource['id']}: {' / '.join(targets)}")
+    print(f"{Colors.GREEN}{len(resources)} {args.resource_type}, {references} references{Colors.RESET} with "
+          f"{len(requests)} request(s) in {elapsed:.2f}s ({len(resolver.missing)} not found)")
+
+
+if __name__ == '__main__':
+    main()
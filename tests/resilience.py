@@ -0,0 +1,224 @@
+"""
+Hedged requests and per-endpoint circuit breakers for idempotent reads (--hedge, --circuit-breaker)
+Reads are GETs (read_resource, search_resources, paging, GET operations) and POSTs of the
+read-only terminology operations ($expand, $validate-code, $lookup, $translate, $subsumes).
+
+- Hedging: when a read has not answered after HEDGE_DELAY (the endpoint's observed p95 by
+  default), the same request is sent again and whichever response arrives first is returned.
+  Duplicates are capped at HEDGE_BUDGET of all reads so a slow server is not sent twice the load.
+- Circuit breaker: when CIRCUIT_ERROR_RATE of an endpoint's last CIRCUIT_WINDOW reads failed
+  (5xx, timeout, connection error), reads of it fail at once with CircuitOpenError for
+  CIRCUIT_OPEN_SECONDS; then one trial read decides whether it closes again.
+
+Usage:
+    with ResilientReads(hedge=True, breaker=True).installed() as reads:
+        ...make_request calls...
+    reads.print_summary()
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Optional
+import requests
+from test_utils import Colors, FHIRResponse, endpoint_label, set_request_policy
+from config import (
+    HEDGE_DELAY, HEDGE_BUDGET, CIRCUIT_ERROR_RATE, CIRCUIT_WINDOW, CIRCUIT_OPEN_SECONDS
+)
+
+# Operations that only read, so sending one twice is harmless even as a POST
+READ_OPERATIONS = {'$expand', '$validate-code', '$lookup', '$translate', '$subsumes'}
+
+# Latencies of an endpoint needed before its percentile is trusted as the hedge delay
+HEDGE_MIN_SAMPLES = 20
+
+# Latencies kept per endpoint
+LATENCY_SAMPLES = 200
+
+# Threads running hedged attempts (a hedged read occupies two while both are in flight)
+HEDGE_THREADS = 64
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a read to an endpoint whose circuit is open"""
+
+
+def is_read(method: str, endpoint: str) -> bool:
+    if method == 'GET':
+        return True
+    return method == 'POST' and endpoint.split('?')[0].rstrip('/').split('/')[-1] in READ_OPERATIONS
+
+
+def parse_hedge_delay(value: str):
+    """('percentile', 0.95) for 'p95', ('ms', 250.0) for '250'"""
+    value = value.strip().lower()
+    if value.startswith('p'):
+        return 'percentile', float(value[1:]) / 100
+    return 'ms', float(value)
+
+
+def is_failure(response: Optional[FHIRResponse]) -> bool:
+    return response is None or response.status_code >= 500
+
+
+class Circuit:
+    """Closed / open / half-open state of one endpoint"""
+    def __init__(self, window: int):
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def error_rate(self) -> float:
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class ResilientReads:
+    """make_request policy that hedges slow reads and fails fast on failing endpoints"""
+    def __init__(self, hedge: bool = True, breaker: bool = True, delay: str = HEDGE_DELAY,
+                 budget: float = HEDGE_BUDGET, error_rate: float = CIRCUIT_ERROR_RATE,
+                 window: int = CIRCUIT_WINDOW, open_seconds: float = CIRCUIT_OPEN_SECONDS):
+        self.hedge = hedge
+        self.breaker = breaker
+        self.delay = parse_hedge_delay(delay)
+        self.budget = budget
+        self.error_rate = error_rate
+        self.window = window
+        self.open_seconds = open_seconds
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.circuits: Dict[str, Circuit] = {}
+        self.counts = {'reads': 0, 'hedged': 0, 'hedge_won': 0}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @contextmanager
+    def installed(self):
+        """Apply the policy to every make_request of the block (in any thread)"""
+        if self.hedge:
+            self._executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix='hedge')
+        previous = set_request_policy(self)
+        try:
+            yield self
+        finally:
+            set_request_policy(previous)
+            if self._executor:
+                # Losing attempts are left to finish (or time out) on their own
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def call(self, method: str, endpoint: str, params: Optional[Dict],
+             attempt: Callable[[], FHIRResponse]) -> FHIRResponse:
+        """Send a request through attempt(), hedged and guarded when it is a read"""
+        if not is_read(method, endpoint):
+            return attempt()
+        label = endpoint_label(method, endpoint, params)
+        circuit_key = endpoint_label(method, endpoint.split('?')[0])
+        if self.breaker:
+            self._admit(circuit_key)
+        response = None
+        try:
+            response = self._hedged(label, attempt) if self._executor else self._timed(label, attempt)
+            return response
+        finally:
+            if self.breaker:
+                self._record(circuit_key, response)
+
+    def _timed(self, label: str, attempt: Callable[[], FHIRResponse]) -> FHIRResponse:
+        response = attempt()
+        with self._lock:
+            self.latencies.setdefault(label, deque(maxlen=LATENCY_SAMPLES)).append(response.latency_ms)
+        return response
+
+    def hedge_delay_ms(self, label: str) -> Optional[float]:
+        """How long a read of this endpoint may take before it is hedged (None: not yet known)"""
+        kind, value = self.delay
+        if kind == 'ms':
+            return value
+        with self._lock:
+            samples = sorted(self.latencies.get(label, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(value * len(samples)), len(samples) - 1)]
+
+    def _hedged(self, label: str, attempt: Callable[[], FHIRResponse]) -> FHIRResponse:
+        start = time.perf_counter()
+        delay = self.hedge_delay_ms(label)
+        primary = self._executor.submit(contextvars.copy_context().run, self._timed, label, attempt)
+        with self._lock:
+            self.counts['reads'] += 1
+            within_budget = self.counts['hedged'] < self.budget * self.counts['reads']
+        if delay is None or not within_budget:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay / 1000)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self.counts['hedged'] += 1
+        hedge = self._executor.submit(contextvars.copy_context().run, self._timed, label, attempt)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    # The other attempt may still answer
+                    error = e
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self.counts['hedge_won'] += 1
+                    # What the caller waited, not just the hedge's own round trip
+                    response.latency_ms = (time.perf_counter() - start) * 1000
+                return response
+        raise error
+
+    def _admit(self, key: str):
+        with self._lock:
+            circuit = self.circuits.setdefault(key, Circuit(self.window))
+            if circuit.state == 'open' and time.monotonic() - circuit.opened_at >= self.open_seconds:
+                # Let one trial read through
+                circuit.state = 'half-open'
+                return
+            if circuit.state != 'closed':
+                circuit.rejected += 1
+                raise CircuitOpenError(f"circuit open for {key} ({circuit.error_rate():.0%} of the last "
+                                       f"{len(circuit.outcomes)} reads failed)")
+
+    def _record(self, key: str, response: Optional[FHIRResponse]):
+        failed = is_failure(response)
+        with self._lock:
+            circuit = self.circuits[key]
+            if circuit.state == 'half-open':
+                if failed:
+                    circuit.state, circuit.opened_at = 'open', time.monotonic()
+                else:
+                    circuit.state = 'closed'
+                    circuit.outcomes.clear()
+                return
+            circuit.outcomes.append(not failed)
+            if (circuit.state == 'closed' and len(circuit.outcomes) == circuit.outcomes.maxlen
+                    and circuit.error_rate() >= self.error_rate):
+                circuit.state, circuit.opened_at = 'open', time.monotonic()
+                circuit.opened += 1
+
+    def print_summary(self):
+        print(f"\n{Colors.BOLD}Hedging and Circuit Breakers{Colors.RESET}")
+        print(f"{'='*60}")
+        if self.hedge:
+            reads, hedged, won = self.counts['reads'], self.counts['hedged'], self.counts['hedge_won']
+            share = hedged / reads if reads else 0.0
+            print(f"Hedged:    {hedged} of {reads} reads ({share:.1%}, budget {self.budget:.0%}), "
+                  f"{won} answered first by the hedge")
+        if self.breaker:
+            tripped = [(key, c) for key, c in sorted(self.circuits.items()) if c.opened]
+            if not tripped:
+                print(f"Circuits:  {Colors.GREEN}none opened{Colors.RESET} ({len(self.circuits)} endpoints)")
+            for key, circuit in tripped:
+                print(f"  {Colors.YELLOW}{key[:48]:<48}{Colors.RESET} opened {circuit.opened}x, "
+                      f"{circuit.rejected} reads failed fast, now {circuit.state}")
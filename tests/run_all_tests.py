@@ -6,12 +6,27 @@ Runs selected test suites and provides comprehensive reporting
 import sys
 import time
 import argparse
-from test_utils import Colors, TestResults
-from test_organization import run_organization_tests
-from test_practitioner import run_practitioner_tests
-from test_patient import run_patient_tests
-from test_terminology import run_terminology_tests
-from config import BASE_URL
+from contextlib import nullcontext, ExitStack
+from test_utils import Colors, TestResults, transfer_stats, server_timing_stats
+from test_organization import run_organization_tests, ORGANIZATION
+from test_practitioner import run_practitioner_tests, PRACTITIONER
+from test_patient import run_patient_tests, PATIENT
+from test_terminology import run_terminology_tests, TERMINOLOGY
+from test_doc_examples import run_doc_example_tests, DOCS
+from fixtures import sweep, shared_fixture_session
+from profiling import Profiler
+from tracing import tracer
+from monitor import run_monitor
+from history import RunRecorder, print_comparison
+from redundancy import RedundancyDetector
+from concurrency import AdaptiveLimiter
+from resilience import ResilientReads
+from coalescing import Coalescer
+from checks import check_timings
+from config import (
+    BASE_URL, BANDWIDTH_SAVING, HISTORY_DB, DETECT_REDUNDANT, ADAPTIVE_CONCURRENCY,
+    HEDGE_READS, CIRCUIT_BREAKER, COALESCE_REQUESTS
+)
 
 
 def print_header(scenarios):
@@ -51,13 +66,130 @@ Examples:
   python run_all_tests.py patient practitioner  # Run patient and practitioner tests
   python run_all_tests.py org pract pat term # Short names also work
   python run_all_tests.py terminology        # Run terminology tests only
+  python run_all_tests.py docs -j 8          # Run the request/JSON examples from input/pagecontent
+  python run_all_tests.py -k "read patient"  # Run checks whose name contains "read patient"
+  python run_all_tests.py term -k expand     # Run only the $expand terminology checks
+  python run_all_tests.py -j 4               # Run independent checks of each scenario on 4 threads
+  python run_all_tests.py --list -k pinfl    # List the selected checks without running them
+  python run_all_tests.py --profile          # Write cProfile stats and a flamegraph stack file to profile/
+  python run_all_tests.py --server-timing    # Report client vs server time per endpoint
+  python run_all_tests.py --trace trace.json # Export scenario/check/request spans (Chrome trace format)
+  python run_all_tests.py --compare          # Flag latency regressions against previous runs
+  python run_all_tests.py --detect-redundant # Report duplicate, refetching and batchable requests per scenario
+  python run_all_tests.py -j 16 --adaptive-concurrency  # Let latency and 429/503s set the requests in flight
+  python run_all_tests.py --sweep --adaptive-concurrency  # Bulk-delete leftovers without overloading the server
+  python run_all_tests.py --hedge --circuit-breaker  # Resend reads slower than p95, fail fast on failing endpoints
+  python run_all_tests.py term -j 16 --coalesce  # Concurrent identical GETs share one request
+  python run_all_tests.py --monitor --interval 60  # Probe continuously, metrics on :9464/metrics
+  python run_all_tests.py --sweep            # Delete leftover test resources and exit
         """
     )
     parser.add_argument(
         'scenarios',
         nargs='*',
-        choices=['organization', 'org', 'practitioner', 'pract', 'patient', 'pat', 'terminology', 'term', 'all'],
-        help='Scenarios to run (organization, practitioner, patient, terminology, or all). Short names accepted (org, pract, pat, term).'
+        # A non-list default keeps argparse from checking [] against choices when no scenario is given
+        default='all',
+        choices=['organization', 'org', 'practitioner', 'pract', 'patient', 'pat', 'terminology', 'term', 'docs', 'all'],
+        help='Scenarios to run (organization, practitioner, patient, terminology, or all). Short names accepted (org, pract, pat, term). '
+             'docs runs the documentation examples and is not part of all.'
+    )
+    parser.add_argument(
+        '-k',
+        dest='patterns',
+        action='append',
+        metavar='PATTERN',
+        help='Only run checks whose "scenario name" contains PATTERN (case-insensitive, repeatable). '
+             'Checks they depend on are run as well.'
+    )
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Run independent checks within a scenario on N threads (default: 1, ignored in interactive mode)'
+    )
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help='List the selected checks and their dependencies, then exit'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Profile each scenario: .pstats per scenario, merged collapsed stacks and a network/JSON/formatting time split'
+    )
+    parser.add_argument(
+        '--profile-dir',
+        default='profile',
+        metavar='DIR',
+        help='Directory for --profile output (default: profile)'
+    )
+    parser.add_argument(
+        '--server-timing',
+        action='store_true',
+        help='Report client latency vs server-reported time (Server-Timing, X-Response-Time) per endpoint'
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Write a trace of scenarios, checks and requests as Chrome trace-event JSON'
+    )
+    parser.add_argument(
+        '--trace-otlp',
+        metavar='FILE',
+        help='Write the same trace as OTLP/JSON (OpenTelemetry file exporter format)'
+    )
+    parser.add_argument(
+        '--compare',
+        action='store_true',
+        help='After the run, flag significant endpoint/check latency regressions against previous runs in HISTORY_DB'
+    )
+    parser.add_argument(
+        '--no-history',
+        action='store_true',
+        help='Do not append this run to HISTORY_DB'
+    )
+    parser.add_argument(
+        '--detect-redundant',
+        action='store_true',
+        help='Report duplicate GETs, refetches of resources already received and batchable reads after each scenario'
+    )
+    parser.add_argument(
+        '--adaptive-concurrency',
+        action='store_true',
+        help='Share an AIMD limit on requests in flight between all threads, grown while latency is flat and cut on 429/503'
+    )
+    parser.add_argument(
+        '--hedge',
+        action='store_true',
+        help='Resend reads still unanswered after HEDGE_DELAY (default: the endpoint\'s p95) and use the first response'
+    )
+    parser.add_argument(
+        '--circuit-breaker',
+        action='store_true',
+        help='Fail reads of an endpoint at once while CIRCUIT_ERROR_RATE of its recent reads failed'
+    )
+    parser.add_argument(
+        '--coalesce',
+        action='store_true',
+        help='Send concurrent identical GETs once and share the response; reports the coalescing ratio'
+    )
+    parser.add_argument(
+        '--monitor',
+        action='store_true',
+        help='Run lightweight probes on a schedule and serve OpenMetrics on http://127.0.0.1:MONITOR_PORT/metrics'
+    )
+    parser.add_argument(
+        '--interval',
+        type=int,
+        default=60,
+        metavar='SECONDS',
+        help='Seconds between probe runs in --monitor mode (default: 60)'
+    )
+    parser.add_argument(
+        '--sweep',
+        action='store_true',
+        help='Delete leftover test resources whose names start with TEST_IDENTIFIER_PREFIX, then exit'
     )
     return parser.parse_args()
 
@@ -73,7 +205,8 @@ def normalize_scenarios(scenarios):
         'organization': 'organization',
         'practitioner': 'practitioner',
         'patient': 'patient',
-        'terminology': 'terminology'
+        'terminology': 'terminology',
+        'docs': 'docs'
     }
 
     # If no scenarios specified or 'all' is specified, run all
@@ -90,42 +223,116 @@ def normalize_scenarios(scenarios):
     return normalized
 
 
+def list_checks(scenarios, test_scenarios, patterns):
+    """Print the checks selected by -k, grouped by scenario"""
+    for scenario in scenarios:
+        name, _, registry = test_scenarios[scenario]
+        checks = registry.select(patterns)
+        print(f"\n{Colors.BOLD}{name}{Colors.RESET} ({len(checks)} checks)")
+        for check in checks:
+            depends = f" {Colors.CYAN}(after: {', '.join(check.depends)}){Colors.RESET}" if check.depends else ""
+            print(f"  {check.name}{depends}")
+    print()
+
+
 def main():
     """Run selected test suites"""
     args = parse_args()
+    limiter = AdaptiveLimiter() if args.adaptive_concurrency or ADAPTIVE_CONCURRENCY else None
+    if args.sweep:
+        with limiter.installed() if limiter else nullcontext():
+            sweep()
+        if limiter:
+            limiter.print_summary()
+        sys.exit(0)
+    if args.monitor:
+        # The limit and requests in flight are served with the probe metrics
+        with limiter.installed() if limiter else nullcontext():
+            run_monitor(args.interval)
+        sys.exit(0)
+
     scenarios = normalize_scenarios(args.scenarios)
 
+    # Available test scenarios: (display name, test function, check registry)
+    test_scenarios = {
+        'organization': ('Organization', run_organization_tests, ORGANIZATION),
+        'practitioner': ('Practitioner/PractitionerRole', run_practitioner_tests, PRACTITIONER),
+        'patient': ('Patient', run_patient_tests, PATIENT),
+        'terminology': ('Terminology', run_terminology_tests, TERMINOLOGY),
+        'docs': ('Documentation Examples', run_doc_example_tests, DOCS)
+    }
+
+    # Drop scenarios with no check matching -k
+    scenarios = [s for s in scenarios if test_scenarios[s][2].select(args.patterns)]
+    if not scenarios:
+        print(f"{Colors.YELLOW}No checks match {', '.join(args.patterns)}{Colors.RESET}")
+        sys.exit(1)
+
+    if args.list:
+        list_checks(scenarios, test_scenarios, args.patterns)
+        sys.exit(0)
+
     print_header(scenarios)
 
     start_time = time.time()
     all_results = []
 
-    # Available test scenarios
-    test_scenarios = {
-        'organization': ('Organization', run_organization_tests),
-        'practitioner': ('Practitioner/PractitionerRole', run_practitioner_tests),
-        'patient': ('Patient', run_patient_tests),
-        'terminology': ('Terminology', run_terminology_tests)
-    }
+    # Shared Organization/Practitioner/Patient fixtures are created once and handed to every scenario
+    fixture_results = TestResults()
+    needs_fixtures = any(check.shared for s in scenarios for check in test_scenarios[s][2].select(args.patterns))
+    session = shared_fixture_session(fixture_results) if needs_fixtures else nullcontext()
+    profiler = Profiler(args.profile_dir) if args.profile else None
 
-    # Run selected scenarios
-    for scenario in scenarios:
-        if scenario not in test_scenarios:
-            continue
-
-        name, test_func = test_scenarios[scenario]
-        try:
-            results = test_func()
-            all_results.append(results)
-            if scenario != scenarios[-1]:  # Don't print separator after last test
-                print_separator()
-        except Exception as e:
-            print(f"{Colors.RED}{name} tests failed with exception: {e}{Colors.RESET}")
-            sys.exit(1)
+    def profiled(key):
+        return profiler.profile(key) if profiler else nullcontext()
+
+    if args.trace or args.trace_otlp:
+        tracer.start()
+
+    # Every run is appended to the history database for --compare
+    recorder = RunRecorder() if HISTORY_DB and not args.no_history else None
+    detector = RedundancyDetector() if args.detect_redundant or DETECT_REDUNDANT else None
+    hedge, breaker = args.hedge or HEDGE_READS, args.circuit_breaker or CIRCUIT_BREAKER
+    reads = ResilientReads(hedge, breaker) if hedge or breaker else None
+    coalescer = Coalescer() if args.coalesce or COALESCE_REQUESTS else None
+
+    with ExitStack() as stack:
+        if recorder:
+            stack.enter_context(recorder)
+        if detector:
+            stack.enter_context(detector)
+        if limiter:
+            stack.enter_context(limiter.installed())
+        if reads:
+            stack.enter_context(reads.installed())
+        if coalescer:
+            stack.enter_context(coalescer.installed())
+        stack.enter_context(tracer.span('FHIR API test run', **{'server.address': BASE_URL}))
+        if needs_fixtures:
+            with profiled('shared-fixtures'), tracer.span('Create shared fixtures'):
+                shared = stack.enter_context(session)
+            print_separator()
+        else:
+            shared = None
+
+        # Run selected scenarios
+        for scenario in scenarios:
+            name, test_func, _ = test_scenarios[scenario]
+            try:
+                with profiled(scenario):
+                    results = test_func(shared, args.patterns, args.workers)
+                all_results.append(results)
+                if detector:
+                    detector.print_report(scenario)
+                if scenario != scenarios[-1]:  # Don't print separator after last test
+                    print_separator()
+            except Exception as e:
+                print(f"{Colors.RED}{name} tests failed with exception: {e}{Colors.RESET}")
+                sys.exit(1)
 
     # Aggregate and print final results
     elapsed_time = time.time() - start_time
-    total_results = aggregate_results(all_results)
+    total_results = aggregate_results([fixture_results] + all_results)
 
     print(f"\n{Colors.BOLD}{'='*70}{Colors.RESET}")
     print(f"{Colors.BOLD}Overall Test Results{Colors.RESET}")
@@ -135,6 +342,40 @@ def main():
 
     total_results.print_summary()
 
+    if BANDWIDTH_SAVING:
+        transfer_stats.print_summary()
+
+    if args.server_timing:
+        server_timing_stats.print_summary()
+
+    if limiter:
+        limiter.print_summary()
+
+    if reads:
+        reads.print_summary()
+
+    if coalescer:
+        coalescer.print_summary()
+
+    if profiler:
+        profiler.write_stacks()
+        profiler.print_summary()
+
+    if recorder:
+        selection = ' '.join(scenarios + [f"-k {pattern}" for pattern in args.patterns or []])
+        run_id = recorder.save(total_results, elapsed_time, check_timings, selection)
+        if args.compare:
+            print_comparison(run_id)
+    elif args.compare:
+        print(f"\n{Colors.YELLOW}--compare needs the run history (HISTORY_DB is empty or --no-history given){Colors.RESET}")
+
+    if args.trace:
+        tracer.write_chrome(args.trace)
+        print(f"\nTrace written to {args.trace} (trace id {tracer.trace_id})")
+    if args.trace_otlp:
+        tracer.write_otlp(args.trace_otlp)
+        print(f"\nOTLP trace written to {args.trace_otlp} (trace id {tracer.trace_id})")
+
     # Exit with appropriate code
     exit_code = 0 if total_results.failed == 0 else 1
 
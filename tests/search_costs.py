@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Search-parameter cost profiler
+Runs every search pattern the scenarios and the documentation use (identifier, name:contains,
+family:contains, given, birthdate gt/lt, gender, address-city, phone, email, partof, _include and
+the terminology url/status/content/version parameters) with values of different selectivity,
+at two page sizes. Each query is warmed up, then repeated; the median latency is reported with
+the number of matches, ranked slowest first, and each pattern gets a verdict:
+- index?: slow even for its most selective value - the server probably scans
+- scales: its broadest value is much slower than its narrowest, at the same page size
+- ok
+
+The server's dataset size is whatever is loaded; to see how costs grow with it, load
+synthetic_data.py output of increasing size and save each run with --json for comparison.
+
+Usage:
+    python search_costs.py                       # all patterns, 1 warm-up + 5 timed runs each
+    python search_costs.py -k Patient --repeat 9 --json costs-100k.json
+"""
+import argparse
+import json
+import statistics
+from typing import Dict, List, NamedTuple, Optional
+import test_utils
+from test_utils import Colors, make_request, search_resources, extract_entries
+from fixtures import SHARED_ORGANIZATION_SOLIQ, SHARED_PRACTITIONER_EMAIL
+from synthetic_data import PINFL_SYSTEM, SOLIQ_SYSTEM
+from config import MONITOR_PATIENT_PINFL
+
+# Page sizes every query runs at; the difference shows the per-result cost
+PAGE_SIZES = (10, 100)
+
+# A pattern whose most selective value still takes this long has no usable index
+SLOW_MS = 500.0
+
+# A pattern scales with its matches when its broadest value is this many times (and at least
+# SCALING_MIN_MS) slower than its most selective one
+SCALING_FACTOR = 3.0
+SCALING_MIN_MS = 50.0
+
+
+class Query(NamedTuple):
+    pattern: str
+    variant: str
+    resource_type: str
+    params: Dict
+
+
+def build_queries(parent_id: Optional[str]) -> List[Query]:
+    """The documented search patterns, each with values from narrow to broad"""
+    queries = [
+        Query('Patient?identifier', 'system|PINFL', 'Patient',
+              {'identifier': f'{PINFL_SYSTEM}|{MONITOR_PATIENT_PINFL}'}),
+        Query('Patient?identifier', 'value only', 'Patient', {'identifier': MONITOR_PATIENT_PINFL}),
+        Query('Patient?given', 'Alisher', 'Patient', {'given': 'Alisher'}),
+        Query('Patient?gender', 'male', 'Patient', {'gender': 'male'}),
+        Query('Patient?address-city', '15010017', 'Patient', {'address-city': '15010017'}),
+        Query('Patient?phone', '+998901234567', 'Patient', {'phone': '+998901234567'}),
+        Query('Practitioner?email', 'doctor@example.com', 'Practitioner', {'email': 'doctor@example.com'}),
+        Query('Practitioner?email', 'test fixture', 'Practitioner', {'email': SHARED_PRACTITIONER_EMAIL}),
+        Query('Organization?identifier', 'soliq', 'Organization',
+              {'identifier': f'{SOLIQ_SYSTEM}|{SHARED_ORGANIZATION_SOLIQ}'}),
+        Query('PractitionerRole?_include', 'practitioner', 'PractitionerRole',
+              {'_include': 'PractitionerRole:practitioner'}),
+        Query('PractitionerRole?_include', 'practitioner+organization', 'PractitionerRole',
+              {'_include': ['PractitionerRole:practitioner', 'PractitionerRole:organization']}),
+        Query('CodeSystem?url', 'v2-0203', 'CodeSystem', {'url': 'http://terminology.hl7.org/CodeSystem/v2-0203'}),
+        Query('CodeSystem?url&version', 'v2-0203 3.0.0', 'CodeSystem',
+              {'url': 'http://terminology.hl7.org/CodeSystem/v2-0203', 'version': '3.0.0'}),
+        Query('CodeSystem?status', 'active', 'CodeSystem', {'status': 'active'}),
+        Query('CodeSystem?content', 'complete', 'CodeSystem', {'content': 'complete'}),
+        Query('ValueSet?url', 'administrative-gender', 'ValueSet',
+              {'url': 'http://hl7.org/fhir/ValueSet/administrative-gender'}),
+        Query('ValueSet?status', 'active', 'ValueSet', {'status': 'active'}),
+    ]
+    # Substrings from a full name down to two letters match more and more patients
+    for value in ('Karimov', 'Karim', 'ov'):
+        queries.append(Query('Patient?family:contains', value, 'Patient', {'family:contains': value}))
+    for value in ('Alisher', 'Ali', 'a'):
+        queries.append(Query('Patient?name:contains', value, 'Patient', {'name:contains': value}))
+    for value in ('Fergana', 'a'):
+        queries.append(Query('Organization?name:contains', value, 'Organization', {'name:contains': value}))
+    for label, value in (('gt2020', ['gt2020-01-01']), ('gt1980 & lt1990', ['gt1980-01-01', 'lt1990-12-31']),
+                         ('gt1940', ['gt1940-01-01']), ('lt1950', ['lt1950-01-01'])):
+        queries.append(Query('Patient?birthdate', label, 'Patient', {'birthdate': value}))
+    if parent_id:
+        queries.append(Query('Organization?partof', parent_id, 'Organization', {'partof': f'Organization/{parent_id}'}))
+    return queries
+
+
+def find_parent_organization() -> Optional[str]:
+    """Id of some Organization that has children, for the partof query"""
+    for organization in extract_entries(search_resources('Organization', {'_count': '100'}) or {}, 'Organization'):
+        reference = organization.get('partOf', {}).get('reference')
+        if reference:
+            return reference.split('/')[-1]
+    return None
+
+
+def profile_query(query: Query, warmup: int, repeat: int) -> Dict:
+    """Median latency and matches of one query at every page size"""
+    result = {'pattern': query.pattern, 'variant': query.variant, 'status': None, 'matches': None, 'pages': {}}
+    for count in PAGE_SIZES:
+        params = dict(query.params, _count=str(count))
+        latencies, server = [], []
+        for run in range(warmup + repeat):
+            response = make_request('GET', f'/{query.resource_type}', params=params)
+            result['status'] = response.status_code
+            if response.status_code != 200:
+                return result
+            if run < warmup:
+                continue
+            latencies.append(response.latency_ms)
+            if response.server_time_ms is not None:
+                server.append(response.server_time_ms)
+        bundle = response.json()
+        returned = len(extract_entries(bundle, query.resource_type))
+        if bundle.get('total') is not None:
+            result['matches'] = bundle['total']
+        elif result['matches'] is None or returned > result['matches']:
+            # Without a total, a full page only says "at least"
+            result['matches'] = returned
+            result['at_least'] = returned == count
+        result['pages'][count] = {
+            'median_ms': statistics.median(latencies),
+            'server_ms': statistics.median(server) if server else None,
+            'returned': returned
+        }
+    return result
+
+
+def per_result_ms(result: Dict) -> Optional[float]:
+    """Extra latency per extra returned resource between the smallest and largest page"""
+    small, large = result['pages'].get(PAGE_SIZES[0]), result['pages'].get(PAGE_SIZES[-1])
+    if not small or not large or large['returned'] <= small['returned']:
+        return None
+    return (large['median_ms'] - small['median_ms']) / (large['returned'] - small['returned'])
+
+
+def verdicts(results: List[Dict]) -> Dict[str, str]:
+    """'index?', 'scales' or 'ok' per pattern, from the latencies of its values at the smallest page"""
+    by_pattern: Dict[str, List[Dict]] = {}
+    for result in results:
+        if result['pages']:
+            by_pattern.setdefault(result['pattern'], []).append(result)
+    found = {}
+    for pattern, variants in by_pattern.items():
+        medians = sorted((r['matches'] or 0, r['pages'][PAGE_SIZES[0]]['median_ms']) for r in variants)
+        fastest = min(ms for _, ms in medians)
+        narrowest, broadest = medians[0][1], medians[-1][1]
+        if fastest >= SLOW_MS:
+            found[pattern] = 'index?'
+        elif (medians[-1][0] > medians[0][0] and broadest >= narrowest * SCALING_FACTOR
+              and broadest - narrowest >= SCALING_MIN_MS):
+            found[pattern] = 'scales'
+        else:
+            found[pattern] = 'ok'
+    return found
+
+
+def print_report(results: List[Dict]):
+    verdict = verdicts(results)
+    print(f"\n{Colors.BOLD}Search Parameter Costs (median ms, slowest first){Colors.RESET}")
+    print(f"{'='*60}")
+    header = ''.join(f"{f'@{count}':>9}" for count in PAGE_SIZES)
+    print(f"  {'Pattern':<30} {'Value':<26} {'Matches':>8}{header} {'ms/result':>10}  Verdict")
+
+    def cost(result):
+        return result['pages'][PAGE_SIZES[-1]]['median_ms'] if PAGE_SIZES[-1] in result['pages'] else -1
+
+    for result in sorted(results, key=cost, reverse=True):
+        if not result['pages']:
+            print(f"  {result['pattern']:<30} {result['variant'][:26]:<26} "
+                  f"{Colors.YELLOW}status {result['status']} (not supported?){Colors.RESET}")
+            continue
+        matches = f"{'≥' if result.get('at_least') else ''}{result['matches']}"
+        pages = ''.join(f"{result['pages'][count]['median_ms']:>9.1f}" if count in result['pages'] else f"{'-':>9}"
+                        for count in PAGE_SIZES)
+        slope = per_result_ms(result)
+        slope = f"{slope:>10.2f}" if slope is not None else f"{'-':>10}"
+        mark = verdict[result['pattern']]
+        color = Colors.GREEN if mark == 'ok' else Colors.YELLOW
+        print(f"  {result['pattern']:<30} {result['variant'][:26]:<26} {matches:>8}{pages} {slope}  "
+              f"{color}{mark}{Colors.RESET}")
+
+    flagged = sorted(pattern for pattern, mark in verdict.items() if mark != 'ok')
+    if flagged:
+        print(f"\n{Colors.YELLOW}Needs attention: {', '.join(f'{p} ({verdict[p]})' for p in flagged)}{Colors.RESET}")
+    else:
+        print(f"\n{Colors.GREEN}No search pattern is slow or scales with its matches{Colors.RESET}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank the documented search parameters by server cost')
+    parser.add_argument('-k', dest='patterns', action='append', metavar='PATTERN',
+                        help='Only search patterns containing this text (repeatable)')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs per query and page size (default: 1)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query and page size (default: 5)')
+    parser.add_argument('--json', metavar='FILE', help='Also write the results as JSON (to compare dataset sizes)')
+    args = parser.parse_args()
+
+    test_utils.VERBOSE = False
+    queries = build_queries(find_parent_organization())
+    if args.patterns:
+        queries = [q for q in queries if any(p.lower() in q.pattern.lower() for p in args.patterns)]
+
+    results = []
+    for query in queries:
+        result = profile_query(query, args.warmup, args.repeat)
+        results.append(result)
+        page = result['pages'].get(PAGE_SIZES[-1])
+        timing = f"{page['median_ms']:.1f} ms" if page else f"status {result['status']}"
+        print(f"  {query.pattern} [{query.variant}]: {timing}")
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Synthetic uz-core data generator for load and scale testing
+Produces Organization, Practitioner, PractitionerRole and uz-core-patient resources shaped like
+the test fixtures (PINFL/ARGOS/soliq identifiers, Uzbek Latin/Cyrillic names, coded addresses,
+phone/email telecoms) and writes them as NDJSON files or transaction Bundles.
+
+Generation is seeded and column-wise per batch, so the same seed always gives the same data.
+A share of the patients are near-duplicates of earlier ones, listed in duplicates.csv.
+
+Usage:
+    python synthetic_data.py --patients 1000000 --out data/ --seed 42
+    python synthetic_data.py --patients 5000 --format bundle --bundle-size 500 --duplicate-rate 0.1
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+from test_utils import Colors, encode_json
+from config import TEST_IDENTIFIER_PREFIX
+
+PINFL_SYSTEM = 'https://dhp.uz/fhir/core/sid/pid/uz/ni'
+ARGOS_SYSTEM = 'https://dhp.uz/fhir/core/sid/pro/uz/argos'
+SOLIQ_SYSTEM = 'https://dhp.uz/fhir/core/sid/org/uz/soliq'
+V2_0203 = 'http://terminology.hl7.org/CodeSystem/v2-0203'
+POSITION_SYSTEM = 'https://terminology.dhp.uz/fhir/core/CodeSystem/position-and-profession-cs'
+SPECIALTY_SYSTEM = 'https://terminology.dhp.uz/fhir/core/CodeSystem/profession-specialization-cs'
+PROFILE_BASE = 'https://dhp.uz/fhir/core/StructureDefinition/'
+
+# (Latin, Cyrillic) name pairs
+MALE_GIVEN = [
+    ('Alisher', 'Алишер'), ('Akbar', 'Акбар'), ('Aziz', 'Азиз'), ('Bekzod', 'Бекзод'), ('Bobur', 'Бобур'),
+    ('Davron', 'Даврон'), ('Doston', 'Достон'), ('Farrux', 'Фаррух'), ('Jasur', 'Жасур'), ('Javlon', 'Жавлон'),
+    ('Kamol', 'Камол'), ('Laziz', 'Лазиз'), ('Murod', 'Мурод'), ('Nodir', 'Нодир'), ('Otabek', 'Отабек'),
+    ('Rustam', 'Рустам'), ('Sardor', 'Сардор'), ('Sherzod', 'Шерзод'), ('Temur', 'Темур'), ('Umid', 'Умид'),
+    ('Sanjar', 'Санжар'), ('Islom', 'Ислом'), ('Shoxrux', 'Шохрух'), ('Ulugʻbek', 'Улуғбек'),
+]
+FEMALE_GIVEN = [
+    ('Dilnoza', 'Дилноза'), ('Gulnora', 'Гулнора'), ('Madina', 'Мадина'), ('Malika', 'Малика'),
+    ('Nigora', 'Нигора'), ('Nilufar', 'Нилуфар'), ('Feruza', 'Феруза'), ('Shahnoza', 'Шаҳноза'),
+    ('Zarina', 'Зарина'), ('Kamola', 'Камола'), ('Mohira', 'Моҳира'), ('Sevara', 'Севара'),
+    ('Dildora', 'Дилдора'), ('Gulchehra', 'Гулчеҳра'), ('Munisa', 'Муниса'), ('Yulduz', 'Юлдуз'),
+    ('Zuhra', 'Зуҳра'), ('Laylo', 'Лайло'), ('Nodira', 'Нодира'), ('Barno', 'Барно'),
+]
+# Male family names; the female form appends 'a' / 'а'
+FAMILY = [
+    ('Karimov', 'Каримов'), ('Rahimov', 'Раҳимов'), ('Tursunov', 'Турсунов'), ('Yusupov', 'Юсупов'),
+    ('Abdullayev', 'Абдуллаев'), ('Aliyev', 'Алиев'), ('Ismoilov', 'Исмоилов'), ('Mirzayev', 'Мирзаев'),
+    ('Nazarov', 'Назаров'), ('Qodirov', 'Қодиров'), ('Saidov', 'Саидов'), ('Toshmatov', 'Тошматов'),
+    ('Umarov', 'Умаров'), ('Xolmatov', 'Холматов'), ('Ergashev', 'Эргашев'), ('Sobirov', 'Собиров'),
+    ('Hasanov', 'Ҳасанов'), ('Usmonov', 'Усмонов'), ('Jurayev', 'Жўраев'), ('Sultonov', 'Султонов'),
+]
+
+# (city, state code) - state codes from the state valueset, e.g. 1726 = Tashkent city
+CITIES = [
+    ('Toshkent', '1726'), ('Samarqand', '1718'), ('Buxoro', '1706'), ('Fargʻona', '1730'),
+    ('Andijon', '1703'), ('Namangan', '1714'), ('Qarshi', '1710'), ('Nukus', '1735'),
+    ('Urganch', '1733'), ('Termiz', '1722'), ('Jizzax', '1708'), ('Navoiy', '1712'), ('Guliston', '1724'),
+]
+# City code used by the address-city searches in the test suite
+TEST_CITY_CODE = '15010017'
+
+STREETS = ['Amir Temur', 'Navoiy', 'Bunyodkor', 'Mustaqillik', 'Istiqlol', 'Bogʻishamol', 'Mirzo Ulugʻbek']
+ORGANIZATION_KINDS = [
+    'shahar {n}-son oilaviy poliklinikasi', 'koʻp tarmoqli tibbiyot markazi',
+    'viloyat koʻp tarmoqli shifoxonasi', 'tuman tibbiyot birlashmasi', '{n}-son shahar shifoxonasi',
+]
+DEPARTMENTS = ['Terapiya boʻlimi', 'Jarrohlik boʻlimi', 'Pediatriya boʻlimi', 'Kardiologiya boʻlimi']
+# (position code, display, specialty code or None) - codes used in the documentation
+POSITIONS = [
+    ('2211.1', 'General practitioner', ('419772000', 'Family practice')),
+    ('2212', 'Medical specialist', None),
+]
+MOBILE_PREFIXES = ['90', '91', '93', '94', '95', '97', '98', '99', '33', '88']
+EMAIL_DOMAINS = ['example.com', 'example.org', 'example.net']
+
+# PINFL check digit weights (repeated over the first 13 digits)
+PINFL_WEIGHTS = (7, 3, 1)
+
+
+def pinfl(gender: str, birth: date, region: int, serial: int) -> str:
+    """
+    14-digit PINFL: century/gender digit, DDMMYY birth date, 3-digit region,
+    3-digit serial and a check digit
+    """
+    century = 3 if birth.year < 2000 else 5
+    first = century if gender == 'male' else century + 1
+    body = f"{first}{birth:%d%m}{birth.year % 100:02d}{region:03d}{serial:03d}"
+    check = sum(int(d) * PINFL_WEIGHTS[i % 3] for i, d in enumerate(body)) % 10
+    return body + str(check)
+
+
+def transliterate_email(latin: str) -> str:
+    return latin.lower().replace('ʻ', '').replace("'", '')
+
+
+class UzCoreGenerator:
+    """
+    Seeded generator of uz-core resources. Each method builds a batch column by column
+    (one random draw per field for the whole batch) and then assembles the resources.
+
+    Args:
+        prefix: Prepended to family/organization names and identifier values so generated
+            data can be found and removed with `python fixtures.py` (use '' for clean data)
+        duplicate_rate: Share of patients that are near-duplicates of an earlier patient
+        cyrillic_rate: Share of people whose names are written in Cyrillic
+    """
+    def __init__(self, seed: int = 42, prefix: str = TEST_IDENTIFIER_PREFIX,
+                 duplicate_rate: float = 0.05, cyrillic_rate: float = 0.3):
+        self.rng = random.Random(seed)
+        self.prefix = prefix
+        self.duplicate_rate = duplicate_rate
+        self.cyrillic_rate = cyrillic_rate
+        # Ground truth: (duplicate id, original id, kind)
+        self.duplicates: List[Tuple[str, str, str]] = []
+        # Recent originals that duplicates are drawn from (bounded to keep memory flat)
+        self._originals: List[Dict] = []
+        self._serial = 0
+
+    def _ids(self, n: int) -> List[str]:
+        return [str(uuid.UUID(int=self.rng.getrandbits(128), version=4)) for _ in range(n)]
+
+    def _names(self, genders: List[str]) -> List[Tuple[str, List[str], bool]]:
+        """(family, [given, patronymic], cyrillic) per person"""
+        rng = self.rng
+        n = len(genders)
+        family = rng.choices(FAMILY, k=n)
+        male = rng.choices(MALE_GIVEN, k=n)
+        female = rng.choices(FEMALE_GIVEN, k=n)
+        father = rng.choices(MALE_GIVEN, k=n)
+        cyrillic = [r < self.cyrillic_rate for r in (rng.random() for _ in range(n))]
+        names = []
+        for gender, fam, m, f, dad, cyr in zip(genders, family, male, female, father, cyrillic):
+            script = 1 if cyr else 0
+            if gender == 'male':
+                names.append((fam[script], [m[script], dad[script] + ('ович' if cyr else 'ovich')], cyr))
+            else:
+                names.append((fam[script] + ('а' if cyr else 'a'), [f[script], dad[script] + ('овна' if cyr else 'ovna')], cyr))
+        return names
+
+    def _phones(self, n: int) -> List[str]:
+        prefixes = self.rng.choices(MOBILE_PREFIXES, k=n)
+        return [f"+998{p}{self.rng.randrange(10_000_000):07d}" for p in prefixes]
+
+    def _addresses(self, n: int) -> List[Dict]:
+        rng = self.rng
+        cities = rng.choices(CITIES, k=n)
+        streets = rng.choices(STREETS, k=n)
+        addresses = []
+        for (city, state), street in zip(cities, streets):
+            district = f"{state}{rng.randrange(200, 300):03d}"
+            # One in ten uses the city code searched by the test suite
+            city_code = TEST_CITY_CODE if rng.random() < 0.1 else f"{district}{rng.randrange(1, 200):04d}"
+            house = rng.randrange(1, 120)
+            addresses.append({
+                "use": "home",
+                "type": "physical",
+                "text": f"{city}, {street} koʻchasi, {house}-uy",
+                "line": [f"{street} koʻchasi, {house}-uy"],
+                "city": city_code,
+                "district": district,
+                "state": state,
+                "country": "UZ"
+            })
+        return addresses
+
+    def organizations(self, n: int, department_rate: float = 0.2) -> List[Dict]:
+        """Healthcare providers; about department_rate of them are departments (partOf an earlier one)"""
+        rng = self.rng
+        ids = self._ids(n)
+        cities = rng.choices(CITIES, k=n)
+        kinds = rng.choices(ORGANIZATION_KINDS, k=n)
+        soliq = [f"{rng.randrange(200_000_000, 310_000_000)}" for _ in range(n)]
+        organizations = []
+        for i, (org_id, (city, _), kind, inn) in enumerate(zip(ids, cities, kinds, soliq)):
+            parents = [o for o in organizations[-50:] if 'partOf' not in o]
+            is_department = parents and rng.random() < department_rate
+            org = {
+                "resourceType": "Organization",
+                "id": org_id,
+                "meta": {"profile": [PROFILE_BASE + "uz-core-organization"]},
+                "identifier": [{
+                    "system": SOLIQ_SYSTEM,
+                    "type": {"coding": [{"system": V2_0203, "code": "TAX"}]},
+                    "value": f"{self.prefix}{inn}"
+                }],
+                "active": True,
+                "language": "uz",
+            }
+            if is_department:
+                parent = rng.choice(parents)
+                org["type"] = [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/organization-type",
+                                            "code": "dept", "display": "Hospital Department"}]}]
+                org["name"] = f"{parent['name']} - {rng.choice(DEPARTMENTS)}"
+                org["partOf"] = {"reference": f"Organization/{parent['id']}"}
+            else:
+                org["type"] = [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/organization-type",
+                                            "code": "prov", "display": "Healthcare Provider"}]}]
+                org["name"] = f"{self.prefix}{city} {kind.format(n=rng.randrange(1, 60))}"
+            organizations.append(org)
+        return organizations
+
+    def practitioners(self, n: int) -> List[Dict]:
+        rng = self.rng
+        ids = self._ids(n)
+        genders = rng.choices(('male', 'female'), k=n)
+        names = self._names(genders)
+        phones = self._phones(n)
+        argos = [f"{rng.randrange(10_000_000, 100_000_000)}" for _ in range(n)]
+        practitioners = []
+        for pract_id, gender, (family, given, cyrillic), phone, argos_id in zip(ids, genders, names, phones, argos):
+            latin_family = family if not cyrillic else f"dr{argos_id}"
+            practitioners.append({
+                "resourceType": "Practitioner",
+                "id": pract_id,
+                "meta": {"profile": [PROFILE_BASE + "uz-core-practitioner"]},
+                "language": "uz",
+                "identifier": [{
+                    "use": "official",
+                    "type": {"coding": [{"system": V2_0203, "code": "NI"}]},
+                    "system": ARGOS_SYSTEM,
+                    "value": f"{self.prefix}{argos_id}"
+                }],
+                "active": True,
+                "name": [{"use": "official", "family": f"{self.prefix}{family}", "given": given}],
+                "telecom": [
+                    {"system": "phone", "value": phone, "use": "work"},
+                    {"system": "email", "value": f"{transliterate_email(latin_family)}.{argos_id[-4:]}@{rng.choice(EMAIL_DOMAINS)}",
+                     "use": "work"}
+                ],
+                "gender": gender
+            })
+        return practitioners
+
+    def practitioner_roles(self, practitioners: List[Dict], organizations: List[Dict]) -> List[Dict]:
+        """One role per practitioner at a random organization"""
+        rng = self.rng
+        n = len(practitioners)
+        ids = self._ids(n)
+        orgs = rng.choices(organizations, k=n)
+        positions = rng.choices(POSITIONS, k=n)
+        roles = []
+        for role_id, pract, org, (code, display, specialty) in zip(ids, practitioners, orgs, positions):
+            name = pract['name'][0]
+            role = {
+                "resourceType": "PractitionerRole",
+                "id": role_id,
+                "meta": {"profile": [PROFILE_BASE + "uz-core-practitionerrole"]},
+                "language": "uz",
+                "active": True,
+                "practitioner": {"reference": f"Practitioner/{pract['id']}",
+                                 "display": f"{name['given'][0]} {name['family']}"},
+                "organization": {"reference": f"Organization/{org['id']}", "display": org['name']},
+                "code": [{"coding": [{"system": POSITION_SYSTEM, "code": code, "display": display}]}]
+            }
+            if specialty:
+                role["specialty"] = [{"coding": [{"system": SPECIALTY_SYSTEM, "code": specialty[0],
+                                                  "display": specialty[1]}]}]
+            roles.append(role)
+        return roles
+
+    def patients(self, n: int, organizations: Optional[List[Dict]] = None) -> List[Dict]:
+        """uz-core patients; about duplicate_rate of them repeat an earlier patient (see self.duplicates)"""
+        rng = self.rng
+        ids = self._ids(n)
+        genders = rng.choices(('male', 'female'), k=n)
+        names = self._names(genders)
+        phones = self._phones(n)
+        addresses = self._addresses(n)
+        # Birth dates between 1940 and 2023
+        births = [date.fromordinal(o) for o in
+                  (rng.randrange(708_000, 738_900) for _ in range(n))]
+        regions = [rng.randrange(1, 1000) for _ in range(n)]
+        managing = rng.choices(organizations, k=n) if organizations else [None] * n
+        duplicate_draws = [rng.random() for _ in range(n)]
+
+        patients = []
+        for i in range(n):
+            family, given, _ = names[i]
+            gender, birth, phone = genders[i], births[i], phones[i]
+            self._serial = (self._serial + 1) % 1000
+            pinfl_value = pinfl(gender, birth, regions[i], self._serial)
+
+            original = None
+            if self._originals and duplicate_draws[i] < self.duplicate_rate:
+                original = rng.choice(self._originals)
+                kind = rng.choice(('same_pinfl', 'demographic'))
+                family = original['name'][0]['family'][len(self.prefix):]
+                given = list(original['name'][0]['given'])
+                gender = original['gender']
+                birth = date.fromisoformat(original['birthDate'])
+                if kind == 'same_pinfl':
+                    pinfl_value = original['identifier'][0]['value'][len(self.prefix):]
+                self.duplicates.append((ids[i], original['id'], kind))
+
+            patient = {
+                "resourceType": "Patient",
+                "id": ids[i],
+                "meta": {"profile": [PROFILE_BASE + "uz-core-patient"]},
+                "language": "uz",
+                "identifier": [{
+                    "use": "official",
+                    "type": {"coding": [{"system": V2_0203, "code": "NI"}]},
+                    "system": PINFL_SYSTEM,
+                    "value": f"{self.prefix}{pinfl_value}"
+                }],
+                "active": True,
+                "name": [{"use": "official", "family": f"{self.prefix}{family}", "given": given}],
+                "gender": gender,
+                "birthDate": birth.isoformat(),
+                "telecom": [{"system": "phone", "value": phone, "use": "mobile"}],
+                "address": [addresses[i]]
+            }
+            if managing[i] is not None:
+                patient["managingOrganization"] = {"reference": f"Organization/{managing[i]['id']}"}
+            patients.append(patient)
+
+            if original is None:
+                if len(self._originals) < 10_000:
+                    self._originals.append(patient)
+                else:
+                    self._originals[rng.randrange(10_000)] = patient
+        return patients
+
+
+def generate(generator: UzCoreGenerator, organizations: int, practitioners: int, patients: int,
+             batch_size: int = 10_000) -> Iterator[Tuple[str, List[Dict]]]:
+    """Yield (resource type, batch) in dependency order: organizations, practitioners, roles, patients"""
+    orgs = generator.organizations(organizations) if organizations else []
+    if orgs:
+        yield 'Organization', orgs
+    for start in range(0, practitioners, batch_size):
+        batch = generator.practitioners(min(batch_size, practitioners - start))
+        yield 'Practitioner', batch
+        if orgs:
+            yield 'PractitionerRole', generator.practitioner_roles(batch, orgs)
+    for start in range(0, patients, batch_size):
+        yield 'Patient', generator.patients(min(batch_size, patients - start), orgs)
+
+
+def transaction_bundle(resources: List[Dict]) -> Dict:
+    """Transaction Bundle that PUTs each resource at its generated id, so references resolve across bundles"""
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {
+                "fullUrl": f"{r['resourceType']}/{r['id']}",
+                "resource": r,
+                "request": {"method": "PUT", "url": f"{r['resourceType']}/{r['id']}"}
+            }
+            for r in resources
+        ]
+    }
+
+
+def write_dataset(batches: Iterator[Tuple[str, List[Dict]]], out_dir: str, output_format: str = 'ndjson',
+                  bundle_size: int = 500) -> Dict[str, int]:
+    """Write NDJSON files per resource type (<Type>.ndjson) or numbered transaction Bundles; returns counts"""
+    os.makedirs(out_dir, exist_ok=True)
+    counts: Dict[str, int] = {}
+    files = {}
+    pending: List[Dict] = []
+    bundle_number = 0
+
+    def flush_bundle(resources):
+        nonlocal bundle_number
+        bundle_number += 1
+        with open(os.path.join(out_dir, f"bundle-{bundle_number:05d}.json"), 'wb') as f:
+            f.write(encode_json(transaction_bundle(resources)))
+
+    try:
+        for resource_type, batch in batches:
+            counts[resource_type] = counts.get(resource_type, 0) + len(batch)
+            if output_format == 'ndjson':
+                if resource_type not in files:
+                    files[resource_type] = open(os.path.join(out_dir, f"{resource_type}.ndjson"), 'wb')
+                files[resource_type].write(b'\n'.join(encode_json(r) for r in batch) + b'\n')
+            else:
+                pending.extend(batch)
+                while len(pending) >= bundle_size:
+                    flush_bundle(pending[:bundle_size])
+                    del pending[:bundle_size]
+        if pending:
+            flush_bundle(pending)
+    finally:
+        for f in files.values():
+            f.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic uz-core resources for load testing')
+    parser.add_argument('--patients', type=int, default=1000, help='Number of patients (default: 1000)')
+    parser.add_argument('--practitioners', type=int, default=100, help='Number of practitioners, each with one role (default: 100)')
+    parser.add_argument('--organizations', type=int, default=20, help='Number of organizations (default: 20)')
+    parser.add_argument('--format', choices=['ndjson', 'bundle'], default='ndjson', help='Output format (default: ndjson)')
+    parser.add_argument('--bundle-size', type=int, default=500, help='Entries per transaction Bundle (default: 500)')
+    parser.add_argument('--out', default='synthetic-data', help='Output directory (default: synthetic-data)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help='Share of duplicate patients (default: 0.05)')
+    parser.add_argument('--cyrillic-rate', type=float, default=0.3, help='Share of names in Cyrillic (default: 0.3)')
+    parser.add_argument('--prefix', default=TEST_IDENTIFIER_PREFIX,
+                        help='Prefix for names and identifiers so the data can be swept (default: TEST_IDENTIFIER_PREFIX)')
+    args = parser.parse_args()
+
+    generator = UzCoreGenerator(args.seed, args.prefix, args.duplicate_rate, args.cyrillic_rate)
+    start = time.perf_counter()
+    counts = write_dataset(generate(generator, args.organizations, args.practitioners, args.patients),
+                           args.out, args.format, args.bundle_size)
+    with open(os.path.join(args.out, 'duplicates.csv'), 'w', encoding='utf-8') as f:
+        f.write('duplicate_id,original_id,kind\n')
+        for duplicate_id, original_id, kind in generator.duplicates:
+            f.write(f"{duplicate_id},{original_id},{kind}\n")
+    elapsed = time.perf_counter() - start
+
+    total = sum(counts.values())
+    print(f"\n{Colors.BOLD}Synthetic data written to {args.out}{Colors.RESET}")
+    for resource_type, count in counts.items():
+        print(f"  {resource_type:<18} {count}")
+    print(f"  {'Duplicate patients':<18} {len(generator.duplicates)}")
+    print(f"\n{total} resources in {elapsed:.1f}s ({total / elapsed * 60:,.0f} per minute)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Incremental terminology mirror in a local SQLite database (TERMINOLOGY_DB)
+The first sync downloads every CodeSystem, ValueSet and ConceptMap; later syncs read only the
+changes since the last checkpoint from _history?_since= (or _lastUpdated=ge when the server has
+no type history), so a restart does not re-download the whole terminology. Concepts, ValueSet
+codes and ConceptMap elements are kept in indexed tables for local lookups.
+
+Usage:
+    python terminology_mirror.py sync             # full on first use, incremental afterwards
+    python terminology_mirror.py sync --full --expand
+    python terminology_mirror.py lookup http://hl7.org/fhir/administrative-gender male
+    python terminology_mirror.py stats
+"""
+import argparse
+import json
+import re
+import sqlite3
+import time
+import requests
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+import test_utils
+from test_utils import Colors, search_all, changes_since, parse_instant
+from concept_maps import EQUIVALENCE_TO_RELATIONSHIP, Translation
+from expansion import PagedExpansion, ExpansionError
+from config import TERMINOLOGY_DB
+
+RESOURCE_TYPES = ['CodeSystem', 'ValueSet', 'ConceptMap']
+
+# Resources per search or _history page
+SYNC_PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    resource_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    url TEXT,
+    version TEXT,
+    version_key TEXT NOT NULL,
+    status TEXT,
+    last_updated TEXT,
+    json TEXT NOT NULL,
+    PRIMARY KEY (resource_type, id)
+);
+CREATE TABLE IF NOT EXISTS concepts (
+    resource_id TEXT NOT NULL,
+    system TEXT NOT NULL,
+    version_key TEXT NOT NULL,
+    code TEXT NOT NULL,
+    display TEXT,
+    parent TEXT
+);
+CREATE TABLE IF NOT EXISTS value_set_codes (
+    resource_id TEXT NOT NULL,
+    value_set TEXT NOT NULL,
+    version_key TEXT NOT NULL,
+    system TEXT,
+    code TEXT NOT NULL,
+    display TEXT
+);
+CREATE TABLE IF NOT EXISTS map_elements (
+    resource_id TEXT NOT NULL,
+    map_url TEXT,
+    source_system TEXT,
+    source_code TEXT NOT NULL,
+    target_system TEXT,
+    target_code TEXT,
+    target_display TEXT,
+    relationship TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    resource_type TEXT PRIMARY KEY,
+    checkpoint TEXT NOT NULL,
+    synced_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_resources_url ON resources(resource_type, url, version_key);
+CREATE INDEX IF NOT EXISTS idx_concepts_code ON concepts(system, code);
+CREATE INDEX IF NOT EXISTS idx_concepts_display ON concepts(display COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_concepts_resource ON concepts(resource_id);
+CREATE INDEX IF NOT EXISTS idx_value_set_codes_code ON value_set_codes(value_set, system, code);
+CREATE INDEX IF NOT EXISTS idx_value_set_codes_resource ON value_set_codes(resource_id);
+CREATE INDEX IF NOT EXISTS idx_map_elements_source ON map_elements(source_system, source_code);
+CREATE INDEX IF NOT EXISTS idx_map_elements_resource ON map_elements(resource_id);
+"""
+
+CONTENT_TABLES = {'CodeSystem': 'concepts', 'ValueSet': 'value_set_codes', 'ConceptMap': 'map_elements'}
+
+
+def version_key(version: Optional[str]) -> str:
+    """Sortable form of a version, so '1.10.0' orders after '1.9.2' (the order of _sort=-version)"""
+    if not version:
+        return ''
+    return '.'.join(part.zfill(10) if part.isdigit() else part for part in re.split(r'[.\-+]', version))
+
+
+def flatten_concepts(concepts: List[Dict], parent: Optional[str] = None) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """(code, display, parent code) of a CodeSystem's concept hierarchy"""
+    for concept in concepts:
+        yield concept.get('code'), concept.get('display'), parent
+        yield from flatten_concepts(concept.get('concept', []), concept.get('code'))
+
+
+def value_set_codes(value_set: Dict) -> Iterator[Tuple[Optional[str], str, Optional[str]]]:
+    """(system, code, display) of a ValueSet's stored expansion, or of its enumerated compose.include concepts"""
+    contains = value_set.get('expansion', {}).get('contains')
+    if contains:
+        stack = list(contains)
+        while stack:
+            item = stack.pop()
+            if 'code' in item:
+                yield item.get('system'), item['code'], item.get('display')
+            stack.extend(item.get('contains', []))
+        return
+    for include in value_set.get('compose', {}).get('include', []):
+        for concept in include.get('concept', []):
+            yield include.get('system'), concept.get('code'), concept.get('display')
+
+
+class TerminologyMirror:
+    """
+    Local copy of the server's terminology resources
+
+    Usage:
+        mirror = TerminologyMirror()
+        mirror.sync()
+        mirror.lookup('http://hl7.org/fhir/administrative-gender', 'male')
+        mirror.validate_code('http://hl7.org/fhir/ValueSet/administrative-gender', 'http://hl7.org/fhir/administrative-gender', 'male')
+    """
+    def __init__(self, path: str = TERMINOLOGY_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Sync
+
+    def checkpoint(self, resource_type: str) -> Optional[str]:
+        row = self.conn.execute("SELECT checkpoint FROM sync_state WHERE resource_type = ?",
+                                (resource_type,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, full: bool = False, expand: bool = False) -> Dict[str, Tuple[int, int]]:
+        """Bring the mirror up to date; returns {resource type: (stored, deleted)}"""
+        counts = {}
+        for resource_type in RESOURCE_TYPES:
+            since = None if full else self.checkpoint(resource_type)
+            stored = deleted = 0
+            latest, latest_instant = since, parse_instant(since)
+            started = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            changes = self._full(resource_type) if since is None else changes_since(resource_type, since, SYNC_PAGE_SIZE)
+            # A page that fails mid-sync raises, so the transaction rolls back and the checkpoint stays put
+            with self.conn:
+                if since is None:
+                    self._clear(resource_type)
+                for resource_id, resource in changes:
+                    if resource is None:
+                        self._delete(resource_type, resource_id)
+                        deleted += 1
+                        continue
+                    self._store(resource, expand)
+                    stored += 1
+                    # Compared as instants: the server may write offsets other than Z
+                    last_updated = resource.get('meta', {}).get('lastUpdated')
+                    instant = parse_instant(last_updated)
+                    if instant and (latest_instant is None or instant > latest_instant):
+                        latest, latest_instant = last_updated, instant
+                # Without meta.lastUpdated on the resources, the next sync asks for changes since this one started
+                latest = latest or started
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (resource_type, checkpoint, synced_at) "
+                    "VALUES (?, ?, datetime('now'))", (resource_type, latest))
+            counts[resource_type] = (stored, deleted)
+        return counts
+
+    def _full(self, resource_type: str) -> Iterator[Tuple[str, Dict]]:
+        for resource in search_all(resource_type, {'_count': str(SYNC_PAGE_SIZE)}, required=True):
+            yield resource.get('id'), resource
+
+    def _clear(self, resource_type: str):
+        self.conn.execute(f"DELETE FROM {CONTENT_TABLES[resource_type]}")
+        self.conn.execute("DELETE FROM resources WHERE resource_type = ?", (resource_type,))
+
+    def _delete(self, resource_type: str, resource_id: str):
+        self.conn.execute(f"DELETE FROM {CONTENT_TABLES[resource_type]} WHERE resource_id = ?", (resource_id,))
+        self.conn.execute("DELETE FROM resources WHERE resource_type = ? AND id = ?", (resource_type, resource_id))
+
+    def _store(self, resource: Dict, expand: bool):
+        """Replace a resource and its rows (its version may have changed)"""
+        resource_type = resource['resourceType']
+        resource_id = resource.get('id')
+        url = resource.get('url')
+        key = version_key(resource.get('version'))
+        self._delete(resource_type, resource_id)
+        self.conn.execute(
+            "INSERT INTO resources (resource_type, id, url, version, version_key, status, last_updated, json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (resource_type, resource_id, url, resource.get('version'), key, resource.get('status'),
+             resource.get('meta', {}).get('lastUpdated'), json.dumps(resource, ensure_ascii=False)))
+
+        if resource_type == 'CodeSystem':
+            self.conn.executemany(
+                "INSERT INTO concepts (resource_id, system, version_key, code, display, parent) VALUES (?, ?, ?, ?, ?, ?)",
+                ((resource_id, url, key, code, display, parent)
+                 for code, display, parent in flatten_concepts(resource.get('concept', [])) if code))
+        elif resource_type == 'ValueSet':
+            codes = list(value_set_codes(resource))
+            if not codes and expand and url:
+                codes = self._expand(url, resource.get('version'))
+            self.conn.executemany(
+                "INSERT INTO value_set_codes (resource_id, value_set, version_key, system, code, display) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((resource_id, url, key, system, code, display) for system, code, display in codes if code))
+        elif resource_type == 'ConceptMap':
+            rows = []
+            for group in resource.get('group', []):
+                for element in group.get('element', []):
+                    if element.get('noMap'):
+                        rows.append((resource_id, url, group.get('source'), element.get('code'),
+                                     None, None, None, 'not-related-to'))
+                    for target in element.get('target', []):
+                        relationship = target.get('relationship') or \
+                            EQUIVALENCE_TO_RELATIONSHIP.get(target.get('equivalence'), target.get('equivalence'))
+                        rows.append((resource_id, url, group.get('source'), element.get('code'), group.get('target'),
+                                     target.get('code'), target.get('display'), relationship))
+            self.conn.executemany("INSERT INTO map_elements VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _expand(self, url: str, version: Optional[str]) -> List[Tuple[Optional[str], str, Optional[str]]]:
+        """Server expansion of an intensional ValueSet (compose filters, whole systems)"""
+        params = {'valueSetVersion': version} if version else None
+        try:
+            return [(c.get('system'), c.get('code'), c.get('display'))
+                    for c in PagedExpansion(url=url, params=params)]
+        except ExpansionError as e:
+            print(f"  {Colors.YELLOW}Not expanded: {url} ({e}){Colors.RESET}")
+            return []
+
+    # Lookups (the newest version unless one is given, as _sort=-version would list first)
+
+    def _version_key(self, resource_type: str, url: str, version: Optional[str]) -> Optional[str]:
+        if version:
+            return version_key(version)
+        row = self.conn.execute(
+            "SELECT version_key FROM resources WHERE resource_type = ? AND url = ? "
+            "ORDER BY version_key DESC LIMIT 1", (resource_type, url)).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, system: str, code: str, version: Optional[str] = None) -> Optional[Dict]:
+        """Like $lookup: {'code', 'display', 'parent', 'version'} or None if the code is unknown"""
+        key = self._version_key('CodeSystem', system, version)
+        if key is None:
+            return None
+        row = self.conn.execute(
+            "SELECT c.code, c.display, c.parent, r.version FROM concepts c "
+            "JOIN resources r ON r.resource_type = 'CodeSystem' AND r.id = c.resource_id "
+            "WHERE c.system = ? AND c.code = ? AND c.version_key = ? LIMIT 1", (system, code, key)).fetchone()
+        return dict(zip(('code', 'display', 'parent', 'version'), row)) if row else None
+
+    def validate_code(self, value_set: str, system: Optional[str], code: str, version: Optional[str] = None) -> Optional[bool]:
+        """Like $validate-code; None if the mirror has no codes for the ValueSet (not enumerated nor expanded)"""
+        key = self._version_key('ValueSet', value_set, version)
+        if key is None or not self.conn.execute(
+                "SELECT 1 FROM value_set_codes WHERE value_set = ? AND version_key = ? LIMIT 1",
+                (value_set, key)).fetchone():
+            return None
+        sql = "SELECT 1 FROM value_set_codes WHERE value_set = ? AND version_key = ? AND code = ?"
+        args = [value_set, key, code]
+        if system:
+            sql += " AND system = ?"
+            args.append(system)
+        return self.conn.execute(sql + " LIMIT 1", args).fetchone() is not None
+
+    def translate(self, system: str, code: str, target_system: Optional[str] = None) -> List[Translation]:
+        """Like $translate, from the mirrored ConceptMap elements"""
+        sql = ("SELECT target_system, target_code, target_display, relationship, map_url FROM map_elements "
+               "WHERE source_system = ? AND source_code = ?")
+        args = [system, code]
+        if target_system:
+            sql += " AND (target_system = ? OR target_system IS NULL)"
+            args.append(target_system)
+        return [Translation(*row) for row in self.conn.execute(sql, args)]
+
+    def search_display(self, text: str, system: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        """Concepts whose display contains the text (case-insensitive for ASCII)"""
+        sql = "SELECT system, code, display FROM concepts WHERE display LIKE ?"
+        args = [f'%{text}%']
+        if system:
+            sql += " AND system = ?"
+            args.append(system)
+        rows = self.conn.execute(sql + " LIMIT ?", args + [limit])
+        return [dict(zip(('system', 'code', 'display'), row)) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        counts = {f'{t}s': self.conn.execute("SELECT COUNT(*) FROM resources WHERE resource_type = ?",
+                                             (t,)).fetchone()[0] for t in RESOURCE_TYPES}
+        for table in CONTENT_TABLES.values():
+            counts[table] = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mirror the server terminology into SQLite')
+    parser.add_argument('--db', default=TERMINOLOGY_DB, help=f'Mirror database (default: {TERMINOLOGY_DB})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync = commands.add_parser('sync', help='Download changes since the last sync (everything on first use)')
+    sync.add_argument('--full', action='store_true', help='Ignore the checkpoints and download everything')
+    sync.add_argument('--expand', action='store_true',
+                      help='Store server expansions of ValueSets that do not enumerate their codes')
+    lookup = commands.add_parser('lookup', help='Look up a code in the mirror')
+    lookup.add_argument('system')
+    lookup.add_argument('code')
+    lookup.add_argument('--version')
+    commands.add_parser('stats', help='Row counts and checkpoints')
+    args = parser.parse_args()
+
+    mirror = TerminologyMirror(args.db)
+    if args.command == 'sync':
+        test_utils.VERBOSE = False
+        start = time.perf_counter()
+        try:
+            counts = mirror.sync(args.full, args.expand)
+        except requests.exceptions.RequestException as e:
+            print(f"{Colors.RED}Sync failed, checkpoints unchanged: {e}{Colors.RESET}")
+            exit(1)
+        for resource_type, (stored, deleted) in counts.items():
+            print(f"  {resource_type}: {stored} stored, {deleted} deleted "
+                  f"(checkpoint {mirror.checkpoint(resource_type) or '-'})")
+        print(f"{Colors.GREEN}Synced in {time.perf_counter() - start:.1f}s{Colors.RESET} → {args.db}")
+    elif args.command == 'lookup':
+        start = time.perf_counter()
+        found = mirror.lookup(args.system, args.code, args.version)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        if found:
+            print(f"{Colors.GREEN}{found['code']}{Colors.RESET} {found['display'] or ''} "
+                  f"(version {found['version'] or '-'}, {elapsed_us:.0f}µs)")
+        else:
+            print(f"{Colors.YELLOW}Not in the mirror{Colors.RESET}")
+            raise SystemExit(1)
+    else:
+        for name, count in mirror.stats().items():
+            print(f"  {name}: {count}")
+        for resource_type in RESOURCE_TYPES:
+            print(f"  {resource_type} checkpoint: {mirror.checkpoint(resource_type) or '-'}")
+    mirror.close()
+
+
+if __name__ == '__main__':
+    main()
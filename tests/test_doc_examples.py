@@ -0,0 +1,370 @@
+"""
+Executable checks extracted from the documentation pages
+Parses the fenced HTTP request and JSON examples (and the cURL code tabs) in input/pagecontent/*.md
+and input/translation/ru/pagecontent/*.md and registers one check per distinct example.
+Examples that passed before are remembered by content hash in DOC_EXAMPLES_CACHE, so after a
+doc edit only new or changed examples are sent to the server again.
+"""
+import glob
+import hashlib
+import html
+import json
+import os
+import re
+import shlex
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from test_utils import TestResults, make_request, Colors
+from checks import Scenario, CheckContext
+from config import BASE_URL, DOC_EXAMPLES_CACHE, DOC_EXAMPLES_WRITE
+from fixtures import SharedFixtures
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_DIRS = [
+    os.path.join(REPO_DIR, 'input', 'pagecontent'),
+    os.path.join(REPO_DIR, 'input', 'translation', 'ru', 'pagecontent'),
+]
+
+# Server URL used in the documentation; requests to it are sent to BASE_URL instead
+DOC_BASE_URL = 'https://playground.dhp.uz/fhir'
+
+REQUEST_LINE = re.compile(r'^(GET|POST|PUT|PATCH|DELETE)\s+(\S.*?)\s*$', re.MULTILINE)
+RESOURCE_TYPE = re.compile(r'"resourceType"\s*:\s*"(\w+)"')
+# Text between a request and its response example ("Response:", "Ответ:")
+RESPONSE_LABEL = re.compile(r'respon|ответ', re.IGNORECASE)
+# Illustrative values that cannot be sent as they are
+PLACEHOLDER = re.compile(r'[\[\]]|existing-id|\.\.\.|\$\{|\$[A-Z_]{2,}')
+
+# Lines a request block may be separated from its body or response example
+NEARBY_LINES = 12
+
+
+class DocExample:
+    """A request, JSON example or unparseable cURL snippet, identified by the hash of its content"""
+    def __init__(self, kind: str, location: str, method: Optional[str] = None, endpoint: Optional[str] = None,
+                 body: Optional[str] = None, response_type: Optional[str] = None, text: Optional[str] = None):
+        self.kind = kind
+        self.locations = [location]
+        self.method = method
+        self.endpoint = endpoint
+        self.body = body
+        self.response_type = response_type
+        self.text = text
+        content = json.dumps([kind, method, endpoint, body, response_type, text])
+        self.digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @property
+    def summary(self) -> str:
+        if self.kind == 'request':
+            return f"{self.method} {self.endpoint}"
+        if self.kind == 'curl':
+            return 'cURL snippet'
+        match = RESOURCE_TYPE.search(self.text or '')
+        return f"JSON {match.group(1) if match else 'example'}"
+
+    def not_executable(self) -> Optional[str]:
+        """Why the example cannot be run, or None"""
+        if self.kind == 'json':
+            return 'JSON fragment' if '...' in self.text else None
+        if self.kind == 'curl':
+            # Reported as a failed check rather than silently dropped
+            return None
+        if self.endpoint.startswith('http'):
+            return 'other server'
+        if PLACEHOLDER.search(self.endpoint) or (self.body and '...' in self.body):
+            return 'placeholder values'
+        if self.method == 'GET' or (self.method == 'POST' and '$' in self.endpoint):
+            return None
+        if self.method == 'POST' and DOC_EXAMPLES_WRITE:
+            return None
+        return 'writes data (set DOC_EXAMPLES_WRITE=true)' if self.method == 'POST' else f'{self.method} of an example id'
+
+
+def fenced_blocks(lines: List[str]) -> List[Tuple[int, int, str, str]]:
+    """(first line, last line, language, text) of every ``` block and <pre><code> cURL tab, 1-based"""
+    blocks = []
+    start = None
+    for number, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if start is None and stripped.startswith('```'):
+            start, language = number, stripped[3:].strip()
+        elif start is not None and stripped.startswith('```'):
+            blocks.append((start, number, language, '\n'.join(lines[start:number - 1])))
+            start = None
+        elif start is None and stripped.startswith('<pre><code class="language-bash">'):
+            end = next((n for n in range(number, len(lines) + 1) if '</code></pre>' in lines[n - 1]), number)
+            text = '\n'.join(lines[number - 1:end])
+            text = text.split('<pre><code class="language-bash">', 1)[1].split('</code></pre>', 1)[0]
+            blocks.append((number, end, 'curl', html.unescape(text)))
+    return blocks
+
+
+def _endpoint(url: str) -> str:
+    if url.startswith(DOC_BASE_URL):
+        url = url[len(DOC_BASE_URL):]
+    return url if url.startswith(('/', 'http')) else f'/{url}'
+
+
+def _curl_requests(text: str) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    (method, url, body) of each curl command in a shell snippet. The whole snippet is tokenized at
+    once so a quoted multi-line -d body stays one argument; raises ValueError when it cannot be parsed.
+    """
+    tokens = shlex.split(re.sub(r'\\\n', ' ', text), comments=True)
+    commands: List[List[str]] = []
+    for token in tokens:
+        if token == 'curl':
+            commands.append([])
+        elif commands:
+            commands[-1].append(token)
+    found = []
+    for args in commands:
+        method, url, body = None, None, None
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ('-X', '--request') and i + 1 < len(args):
+                method = args[i + 1]
+                i += 1
+            elif arg in ('-d', '--data', '--data-raw') and i + 1 < len(args):
+                body = args[i + 1]
+                i += 1
+            elif arg in ('-H', '--header', '-u', '-o'):
+                i += 1
+            elif not arg.startswith('-') and url is None:
+                url = arg
+            i += 1
+        if not url:
+            raise ValueError(f"curl command without a URL: curl {' '.join(args)[:60]}")
+        # shlex keeps the backslash of "\$expand" inside double quotes
+        found.append((method or ('POST' if body else 'GET'), url.replace('\\$', '$'), body))
+    return found
+
+
+def extract_page(path: str, label: str) -> List[DocExample]:
+    """Examples of one markdown page; label is the page name shown in check names"""
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    blocks = fenced_blocks(lines)
+    examples = []
+
+    def between(a: int, b: int) -> str:
+        return '\n'.join(lines[a:b - 1])
+
+    for index, (start, end, language, text) in enumerate(blocks):
+        location = f"{label}:{start}"
+        if language == 'json':
+            examples.append(DocExample('json', location, text=text.strip()))
+            continue
+        if language == 'curl':
+            try:
+                parsed = _curl_requests(text)
+            except ValueError as e:
+                examples.append(DocExample('curl', location, body=str(e), text=text))
+                continue
+            for method, url, body in parsed:
+                examples.append(DocExample('request', location, method, _endpoint(url), body))
+            continue
+        if language not in ('', 'http'):
+            continue
+
+        head, _, inline_body = text.strip().partition('\n\n')
+        match = REQUEST_LINE.match(head)
+        if not match:
+            continue
+        method, url = match.groups()
+        body = inline_body.strip() or None
+        following = [b for b in blocks[index + 1:index + 3] if b[2] == 'json']
+        response_type = None
+        for next_start, next_end, _, next_text in following:
+            gap = between(end, next_start)
+            if next_start - end > NEARBY_LINES or REQUEST_LINE.search(gap):
+                break
+            if RESPONSE_LABEL.search(gap):
+                type_match = RESOURCE_TYPE.search(next_text)
+                response_type = type_match.group(1) if type_match else None
+                break
+            if body is None and method in ('POST', 'PUT'):
+                body = next_text.strip()
+                end = next_end
+        examples.append(DocExample('request', location, method, _endpoint(url), body, response_type))
+    return examples
+
+
+def extract_examples() -> List[DocExample]:
+    """Distinct examples of all pages; an example repeated in a translation is kept once"""
+    by_digest: Dict[str, DocExample] = {}
+    for directory in PAGE_DIRS:
+        prefix = '' if directory == PAGE_DIRS[0] else 'ru/'
+        for path in sorted(glob.glob(os.path.join(directory, '*.md'))):
+            for example in extract_page(path, prefix + os.path.basename(path)):
+                if example.digest in by_digest:
+                    by_digest[example.digest].locations.extend(example.locations)
+                else:
+                    by_digest[example.digest] = example
+    return list(by_digest.values())
+
+
+def split_endpoint(endpoint: str) -> Tuple[str, Dict]:
+    """Path and params of a documented URL; repeated parameters become lists"""
+    path, _, query = endpoint.partition('?')
+    params: Dict = {}
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        if key in params:
+            params[key] = params[key] + [value] if isinstance(params[key], list) else [params[key], value]
+        else:
+            params[key] = value
+    return path, params
+
+
+# Content keys of examples that passed, with the time they passed (loaded from DOC_EXAMPLES_CACHE)
+_passed: Dict[str, str] = {}
+_passed_lock = threading.Lock()
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def load_cache():
+    _passed.clear()
+    if DOC_EXAMPLES_CACHE and os.path.exists(DOC_EXAMPLES_CACHE):
+        with open(DOC_EXAMPLES_CACHE, encoding='utf-8') as f:
+            _passed.update(json.load(f))
+
+
+def save_cache():
+    if DOC_EXAMPLES_CACHE:
+        with open(DOC_EXAMPLES_CACHE, 'w', encoding='utf-8') as f:
+            json.dump(_passed, f, indent=0, sort_keys=True)
+
+
+def profile_rules():
+    """Compiled uz-core rules for JSON examples, or None when no profiles are available offline"""
+    global _rules
+    with _rules_lock:
+        if _rules is None:
+            from profile_validator import compile_rules
+            try:
+                _rules = compile_rules(verbose=False)
+            except OSError:
+                _rules = {'profiles': {}}
+        return _rules if _rules['profiles'] else None
+
+
+def check_json(example: DocExample, results: TestResults, name: str):
+    try:
+        resource = json.loads(example.text)
+    except ValueError as e:
+        results.add_fail(name, f"Invalid JSON: {e}")
+        return
+    rules = profile_rules()
+    if rules and isinstance(resource, dict):
+        from profile_validator import validate_resource, ERROR
+        _, issues = validate_resource(resource, rules)
+        errors = [f"{element}: {message}" for severity, element, message in issues if severity == ERROR]
+        if errors:
+            results.add_fail(name, '; '.join(errors[:3]))
+            return
+    results.add_pass(name)
+
+
+def check_request(example: DocExample, results: TestResults, name: str):
+    path, params = split_endpoint(example.endpoint)
+    body = None
+    if example.body:
+        try:
+            body = json.loads(example.body)
+        except ValueError as e:
+            results.add_fail(name, f"Invalid JSON request body: {e}")
+            return
+    response = make_request(example.method, path, data=body, params=params or None)
+    status = response.status_code
+
+    if example.response_type == 'OperationOutcome':
+        if 400 <= status < 500:
+            results.add_pass(name)
+        else:
+            results.add_fail(name, f"Documented as an error, got status {status}")
+        return
+    if status in (404, 410) and not params and path.count('/') == 2 and '$' not in path:
+        results.add_skip(name, f"Example id not on this server (status {status})")
+        return
+    expected = 201 if example.method == 'POST' and '$' not in path else 200
+    if status != expected:
+        results.add_fail(name, f"Expected {expected}, got {status}")
+        return
+    if example.response_type:
+        try:
+            actual = response.json().get('resourceType')
+        except ValueError:
+            actual = None
+        if actual != example.response_type:
+            results.add_fail(name, f"Documented response is {example.response_type}, got {actual}")
+            return
+    results.add_pass(name)
+
+
+DOCS = Scenario('docs', 'Documentation Example Tests')
+EXAMPLES = extract_examples()
+NOT_EXECUTABLE: Dict[str, int] = {}
+
+
+def register(example: DocExample):
+    name = f"{example.locations[0]} {example.summary}"[:120]
+    if any(check.name == name for check in DOCS.checks):
+        name = f"{name} #{len(DOCS.checks)}"
+
+    @DOCS.check(name, section="Documentation Examples")
+    def run_example(ctx: CheckContext, results: TestResults):
+        if example.kind == 'curl':
+            results.add_fail(name, f"Could not parse cURL snippet: {example.body}")
+            return
+        # Requests depend on the server, JSON checks on the compiled profile rules
+        if example.kind == 'request':
+            key = f"{example.digest}|{BASE_URL}"
+        else:
+            rules = profile_rules()
+            key = f"{example.digest}|{os.path.basename(rules['cache_path']) if rules else ''}"
+        if key in _passed:
+            results.add_pass(f"{name} (unchanged since {_passed[key][:10]})")
+            return
+        if len(example.locations) > 1:
+            print(f"  {Colors.CYAN}→ Also in {', '.join(example.locations[1:])}{Colors.RESET}")
+        if example.kind == 'request':
+            check_request(example, results, name)
+        else:
+            check_json(example, results, name)
+        if results.passed and not results.failed:
+            with _passed_lock:
+                _passed[key] = datetime.now(timezone.utc).isoformat()
+
+
+for _example in EXAMPLES:
+    _reason = _example.not_executable()
+    if _reason:
+        NOT_EXECUTABLE[_reason] = NOT_EXECUTABLE.get(_reason, 0) + 1
+    else:
+        register(_example)
+
+
+def run_doc_example_tests(shared: Optional[SharedFixtures] = None, patterns: Optional[List[str]] = None,
+                          workers: int = 1) -> TestResults:
+    """
+    Run the documentation examples, or only those matching patterns.
+    Examples that passed before with the same content are not sent again.
+    """
+    load_cache()
+    skipped = ', '.join(f"{count} {reason}" for reason, count in sorted(NOT_EXECUTABLE.items()))
+    print(f"{Colors.CYAN}{len(EXAMPLES)} distinct examples, {len(DOCS.checks)} executable"
+          f"{f' (not run: {skipped})' if skipped else ''}{Colors.RESET}")
+    try:
+        return DOCS.run(shared, patterns, workers)
+    finally:
+        save_cache()
+
+
+if __name__ == '__main__':
+    results = run_doc_example_tests()
+    results.print_summary()
+    exit(0 if results.failed == 0 else 1)
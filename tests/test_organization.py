@@ -2,74 +2,27 @@
 Tests for Organization resource
 Based on examples from organization-management.md
 """
-import time
+import os
+from typing import List, Optional
 from test_utils import (
     TestResults, make_request, create_resource, read_resource,
     update_resource, delete_resource, search_resources,
     assert_status_code, assert_resource_exists, assert_no_resources,
     Colors
 )
-from config import TEST_IDENTIFIER_PREFIX, CLEANUP_AFTER_TESTS
+from checks import Scenario, CheckContext
+from directory_replica import DirectoryReplica
+from org_hierarchy import OrgHierarchy
+from config import TEST_IDENTIFIER_PREFIX, DIRECTORY_DB
+from fixtures import SharedFixtures
 
 
-def run_organization_tests() -> TestResults:
-    """Run all organization tests"""
-    results = TestResults()
-    created_resources = []
+ORGANIZATION = Scenario('organization', 'Organization Tests')
 
-    print(f"\n{Colors.BOLD}=== Organization Tests ==={Colors.RESET}\n")
 
-    # Setup: Create test organization for name search
-    print(f"\n{Colors.BOLD}Search Tests Setup{Colors.RESET}")
-    fergana_org = {
-        "resourceType": "Organization",
-        "meta": {
-            "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-organization"]
-        },
-        "identifier": [
-            {
-                "system": "https://dhp.uz/fhir/core/sid/org/uz/soliq",
-                "type": {
-                    "coding": [
-                        {"system": "http://terminology.hl7.org/CodeSystem/v2-0203", "code": "TAX"}
-                    ]
-                },
-                "value": f"{TEST_IDENTIFIER_PREFIX}fergana-test-999"
-            }
-        ],
-        "active": True,
-        "type": [
-            {
-                "coding": [
-                    {
-                        "system": "http://terminology.hl7.org/CodeSystem/organization-type",
-                        "code": "prov",
-                        "display": "Healthcare Provider"
-                    }
-                ]
-            }
-        ],
-        "language": "uz",
-        "name": f"{TEST_IDENTIFIER_PREFIX}Fergana Regional Hospital"
-    }
-
-    response = make_request('POST', '/Organization', data=fergana_org)
-    test_org_exact_name = None
-    if response.status_code == 201:
-        fergana_org_created = response.json()
-        created_resources.append(('Organization', fergana_org_created['id']))
-        test_org_exact_name = fergana_org_created.get('name', f"{TEST_IDENTIFIER_PREFIX}Fergana Regional Hospital")
-        results.add_pass("Create test organization for name search")
-
-        # Wait 5 seconds for indexing
-        print(f"{Colors.BLUE}Waiting 5 seconds for server indexing...{Colors.RESET}")
-        time.sleep(5)
-    else:
-        results.add_fail("Create test organization", f"Status {response.status_code}")
-
-    print(f"\n{Colors.BOLD}Search Tests{Colors.RESET}")
-
-    # Test 1: Search for organization by soliq ID (positive test - should exist)
+# Test 1: Search for organization by soliq ID (positive test - should exist)
+@ORGANIZATION.check("Search organization by soliq ID", section="Search Tests")
+def search_by_soliq_id(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={
         'identifier': 'https://dhp.uz/fhir/core/sid/org/uz/soliq|123456789'
     })
@@ -86,7 +39,10 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail("Search organization by soliq ID", f"Status {response.status_code}")
 
-    # Test 2: Search by name with :contains modifier (substring match)
+
+# Test 2: Search by name with :contains modifier (substring match)
+@ORGANIZATION.check("Search organization by name:contains")
+def search_by_name_contains(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={'name:contains': 'Fergana'})
     if response.status_code == 200:
         bundle = response.json()
@@ -100,7 +56,13 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail("Search organization by name:contains", f"Status {response.status_code}")
 
-    # Test 3: Search with exact name match (using our test org)
+
+# Test 3: Search with exact name match (using our test org)
+@ORGANIZATION.check("Search organization by exact name", shared=True)
+def search_by_exact_name(ctx: CheckContext, results: TestResults):
+    # Shared test organization (created once per run and already indexed)
+    shared_org = ctx.shared.organization if ctx.shared else None
+    test_org_exact_name = shared_org.get('name') if shared_org else None
     if test_org_exact_name:
         response = make_request('GET', '/Organization', params={'name:exact': test_org_exact_name})
         if response.status_code == 200:
@@ -117,7 +79,10 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_skip('Search organization by exact name', 'Test org not created')
 
-    # Test 4: Search by type
+
+# Test 4: Search by type
+@ORGANIZATION.check("Search organization by type")
+def search_by_type(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={'type': 'prov'})
     if response.status_code == 200:
         bundle = response.json()
@@ -125,7 +90,10 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail("Search organization by type", f"Status {response.status_code}")
 
-    # Test 5: Search active organizations
+
+# Test 5: Search active organizations
+@ORGANIZATION.check("Search active organizations")
+def search_active(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={'active': 'true'})
     if response.status_code == 200:
         bundle = response.json()
@@ -133,14 +101,20 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail("Search active organizations", f"Status {response.status_code}")
 
-    # Test 6: Combining parameters (AND) with :contains modifier
+
+# Test 6: Combining parameters (AND) with :contains modifier
+@ORGANIZATION.check("Search with combined parameters (AND)")
+def search_combined_and(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={
         'name:contains': 'Hospital',
         'active': 'true'
     })
     assert_status_code(response, 200, 'Search with combined parameters (AND)', results)
 
-    # Test 7: Multiple values (OR)
+
+# Test 7: Multiple values (OR)
+@ORGANIZATION.check("Search with multiple values (OR)")
+def search_multiple_values_or(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={
         'type': 'prov,dept'
     })
@@ -150,7 +124,10 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail("Search with multiple values", f"Status {response.status_code}")
 
-    # Test 8: Search departments of an organization (if we can find a parent org)
+
+# Test 8: Search departments of an organization (if we can find a parent org)
+@ORGANIZATION.check("Search for departments (partof)")
+def search_departments(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={'type': 'prov', '_count': '1'})
     if response.status_code == 200:
         bundle = response.json()
@@ -167,10 +144,10 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail("Search for departments", f"Status {response.status_code}")
 
-    # CRUD Operations Tests
-    print(f"\n{Colors.BOLD}CRUD Operations{Colors.RESET}")
 
-    # Test 9: Create organization
+# Test 9: Create organization
+@ORGANIZATION.check("Create organization", section="CRUD Operations")
+def create_organization(ctx: CheckContext, results: TestResults):
     test_org = {
         "resourceType": "Organization",
         "meta": {
@@ -206,47 +183,55 @@ def run_organization_tests() -> TestResults:
     response = make_request('POST', '/Organization', data=test_org)
     if response.status_code == 201:
         created_org = response.json()
-        created_resources.append(('Organization', created_org['id']))
+        ctx['organization_id'] = created_org['id']
         results.add_pass("Create organization")
+    else:
+        results.add_fail("Create organization", f"Status {response.status_code}")
+
 
-        # Test 10: Read organization
-        org_id = created_org['id']
-        response = make_request('GET', f'/Organization/{org_id}',
-                              highlight_fields=['name', 'id', 'active'])
+# Test 10: Read organization
+@ORGANIZATION.check("Read organization by ID", depends=["Create organization"])
+def read_organization(ctx: CheckContext, results: TestResults):
+    org_id = ctx['organization_id']
+    response = make_request('GET', f'/Organization/{org_id}',
+                          highlight_fields=['name', 'id', 'active'])
+    if response.status_code == 200:
+        results.add_pass("Read organization by ID")
+        ctx['organization'] = response.json()
+    else:
+        results.add_fail("Read organization by ID", f"Status {response.status_code}")
+
+
+# Test 11: Update organization
+@ORGANIZATION.check("Update organization", depends=["Read organization by ID"])
+def update_organization(ctx: CheckContext, results: TestResults):
+    org_id = ctx['organization_id']
+    read_org = ctx['organization']
+    read_org['name'] = f"{TEST_IDENTIFIER_PREFIX}Updated Test Organization"
+    version = read_org['meta']['versionId']
+
+    response = make_request('PUT', f'/Organization/{org_id}',
+                          data=read_org,
+                          headers={'If-Match': f'W/"{version}"'},
+                          highlight_fields=['name'])
+    if response.status_code == 200:
+        results.add_pass("Update organization")
+
+        # Verify update
+        response = make_request('GET', f'/Organization/{org_id}')
         if response.status_code == 200:
-            results.add_pass("Read organization by ID")
-            read_org = response.json()
-
-            # Test 11: Update organization
-            read_org['name'] = f"{TEST_IDENTIFIER_PREFIX}Updated Test Organization"
-            version = read_org['meta']['versionId']
-
-            response = make_request('PUT', f'/Organization/{org_id}',
-                                  data=read_org,
-                                  headers={'If-Match': f'W/"{version}"'},
-                                  highlight_fields=['name'])
-            if response.status_code == 200:
-                results.add_pass("Update organization")
-
-                # Verify update
-                response = make_request('GET', f'/Organization/{org_id}')
-                if response.status_code == 200:
-                    updated_org = response.json()
-                    if updated_org['name'] == f"{TEST_IDENTIFIER_PREFIX}Updated Test Organization":
-                        results.add_pass("Verify organization update")
-                    else:
-                        results.add_fail("Verify organization update", "Name not updated")
+            updated_org = response.json()
+            if updated_org['name'] == f"{TEST_IDENTIFIER_PREFIX}Updated Test Organization":
+                results.add_pass("Verify organization update")
             else:
-                results.add_fail("Update organization", f"Status {response.status_code}")
-        else:
-            results.add_fail("Read organization by ID", f"Status {response.status_code}")
+                results.add_fail("Verify organization update", "Name not updated")
     else:
-        results.add_fail("Create organization", f"Status {response.status_code}")
+        results.add_fail("Update organization", f"Status {response.status_code}")
 
-    # Negative Tests
-    print(f"\n{Colors.BOLD}Negative Tests{Colors.RESET}")
 
-    # Test 12: Read non-existent organization (accept both 400 and 404)
+# Test 12: Read non-existent organization (accept both 400 and 404)
+@ORGANIZATION.check("Read non-existent organization", section="Negative Tests")
+def read_nonexistent(ctx: CheckContext, results: TestResults):
     # 400 = Invalid ID format, 404 = Valid format but doesn't exist
     response = make_request('GET', '/Organization/nonexistent-id-12345')
     if response.status_code in [400, 404]:
@@ -254,7 +239,10 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail('Read non-existent organization', f"Expected 400 or 404, got {response.status_code}")
 
-    # Test 13: Search with invalid parameter
+
+# Test 13: Search with invalid parameter
+@ORGANIZATION.check("Search non-existent organization name")
+def search_nonexistent_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Organization', params={
         'name': 'XYZ_NONEXISTENT_ORG_NAME_12345'
     })
@@ -264,31 +252,86 @@ def run_organization_tests() -> TestResults:
     else:
         results.add_fail("Search non-existent organization", f"Status {response.status_code}")
 
-    # Test 14: Update without If-Match header (should fail with 412)
-    if created_resources:
-        org_id = created_resources[0][1]
-        response = make_request('GET', f'/Organization/{org_id}')
-        if response.status_code == 200:
-            org_data = response.json()
-            org_data['name'] = "Should fail without version"
 
-            response = make_request('PUT', f'/Organization/{org_id}', data=org_data)
-            if response.status_code == 412:
-                results.add_pass("Update without If-Match header (correctly fails)")
-            else:
-                results.add_fail("Update without If-Match", f"Expected 412, got {response.status_code}")
-
-    # Cleanup
-    if CLEANUP_AFTER_TESTS:
-        print(f"\n{Colors.BOLD}Cleanup{Colors.RESET}")
-        for resource_type, resource_id in created_resources:
-            response = make_request('DELETE', f'/{resource_type}/{resource_id}')
-            if response.status_code == 200:
-                results.add_pass(f"Delete {resource_type}/{resource_id}")
-            else:
-                results.add_fail(f"Delete {resource_type}/{resource_id}", f"Status {response.status_code}")
+# Test 14: Update without If-Match header (should fail with 412)
+@ORGANIZATION.check("Update without If-Match header", depends=["Create organization"])
+def update_without_if_match(ctx: CheckContext, results: TestResults):
+    org_id = ctx['organization_id']
+    response = make_request('GET', f'/Organization/{org_id}')
+    if response.status_code == 200:
+        org_data = response.json()
+        org_data['name'] = "Should fail without version"
+
+        response = make_request('PUT', f'/Organization/{org_id}', data=org_data)
+        if response.status_code == 412:
+            results.add_pass("Update without If-Match header (correctly fails)")
+        else:
+            results.add_fail("Update without If-Match", f"Expected 412, got {response.status_code}")
+
+
+# Test 15: The local directory replica answers name:contains like the server
+@ORGANIZATION.check("Search name:contains in local directory replica")
+def search_name_contains_in_replica(ctx: CheckContext, results: TestResults):
+    if not os.path.exists(DIRECTORY_DB):
+        results.add_skip("Search in local directory replica", f"No replica at {DIRECTORY_DB} (run directory_replica.py sync)")
+        return
+    params = {'name:contains': 'Fergana', '_count': '50'}
+    replica = DirectoryReplica(DIRECTORY_DB)
+    try:
+        replica.sync()
+        local = replica.search('Organization', params)
+    finally:
+        replica.close()
+    server = search_resources('Organization', params)
+    if server is None:
+        results.add_skip("Search in local directory replica", "Server search failed")
+        return
+    local_ids = {e['resource']['id'] for e in local['entry']}
+    server_ids = {e['resource']['id'] for e in server.get('entry', []) if e.get('resource', {}).get('resourceType') == 'Organization'}
+    server_total = server.get('total', len(server_ids))
+    print(f"  {Colors.CYAN}→ Replica: {local['total']} match(es), server: {server_total}{Colors.RESET}")
+    # Past one page the two may sort differently, so only the totals are compared
+    if local_ids == server_ids or (server_total > 50 and local['total'] == server_total):
+        results.add_pass("Search name:contains in local directory replica")
+    else:
+        results.add_fail("Search in local directory replica",
+                         f"Only in replica: {sorted(local_ids - server_ids)[:3]}, only on server: {sorted(server_ids - local_ids)[:3]}")
+
+
+# Test 16: Whole hierarchy in a few requests, direct children agree with a partof search
+@ORGANIZATION.check("Load organization hierarchy into closure table")
+def load_organization_hierarchy(ctx: CheckContext, results: TestResults):
+    bundle = search_resources('Organization', {'type': 'prov', '_count': '1'})
+    roots = [e['resource'] for e in (bundle or {}).get('entry', []) if e.get('resource', {}).get('resourceType') == 'Organization']
+    if not roots:
+        results.add_skip("Load organization hierarchy", "No parent org found")
+        return
+    root_id = roots[0]['id']
+    hierarchy = OrgHierarchy(':memory:')
+    info = hierarchy.load(root_id)
+    children = {org['id'] for org in hierarchy.descendants(root_id, max_depth=1)}
+    hierarchy.close()
+    if info is None:
+        results.add_fail("Load organization hierarchy", f"Root Organization/{root_id} not found by _id")
+        return
+    print(f"  {Colors.CYAN}→ {info['nodes']} organization(s) in {info['requests']} request(s) ({info['method']}){Colors.RESET}")
+    bundle = search_resources('Organization', {'partof': f'Organization/{root_id}', '_count': '100'})
+    expected = {e['resource']['id'] for e in (bundle or {}).get('entry', []) if e.get('resource', {}).get('resourceType') == 'Organization'}
+    if bundle is None:
+        results.add_skip("Load organization hierarchy", "partof search failed")
+    elif children == expected or (len(expected) == 100 and expected <= children):
+        results.add_pass("Load organization hierarchy into closure table")
+    else:
+        results.add_fail("Load organization hierarchy", f"{len(children)} direct children in the tree, partof search found {len(expected)}")
+
 
-    return results
+def run_organization_tests(shared: Optional[SharedFixtures] = None, patterns: Optional[List[str]] = None,
+                           workers: int = 1) -> TestResults:
+    """
+    Run all organization tests, or only the checks matching patterns.
+    The shared fixtures are created here when none are passed.
+    """
+    return ORGANIZATION.run(shared, patterns, workers)
 
 
 if __name__ == '__main__':
@@ -3,77 +3,28 @@ Tests for Patient resource
 Based on examples from patient-registration.md
 Includes comprehensive duplicate detection and matching tests
 """
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from test_utils import (
     TestResults, make_request, create_resource, read_resource,
     update_resource, delete_resource, search_resources,
     assert_status_code, assert_resource_exists, assert_no_resources,
     extract_entries, Colors
 )
-from config import TEST_IDENTIFIER_PREFIX, CLEANUP_AFTER_TESTS
+from checks import Scenario, CheckContext
+from config import TEST_IDENTIFIER_PREFIX
+from fixtures import SharedFixtures, SHARED_PATIENT_PINFL
 
 
-def run_patient_tests() -> TestResults:
-    """Run all patient registration and duplicate detection tests"""
-    results = TestResults()
-    created_resources = []
+PATIENT = Scenario('patient', 'Patient Registration Tests')
 
-    print(f"\n{Colors.BOLD}=== Patient Registration Tests ==={Colors.RESET}\n")
 
-    # Setup: Create test patient first for search tests
-    print(f"\n{Colors.BOLD}Search Tests Setup{Colors.RESET}")
-    test_pinfl = f"{TEST_IDENTIFIER_PREFIX}search-12345678901234"
-    search_test_patient = {
-        "resourceType": "Patient",
-        "meta": {
-            "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-patient"]
-        },
-        "language": "uz",
-        "identifier": [
-            {
-                "use": "official",
-                "type": {
-                    "coding": [
-                        {
-                            "system": "http://terminology.hl7.org/CodeSystem/v2-0203",
-                            "code": "NI"
-                        }
-                    ]
-                },
-                "system": "https://dhp.uz/fhir/core/sid/pid/uz/ni",
-                "value": test_pinfl
-            }
-        ],
-        "active": True,
-        "name": [
-            {
-                "use": "official",
-                "family": f"{TEST_IDENTIFIER_PREFIX}SearchTest",
-                "given": ["Test", "Patient"]
-            }
-        ],
-        "gender": "male",
-        "birthDate": "1985-05-15"
-    }
-
-    response = make_request('POST', '/Patient', data=search_test_patient)
-    test_patient_id = None
-    if response.status_code == 201:
-        created_patient = response.json()
-        test_patient_id = created_patient['id']
-        created_resources.append(('Patient', test_patient_id))
-        results.add_pass("Create test patient for search tests")
-
-        # Wait for indexing
-        print(f"{Colors.BLUE}Waiting 5 seconds for server indexing...{Colors.RESET}")
-        import time
-        time.sleep(5)
-    else:
-        results.add_fail("Create test patient", f"Status {response.status_code}")
-
-    # Search Tests
-    print(f"\n{Colors.BOLD}Patient Search Tests{Colors.RESET}")
-
-    # Test 1: Search patient by PINFL (using our test data)
+# Test 1: Search patient by PINFL (using our test data)
+@PATIENT.check("Search patient by PINFL identifier", section="Patient Search Tests", shared=True)
+def search_by_pinfl(ctx: CheckContext, results: TestResults):
+    # Shared test patient (created once per run and already indexed)
+    test_pinfl = SHARED_PATIENT_PINFL if ctx.shared.patient else None
     if test_pinfl:
         response = make_request('GET', '/Patient', params={
             'identifier': f'https://dhp.uz/fhir/core/sid/pid/uz/ni|{test_pinfl}'
@@ -94,7 +45,10 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail('Search patient by PINFL identifier', f"Status {response.status_code}")
 
-    # Test 2: Search patient by name with :contains modifier (using our test data)
+
+# Test 2: Search patient by name with :contains modifier (using our test data)
+@PATIENT.check("Search patient by name", shared=True)
+def search_by_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={'name:contains': f'{TEST_IDENTIFIER_PREFIX}SearchTest'})
     if response.status_code == 200:
         bundle = response.json()
@@ -108,7 +62,10 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail('Search patient by name', f"Status {response.status_code}")
 
-    # Test 3: Search by given name with :contains modifier (using our test data)
+
+# Test 3: Search by given name with :contains modifier (using our test data)
+@PATIENT.check("Search patient by given name", shared=True)
+def search_by_given_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={'given:contains': 'Test'})
     if response.status_code == 200:
         bundle = response.json()
@@ -122,7 +79,10 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail('Search patient by given name', f"Status {response.status_code}")
 
-    # Test 4: Search by family name with :contains modifier (using our test data)
+
+# Test 4: Search by family name with :contains modifier (using our test data)
+@PATIENT.check("Search patient by family name", shared=True)
+def search_by_family_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={'family:contains': f'{TEST_IDENTIFIER_PREFIX}SearchTest'})
     if response.status_code == 200:
         bundle = response.json()
@@ -136,7 +96,10 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail('Search patient by family name', f"Status {response.status_code}")
 
-    # Test 5: Search by phone number
+
+# Test 5: Search by phone number
+@PATIENT.check("Search patient by phone")
+def search_by_phone(ctx: CheckContext, results: TestResults):
     # Note: Phone search appears to not work on this server (known limitation)
     # Even though patients have phone numbers, phone search returns no results
     response = make_request('GET', '/Patient', params={
@@ -154,22 +117,34 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail('Search patient by phone', f"Status {response.status_code}")
 
-    # Test 6: Search by birthdate
+
+# Test 6: Search by birthdate
+@PATIENT.check("Search patient by birthdate")
+def search_by_birthdate(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={'birthdate': '1985-05-15'})
     assert_status_code(response, 200, 'Search patient by birthdate', results)
 
-    # Test 7: Search by gender
+
+# Test 7: Search by gender
+@PATIENT.check("Search patient by gender")
+def search_by_gender(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={'gender': 'male'})
     assert_status_code(response, 200, 'Search patient by gender', results)
 
-    # Test 8: Search by address city (using actual city code from sample data)
+
+# Test 8: Search by address city (using actual city code from sample data)
+@PATIENT.check("Search patient by city code")
+def search_by_city(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={
         'address-city': '15010017',
         'active': 'true'
     })
     assert_status_code(response, 200, 'Search patient by city code', results)
 
-    # Test 9: Combined demographics search with :contains modifier
+
+# Test 9: Combined demographics search with :contains modifier
+@PATIENT.check("Search patient with combined demographics")
+def search_combined_demographics(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={
         'family:contains': 'Karimov',
         'given': 'Alisher',
@@ -177,23 +152,29 @@ def run_patient_tests() -> TestResults:
     })
     assert_status_code(response, 200, 'Search patient with combined demographics', results)
 
-    # Test 10: Search with date range
+
+# Test 10: Search with date range
+@PATIENT.check("Search patient with date range")
+def search_date_range(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={
         'birthdate': 'gt1980-01-01',
         'birthdate': 'lt1990-12-31'
     })
     assert_status_code(response, 200, 'Search patient with date range', results)
 
-    # Test 11: Search by organization
+
+# Test 11: Search by organization
+@PATIENT.check("Search patient by organization")
+def search_by_organization(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={
         'organization': 'Organization/123'
     })
     assert_status_code(response, 200, 'Search patient by organization', results)
 
-    # CRUD Operations
-    print(f"\n{Colors.BOLD}Patient CRUD Operations{Colors.RESET}")
 
-    # Test 12: Create patient
+# Test 12: Create patient
+@PATIENT.check("Create patient", section="Patient CRUD Operations")
+def create_patient(ctx: CheckContext, results: TestResults):
     test_patient = {
         "resourceType": "Patient",
         "meta": {
@@ -237,47 +218,55 @@ def run_patient_tests() -> TestResults:
     response = make_request('POST', '/Patient', data=test_patient)
     if response.status_code == 201:
         created_patient = response.json()
-        patient_id = created_patient['id']
-        created_resources.append(('Patient', patient_id))
+        ctx['patient_id'] = created_patient['id']
         results.add_pass("Create patient")
+    else:
+        results.add_fail("Create patient", f"Status {response.status_code}")
 
-        # Test 13: Read patient
-        response = make_request('GET', f'/Patient/{patient_id}',
-                              highlight_fields=['name', 'identifier', 'gender', 'birthDate'])
-        if response.status_code == 200:
-            results.add_pass("Read patient by ID")
-            read_patient = response.json()
 
-            # Test 14: Update patient
-            read_patient['name'][0]['given'] = ["UpdatedName"]
-            version = read_patient['meta']['versionId']
+# Test 13: Read patient
+@PATIENT.check("Read patient by ID", depends=["Create patient"])
+def read_patient(ctx: CheckContext, results: TestResults):
+    patient_id = ctx['patient_id']
+    response = make_request('GET', f'/Patient/{patient_id}',
+                          highlight_fields=['name', 'identifier', 'gender', 'birthDate'])
+    if response.status_code == 200:
+        results.add_pass("Read patient by ID")
+        ctx['patient'] = response.json()
+    else:
+        results.add_fail("Read patient", f"Status {response.status_code}")
 
-            response = make_request('PUT', f'/Patient/{patient_id}',
-                                  data=read_patient,
-                                  headers={'If-Match': f'W/"{version}"'},
-                                  highlight_fields=['name[0].given'])
-            if response.status_code == 200:
-                results.add_pass("Update patient")
 
-                # Verify update
-                response = make_request('GET', f'/Patient/{patient_id}')
-                if response.status_code == 200:
-                    updated_patient = response.json()
-                    if updated_patient['name'][0]['given'][0] == "UpdatedName":
-                        results.add_pass("Verify patient update")
-                    else:
-                        results.add_fail("Verify patient update", "Name not updated correctly")
+# Test 14: Update patient
+@PATIENT.check("Update patient", depends=["Read patient by ID"])
+def update_patient(ctx: CheckContext, results: TestResults):
+    patient_id = ctx['patient_id']
+    read_patient = ctx['patient']
+    read_patient['name'][0]['given'] = ["UpdatedName"]
+    version = read_patient['meta']['versionId']
+
+    response = make_request('PUT', f'/Patient/{patient_id}',
+                          data=read_patient,
+                          headers={'If-Match': f'W/"{version}"'},
+                          highlight_fields=['name[0].given'])
+    if response.status_code == 200:
+        results.add_pass("Update patient")
+
+        # Verify update
+        response = make_request('GET', f'/Patient/{patient_id}')
+        if response.status_code == 200:
+            updated_patient = response.json()
+            if updated_patient['name'][0]['given'][0] == "UpdatedName":
+                results.add_pass("Verify patient update")
             else:
-                results.add_fail("Update patient", f"Status {response.status_code}")
-        else:
-            results.add_fail("Read patient", f"Status {response.status_code}")
+                results.add_fail("Verify patient update", "Name not updated correctly")
     else:
-        results.add_fail("Create patient", f"Status {response.status_code}")
+        results.add_fail("Update patient", f"Status {response.status_code}")
 
-    # Duplicate Detection Tests
-    print(f"\n{Colors.BOLD}Duplicate Detection Tests{Colors.RESET}")
 
-    # Test 15: Search before create (by PINFL)
+# Test 15: Search before create (by PINFL)
+@PATIENT.check("Search before create", section="Duplicate Detection Tests")
+def search_before_create(ctx: CheckContext, results: TestResults):
     test_pinfl = f"{TEST_IDENTIFIER_PREFIX}98765432109876"
     response = make_request('GET', '/Patient', params={
         'identifier': f'https://dhp.uz/fhir/core/sid/pid/uz/ni|{test_pinfl}'
@@ -325,8 +314,7 @@ def run_patient_tests() -> TestResults:
             response = make_request('POST', '/Patient', data=duplicate_test_patient)
             if response.status_code == 201:
                 dup_patient = response.json()
-                dup_patient_id = dup_patient['id']
-                created_resources.append(('Patient', dup_patient_id))
+                ctx['duplicate_patient_id'] = dup_patient['id']
 
                 # Test 16: Search again to verify duplicate would be found
                 response = make_request('GET', '/Patient', params={
@@ -344,45 +332,52 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail("Search before create", f"Status {response.status_code}")
 
-    # Test 17: Create duplicate patient and link them
-    if len(created_resources) >= 2:
-        main_patient_id = created_resources[0][1]
-        dup_patient_id = created_resources[1][1]
 
-        # Mark duplicate as inactive and link to main
-        response = make_request('GET', f'/Patient/{dup_patient_id}')
+# Test 17: Create duplicate patient and link them
+@PATIENT.check("Link duplicate patient to main record", depends=["Create patient", "Search before create"])
+def link_duplicate(ctx: CheckContext, results: TestResults):
+    if 'duplicate_patient_id' not in ctx:
+        return
+    main_patient_id = ctx['patient_id']
+    dup_patient_id = ctx['duplicate_patient_id']
+
+    # Mark duplicate as inactive and link to main
+    response = make_request('GET', f'/Patient/{dup_patient_id}')
+    if response.status_code == 200:
+        dup_patient = response.json()
+        dup_patient['active'] = False
+        dup_patient['link'] = [
+            {
+                "other": {
+                    "reference": f"Patient/{main_patient_id}",
+                    "display": "Main patient record"
+                },
+                "type": "replaced-by"
+            }
+        ]
+        version = dup_patient['meta']['versionId']
+
+        response = make_request('PUT', f'/Patient/{dup_patient_id}',
+                              data=dup_patient,
+                              headers={'If-Match': f'W/"{version}"'})
         if response.status_code == 200:
-            dup_patient = response.json()
-            dup_patient['active'] = False
-            dup_patient['link'] = [
-                {
-                    "other": {
-                        "reference": f"Patient/{main_patient_id}",
-                        "display": "Main patient record"
-                    },
-                    "type": "replaced-by"
-                }
-            ]
-            version = dup_patient['meta']['versionId']
-
-            response = make_request('PUT', f'/Patient/{dup_patient_id}',
-                                  data=dup_patient,
-                                  headers={'If-Match': f'W/"{version}"'})
+            results.add_pass("Link duplicate patient to main record")
+
+            # Verify link was created
+            response = make_request('GET', f'/Patient/{dup_patient_id}')
             if response.status_code == 200:
-                results.add_pass("Link duplicate patient to main record")
+                linked_patient = response.json()
+                if 'link' in linked_patient and len(linked_patient['link']) > 0:
+                    results.add_pass("Verify patient link created")
+                else:
+                    results.add_fail("Verify patient link", "Link not found in resource")
+        else:
+            results.add_fail("Link duplicate patient", f"Status {response.status_code}")
 
-                # Verify link was created
-                response = make_request('GET', f'/Patient/{dup_patient_id}')
-                if response.status_code == 200:
-                    linked_patient = response.json()
-                    if 'link' in linked_patient and len(linked_patient['link']) > 0:
-                        results.add_pass("Verify patient link created")
-                    else:
-                        results.add_fail("Verify patient link", "Link not found in resource")
-            else:
-                results.add_fail("Link duplicate patient", f"Status {response.status_code}")
 
-    # Test 18: Search by demographics (substring matching) with :contains
+# Test 18: Search by demographics (substring matching) with :contains
+@PATIENT.check("Search by demographics for matching")
+def search_demographics_matching(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={
         'family:contains': f"{TEST_IDENTIFIER_PREFIX}Karimov",
         'birthdate': '1985-05-15',
@@ -390,7 +385,10 @@ def run_patient_tests() -> TestResults:
     })
     assert_status_code(response, 200, 'Search by demographics for matching', results)
 
-    # Test 19: Search by phone for matching
+
+# Test 19: Search by phone for matching
+@PATIENT.check("Search by phone for matching")
+def search_phone_matching(ctx: CheckContext, results: TestResults):
     # Note: Phone search doesn't work on this server, but we test that the endpoint accepts the parameter
     response = make_request('GET', '/Patient', params={
         'phone': f"{TEST_IDENTIFIER_PREFIX}%2B998901234567",
@@ -398,10 +396,10 @@ def run_patient_tests() -> TestResults:
     })
     assert_status_code(response, 200, 'Search by phone for matching', results)
 
-    # Negative Tests
-    print(f"\n{Colors.BOLD}Negative Tests{Colors.RESET}")
 
-    # Test 20: Read non-existent patient (accept both 400 and 404)
+# Test 20: Read non-existent patient (accept both 400 and 404)
+@PATIENT.check("Read non-existent patient", section="Negative Tests")
+def read_nonexistent(ctx: CheckContext, results: TestResults):
     # 400 = Invalid ID format, 404 = Valid format but doesn't exist
     response = make_request('GET', '/Patient/nonexistent-patient-xyz-12345')
     if response.status_code in [400, 404]:
@@ -409,7 +407,10 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail('Read non-existent patient', f"Expected 400 or 404, got {response.status_code}")
 
-    # Test 21: Search non-existent PINFL
+
+# Test 21: Search non-existent PINFL
+@PATIENT.check("Search non-existent PINFL")
+def search_nonexistent_pinfl(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={
         'identifier': 'https://dhp.uz/fhir/core/sid/pid/uz/ni|99999999999999'
     })
@@ -419,7 +420,10 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail("Search non-existent PINFL", f"Status {response.status_code}")
 
-    # Test 22: Search non-existent name
+
+# Test 22: Search non-existent name
+@PATIENT.check("Search non-existent patient name")
+def search_nonexistent_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={
         'name': 'NONEXISTENT_PATIENT_NAME_XYZ_12345'
     })
@@ -429,35 +433,65 @@ def run_patient_tests() -> TestResults:
     else:
         results.add_fail("Search non-existent name", f"Status {response.status_code}")
 
-    # Test 23: Search inactive patients
+
+# Test 23: Search inactive patients
+@PATIENT.check("Search inactive patients")
+def search_inactive(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Patient', params={'active': 'false'})
     assert_status_code(response, 200, 'Search inactive patients', results)
 
-    # Test 24: Update without If-Match (should fail)
-    if created_resources:
-        patient_id = created_resources[0][1]
-        response = make_request('GET', f'/Patient/{patient_id}')
-        if response.status_code == 200:
-            patient_data = response.json()
-            patient_data['name'][0]['given'] = ["ShouldFail"]
 
-            response = make_request('PUT', f'/Patient/{patient_id}', data=patient_data)
-            if response.status_code == 412:
-                results.add_pass("Update without If-Match (correctly fails)")
-            else:
-                results.add_fail("Update without If-Match", f"Expected 412, got {response.status_code}")
+# Test 24: Update without If-Match (should fail)
+@PATIENT.check("Update without If-Match", depends=["Create patient"])
+def update_without_if_match(ctx: CheckContext, results: TestResults):
+    patient_id = ctx['patient_id']
+    response = make_request('GET', f'/Patient/{patient_id}')
+    if response.status_code == 200:
+        patient_data = response.json()
+        patient_data['name'][0]['given'] = ["ShouldFail"]
+
+        response = make_request('PUT', f'/Patient/{patient_id}', data=patient_data)
+        if response.status_code == 412:
+            results.add_pass("Update without If-Match (correctly fails)")
+        else:
+            results.add_fail("Update without If-Match", f"Expected 412, got {response.status_code}")
+
+
+# Test 25: Two writers with the same version (exactly one may commit)
+@PATIENT.check("Concurrent If-Match updates", depends=["Update patient"])
+def concurrent_if_match_updates(ctx: CheckContext, results: TestResults):
+    patient_id = ctx['patient_id']
+    response = make_request('GET', f'/Patient/{patient_id}')
+    if response.status_code != 200:
+        results.add_fail("Concurrent If-Match updates", f"Read failed: status {response.status_code}")
+        return
+    patient = response.json()
+    version = patient.get('meta', {}).get('versionId')
+    if not version:
+        results.add_fail("Concurrent If-Match updates", "Read returned no meta.versionId")
+        return
+
+    def put(given: str) -> int:
+        data = dict(patient, name=[dict(patient['name'][0], given=[given])])
+        return make_request('PUT', f'/Patient/{patient_id}', data=data,
+                            headers={'If-Match': f'W/"{version}"'}).status_code
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, put, given) for given in ("WriterA", "WriterB")]
+        statuses = sorted(future.result() for future in futures)
+    if statuses in ([200, 409], [200, 412]):
+        results.add_pass("Concurrent If-Match updates (one commits, one gets a conflict)")
+    else:
+        results.add_fail("Concurrent If-Match updates", f"Expected one 200 and one 409/412, got {statuses}")
 
-    # Cleanup
-    if CLEANUP_AFTER_TESTS:
-        print(f"\n{Colors.BOLD}Cleanup{Colors.RESET}")
-        for resource_type, resource_id in created_resources:
-            response = make_request('DELETE', f'/{resource_type}/{resource_id}')
-            if response.status_code == 200:
-                results.add_pass(f"Delete {resource_type}/{resource_id}")
-            else:
-                results.add_fail(f"Delete {resource_type}/{resource_id}", f"Status {response.status_code}")
 
-    return results
+def run_patient_tests(shared: Optional[SharedFixtures] = None, patterns: Optional[List[str]] = None,
+                      workers: int = 1) -> TestResults:
+    """
+    Run all patient registration and duplicate detection tests, or only the checks matching patterns.
+    The shared fixtures are created here when none are passed.
+    """
+    return PATIENT.run(shared, patterns, workers)
 
 
 if __name__ == '__main__':
@@ -2,90 +2,28 @@
 Tests for Practitioner and PractitionerRole resources
 Based on examples from practitioner-practitionerrole-management.md
 """
+from typing import List, Optional
 from test_utils import (
     TestResults, make_request, create_resource, read_resource,
     update_resource, delete_resource, search_resources,
     assert_status_code, assert_resource_exists, assert_no_resources,
-    Colors
+    add_request_listener, remove_request_listener, Colors
+)
+from checks import Scenario, CheckContext, current_check
+from references import ReferenceResolver, id_chunks
+from config import TEST_IDENTIFIER_PREFIX
+from fixtures import (
+    SharedFixtures, SHARED_PRACTITIONER_ARGOS, SHARED_PRACTITIONER_PHONE, SHARED_PRACTITIONER_EMAIL
 )
-from config import TEST_IDENTIFIER_PREFIX, CLEANUP_AFTER_TESTS
 
 
-def run_practitioner_tests() -> TestResults:
-    """Run all practitioner and practitioner role tests"""
-    results = TestResults()
-    created_resources = []
+PRACTITIONER = Scenario('practitioner', 'Practitioner Tests')
 
-    print(f"\n{Colors.BOLD}=== Practitioner Tests ==={Colors.RESET}\n")
 
-    # Setup: Create test practitioner first for search tests
-    print(f"\n{Colors.BOLD}Search Tests Setup{Colors.RESET}")
-    test_argos_id = f"{TEST_IDENTIFIER_PREFIX}argos-12345678"
-    test_practitioner = {
-        "resourceType": "Practitioner",
-        "meta": {
-            "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-practitioner"]
-        },
-        "language": "uz",
-        "identifier": [
-            {
-                "use": "official",
-                "type": {
-                    "coding": [
-                        {
-                            "system": "http://terminology.hl7.org/CodeSystem/v2-0203",
-                            "code": "NI"
-                        }
-                    ]
-                },
-                "system": "https://dhp.uz/fhir/core/sid/pro/uz/argos",
-                "value": test_argos_id
-            }
-        ],
-        "active": True,
-        "name": [
-            {
-                "use": "official",
-                "family": f"{TEST_IDENTIFIER_PREFIX}TestPractitioner",
-                "given": ["Test", "Search"]
-            }
-        ],
-        "telecom": [
-            {
-                "system": "phone",
-                "value": f"{TEST_IDENTIFIER_PREFIX}+998901234567",
-                "use": "work"
-            },
-            {
-                "system": "email",
-                "value": f"{TEST_IDENTIFIER_PREFIX}doctor@example.com",
-                "use": "work"
-            }
-        ],
-        "gender": "male"
-    }
-
-    response = make_request('POST', '/Practitioner', data=test_practitioner)
-    test_practitioner_id = None
-    test_phone = f"{TEST_IDENTIFIER_PREFIX}+998901234567"
-    test_email = f"{TEST_IDENTIFIER_PREFIX}doctor@example.com"
-    if response.status_code == 201:
-        created_pract = response.json()
-        test_practitioner_id = created_pract['id']
-        created_resources.append(('Practitioner', test_practitioner_id))
-        results.add_pass("Create test practitioner for search tests")
-
-        # Wait for indexing
-        print(f"{Colors.BLUE}Waiting 5 seconds for server indexing...{Colors.RESET}")
-        import time
-        time.sleep(5)
-    else:
-        results.add_fail("Create test practitioner", f"Status {response.status_code}")
-
-    # Search Tests
-    print(f"\n{Colors.BOLD}Practitioner Search Tests{Colors.RESET}")
-
-    # Test 1: Search practitioner by ARGOS identifier (using our test data)
+# Test 1: Search practitioner by ARGOS identifier (using our test data)
+@PRACTITIONER.check("Search practitioner by ARGOS identifier", section="Practitioner Search Tests", shared=True)
+def search_by_argos_id(ctx: CheckContext, results: TestResults):
+    test_argos_id = SHARED_PRACTITIONER_ARGOS if ctx.shared.practitioner else None
     if test_argos_id:
         response = make_request('GET', '/Practitioner', params={
             'identifier': f'https://dhp.uz/fhir/core/sid/pro/uz/argos|{test_argos_id}'
@@ -104,7 +42,10 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_skip('Search practitioner by ARGOS identifier', 'Test practitioner not created')
 
-    # Test 2: Search practitioner by name with :contains modifier
+
+# Test 2: Search practitioner by name with :contains modifier
+@PRACTITIONER.check("Search practitioner by name")
+def search_by_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Practitioner', params={'name:contains': 'Karimov'})
     if response.status_code == 200:
         bundle = response.json()
@@ -112,15 +53,25 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_fail("Search practitioner by name", f"Status {response.status_code}")
 
-    # Test 3: Search by given name with :contains modifier
+
+# Test 3: Search by given name with :contains modifier
+@PRACTITIONER.check("Search practitioner by given name")
+def search_by_given_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Practitioner', params={'given:contains': 'Alisher'})
     assert_status_code(response, 200, 'Search practitioner by given name', results)
 
-    # Test 4: Search by family name with :contains modifier
+
+# Test 4: Search by family name with :contains modifier
+@PRACTITIONER.check("Search practitioner by family name")
+def search_by_family_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Practitioner', params={'family:contains': 'Karimov'})
     assert_status_code(response, 200, 'Search practitioner by family name', results)
 
-    # Test 5: Search by phone number (using our test data)
+
+# Test 5: Search by phone number (using our test data)
+@PRACTITIONER.check("Search practitioner by phone", shared=True)
+def search_by_phone(ctx: CheckContext, results: TestResults):
+    test_phone = SHARED_PRACTITIONER_PHONE if ctx.shared.practitioner else None
     # Note: Phone search appears to not work on this server (known limitation)
     # Even though practitioners have phone numbers, phone search returns no results
     if test_phone:
@@ -146,7 +97,11 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_fail('Search practitioner by phone', f"Status {response.status_code}")
 
-    # Test 6: Search by email (using our test data)
+
+# Test 6: Search by email (using our test data)
+@PRACTITIONER.check("Search practitioner by email", shared=True)
+def search_by_email(ctx: CheckContext, results: TestResults):
+    test_email = SHARED_PRACTITIONER_EMAIL if ctx.shared.practitioner else None
     if test_email:
         response = make_request('GET', '/Practitioner', params={
             'email': test_email
@@ -167,14 +122,20 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_fail('Search practitioner by email', f"Status {response.status_code}")
 
-    # Test 7: Search by address city (using actual city code from sample data)
+
+# Test 7: Search by address city (using actual city code from sample data)
+@PRACTITIONER.check("Search practitioner by city code")
+def search_by_city(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Practitioner', params={
         'address-city': '15010017',
         'active': 'true'
     })
     assert_status_code(response, 200, 'Search practitioner by city code', results)
 
-    # Test 8: Search by gender
+
+# Test 8: Search by gender
+@PRACTITIONER.check("Search practitioner by gender")
+def search_by_gender(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Practitioner', params={'gender': 'male'})
     if response.status_code == 200:
         bundle = response.json()
@@ -182,7 +143,10 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_fail("Search practitioner by gender", f"Status {response.status_code}")
 
-    # Test 9: Combined search parameters with :contains modifier
+
+# Test 9: Combined search parameters with :contains modifier
+@PRACTITIONER.check("Search practitioner with combined params")
+def search_combined(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Practitioner', params={
         'family:contains': 'Karimov',
         'address-city': '15010017',
@@ -190,10 +154,10 @@ def run_practitioner_tests() -> TestResults:
     })
     assert_status_code(response, 200, 'Search practitioner with combined params', results)
 
-    # CRUD Operations
-    print(f"\n{Colors.BOLD}Practitioner CRUD Operations{Colors.RESET}")
 
-    # Test 10: Create another practitioner for CRUD tests
+# Test 10: Create another practitioner for CRUD tests
+@PRACTITIONER.check("Create practitioner", section="Practitioner CRUD Operations")
+def create_practitioner(ctx: CheckContext, results: TestResults):
     crud_test_practitioner = {
         "resourceType": "Practitioner",
         "meta": {
@@ -242,36 +206,44 @@ def run_practitioner_tests() -> TestResults:
     response = make_request('POST', '/Practitioner', data=crud_test_practitioner)
     if response.status_code == 201:
         created_pract = response.json()
-        pract_id = created_pract['id']
-        created_resources.append(('Practitioner', pract_id))
+        ctx['practitioner_id'] = created_pract['id']
         results.add_pass("Create practitioner")
-
-        # Test 11: Read practitioner
-        response = make_request('GET', f'/Practitioner/{pract_id}')
-        if response.status_code == 200:
-            results.add_pass("Read practitioner by ID")
-
-            # Test 12: Update practitioner
-            read_pract = response.json()
-            read_pract['name'][0]['given'] = ["Updated", "Name"]
-            version = read_pract['meta']['versionId']
-
-            response = make_request('PUT', f'/Practitioner/{pract_id}',
-                                  data=read_pract,
-                                  headers={'If-Match': f'W/"{version}"'})
-            if response.status_code == 200:
-                results.add_pass("Update practitioner")
-            else:
-                results.add_fail("Update practitioner", f"Status {response.status_code}")
-        else:
-            results.add_fail("Read practitioner", f"Status {response.status_code}")
     else:
         results.add_fail("Create practitioner", f"Status {response.status_code}")
 
-    # PractitionerRole Tests
-    print(f"\n{Colors.BOLD}PractitionerRole Tests{Colors.RESET}")
 
-    # Test 13: Search for practitioner roles
+# Test 11: Read practitioner
+@PRACTITIONER.check("Read practitioner by ID", depends=["Create practitioner"])
+def read_practitioner(ctx: CheckContext, results: TestResults):
+    pract_id = ctx['practitioner_id']
+    response = make_request('GET', f'/Practitioner/{pract_id}')
+    if response.status_code == 200:
+        results.add_pass("Read practitioner by ID")
+        ctx['practitioner'] = response.json()
+    else:
+        results.add_fail("Read practitioner", f"Status {response.status_code}")
+
+
+# Test 12: Update practitioner
+@PRACTITIONER.check("Update practitioner", depends=["Read practitioner by ID"])
+def update_practitioner(ctx: CheckContext, results: TestResults):
+    pract_id = ctx['practitioner_id']
+    read_pract = ctx['practitioner']
+    read_pract['name'][0]['given'] = ["Updated", "Name"]
+    version = read_pract['meta']['versionId']
+
+    response = make_request('PUT', f'/Practitioner/{pract_id}',
+                          data=read_pract,
+                          headers={'If-Match': f'W/"{version}"'})
+    if response.status_code == 200:
+        results.add_pass("Update practitioner")
+    else:
+        results.add_fail("Update practitioner", f"Status {response.status_code}")
+
+
+# Test 13: Search for practitioner roles
+@PRACTITIONER.check("Search active practitioner roles", section="PractitionerRole Tests")
+def search_active_roles(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/PractitionerRole', params={'active': 'true'})
     if response.status_code == 200:
         bundle = response.json()
@@ -279,92 +251,105 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_fail("Search practitioner roles", f"Status {response.status_code}")
 
-    # Test 14: Search by practitioner reference
-    if created_resources and created_resources[0][0] == 'Practitioner':
-        pract_id = created_resources[0][1]
+
+# Test 14: Search by practitioner reference (using the shared test practitioner)
+@PRACTITIONER.check("Search practitioner roles by practitioner", shared=True)
+def search_roles_by_practitioner(ctx: CheckContext, results: TestResults):
+    if ctx.shared.practitioner:
+        pract_id = ctx.shared.practitioner['id']
         response = make_request('GET', '/PractitionerRole', params={
             'practitioner': f'Practitioner/{pract_id}'
         })
         assert_status_code(response, 200, 'Search practitioner roles by practitioner', results)
+    else:
+        results.add_skip('Search practitioner roles by practitioner', 'Shared test practitioner not created')
 
-    # Test 15: Search by organization
-    # First try to find an organization
-    response = make_request('GET', '/Organization', params={'_count': '1'})
-    if response.status_code == 200:
-        bundle = response.json()
-        entries = bundle.get('entry', [])
-        org_entries = [e for e in entries if e.get('resource', {}).get('resourceType') == 'Organization']
-        if len(org_entries) > 0:
-            org_id = org_entries[0]['resource']['id']
-
-            response = make_request('GET', '/PractitionerRole', params={
-                'organization': f'Organization/{org_id}'
-            })
-            assert_status_code(response, 200, 'Search practitioner roles by organization', results)
-
-            # Test 16: Create practitioner role
-            if created_resources and created_resources[0][0] == 'Practitioner':
-                pract_id = created_resources[0][1]
-
-                test_role = {
-                    "resourceType": "PractitionerRole",
-                    "meta": {
-                        "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-practitionerrole"]
-                    },
-                    "language": "uz",
-                    "active": True,
-                    "practitioner": {
-                        "reference": f"Practitioner/{pract_id}",
-                        "display": "Test Practitioner"
-                    },
-                    "organization": {
-                        "reference": f"Organization/{org_id}",
-                        "display": "Test Organization"
-                    },
-                    "code": [
-                        {
-                            "coding": [
-                                {
-                                    "system": "https://terminology.dhp.uz/fhir/core/CodeSystem/position-and-profession-cs",
-                                    "code": "2211.1",
-                                    "display": "General practitioner"
-                                }
-                            ]
-                        }
-                    ]
-                }
 
-                response = make_request('POST', '/PractitionerRole', data=test_role)
-                if response.status_code == 201:
-                    created_role = response.json()
-                    created_resources.append(('PractitionerRole', created_role['id']))
-                    results.add_pass("Create practitioner role")
-
-                    # Test 17: Read practitioner role
-                    role_id = created_role['id']
-                    response = make_request('GET', f'/PractitionerRole/{role_id}')
-                    if response.status_code == 200:
-                        results.add_pass("Read practitioner role by ID")
-                    else:
-                        results.add_fail("Read practitioner role", f"Status {response.status_code}")
-                else:
-                    results.add_fail("Create practitioner role", f"Status {response.status_code}")
-        else:
-            results.add_skip("Organization-based tests", "No organizations found")
+# Test 15: Search by organization (using the shared test organization)
+@PRACTITIONER.check("Search practitioner roles by organization", shared=True)
+def search_roles_by_organization(ctx: CheckContext, results: TestResults):
+    if ctx.shared.organization:
+        org_id = ctx.shared.organization['id']
+        response = make_request('GET', '/PractitionerRole', params={
+            'organization': f'Organization/{org_id}'
+        })
+        assert_status_code(response, 200, 'Search practitioner roles by organization', results)
+    else:
+        results.add_skip("Organization-based tests", "Shared test organization not created")
+
+
+# Test 16: Create practitioner role for the shared practitioner and organization
+@PRACTITIONER.check("Create practitioner role", shared=True)
+def create_practitioner_role(ctx: CheckContext, results: TestResults):
+    if not (ctx.shared.practitioner and ctx.shared.organization):
+        results.add_skip("Create practitioner role", "Shared test practitioner or organization not created")
+        return
+    pract_id = ctx.shared.practitioner['id']
+    org_id = ctx.shared.organization['id']
+
+    test_role = {
+        "resourceType": "PractitionerRole",
+        "meta": {
+            "profile": ["https://dhp.uz/fhir/core/StructureDefinition/uz-core-practitionerrole"]
+        },
+        "language": "uz",
+        "active": True,
+        "practitioner": {
+            "reference": f"Practitioner/{pract_id}",
+            "display": "Test Practitioner"
+        },
+        "organization": {
+            "reference": f"Organization/{org_id}",
+            "display": "Test Organization"
+        },
+        "code": [
+            {
+                "coding": [
+                    {
+                        "system": "https://terminology.dhp.uz/fhir/core/CodeSystem/position-and-profession-cs",
+                        "code": "2211.1",
+                        "display": "General practitioner"
+                    }
+                ]
+            }
+        ]
+    }
+
+    response = make_request('POST', '/PractitionerRole', data=test_role)
+    if response.status_code == 201:
+        created_role = response.json()
+        ctx['role_id'] = created_role['id']
+        results.add_pass("Create practitioner role")
+    else:
+        results.add_fail("Create practitioner role", f"Status {response.status_code}")
+
+
+# Test 17: Read practitioner role
+@PRACTITIONER.check("Read practitioner role by ID", depends=["Create practitioner role"])
+def read_practitioner_role(ctx: CheckContext, results: TestResults):
+    if 'role_id' not in ctx:
+        return
+    role_id = ctx['role_id']
+    response = make_request('GET', f'/PractitionerRole/{role_id}')
+    if response.status_code == 200:
+        results.add_pass("Read practitioner role by ID")
     else:
-        results.add_skip("Organization-based tests", f"Cannot search organizations: {response.status_code}")
+        results.add_fail("Read practitioner role", f"Status {response.status_code}")
+
 
-    # Test 18: Search with _include
+# Test 18: Search with _include
+@PRACTITIONER.check("Search with _include parameter")
+def search_with_include(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/PractitionerRole', params={
         '_include': 'PractitionerRole:practitioner',
         '_count': '5'
     })
     assert_status_code(response, 200, 'Search with _include parameter', results)
 
-    # Negative Tests
-    print(f"\n{Colors.BOLD}Negative Tests{Colors.RESET}")
 
-    # Test 19: Read non-existent practitioner (accept both 400 and 404)
+# Test 19: Read non-existent practitioner (accept both 400 and 404)
+@PRACTITIONER.check("Read non-existent practitioner", section="Negative Tests")
+def read_nonexistent(ctx: CheckContext, results: TestResults):
     # 400 = Invalid ID format, 404 = Valid format but doesn't exist
     response = make_request('GET', '/Practitioner/nonexistent-practitioner-12345')
     if response.status_code in [400, 404]:
@@ -372,7 +357,10 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_fail('Read non-existent practitioner', f"Expected 400 or 404, got {response.status_code}")
 
-    # Test 20: Search non-existent practitioner
+
+# Test 20: Search non-existent practitioner
+@PRACTITIONER.check("Search non-existent practitioner")
+def search_nonexistent(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/Practitioner', params={
         'name': 'NONEXISTENT_PRACTITIONER_XYZ_12345'
     })
@@ -382,18 +370,61 @@ def run_practitioner_tests() -> TestResults:
     else:
         results.add_fail("Search non-existent practitioner", f"Status {response.status_code}")
 
-    # Cleanup
-    if CLEANUP_AFTER_TESTS:
-        print(f"\n{Colors.BOLD}Cleanup{Colors.RESET}")
-        # Delete in reverse order (roles before practitioners)
-        for resource_type, resource_id in reversed(created_resources):
-            response = make_request('DELETE', f'/{resource_type}/{resource_id}')
-            if response.status_code == 200:
-                results.add_pass(f"Delete {resource_type}/{resource_id}")
-            else:
-                results.add_fail(f"Delete {resource_type}/{resource_id}", f"Status {response.status_code}")
 
-    return results
+# Test 21: Resolve the references of a page of roles in bulk
+@PRACTITIONER.check("Resolve PractitionerRole references in bulk", depends=["Create practitioner role"])
+def resolve_role_references(ctx: CheckContext, results: TestResults):
+    resolver = ReferenceResolver()
+    roles = resolver.search('PractitionerRole', {'_count': '50'})
+    role_id = ctx.get('role_id')
+    if role_id and not any(role.get('id') == role_id for role in roles):
+        # The page may not reach the role created for the shared fixtures
+        response = make_request('GET', f'/PractitionerRole/{role_id}')
+        if response.status_code == 200:
+            roles.append(response.json())
+    if not roles:
+        results.add_skip("Resolve PractitionerRole references", "No practitioner roles found")
+        return
+    paths = {'practitioner', 'organization'}
+    wanted = resolver.unresolved(roles, paths)
+    jobs = sum(len(list(id_chunks(resource_type, ids))) for resource_type, ids in wanted.items())
+
+    # Only this check's requests: other checks may run at the same time with -j
+    check = current_check.get()
+    sent = []
+
+    def count(method, endpoint, response):
+        if current_check.get() is check:
+            sent.append(endpoint)
+    add_request_listener(count)
+    try:
+        resolver.resolve(roles, paths)
+    finally:
+        remove_request_listener(count)
+    print(f"  {Colors.CYAN}→ {len(roles)} role(s), {sum(len(ids) for ids in wanted.values())} reference(s) "
+          f"resolved with {len(sent)} request(s), {len(resolver.missing)} not found{Colors.RESET}")
+    if len(sent) > jobs:
+        results.add_fail("Resolve PractitionerRole references in bulk",
+                         f"{len(sent)} requests for {jobs} _id search(es)")
+        return
+    results.add_pass("Resolve PractitionerRole references in bulk")
+
+    if role_id and ctx.shared.practitioner and ctx.shared.organization:
+        expected = [('Practitioner', ctx.shared.practitioner['id']), ('Organization', ctx.shared.organization['id'])]
+        unresolved = [f"{t}/{i}" for t, i in expected if (t, i) not in resolver.resources]
+        if unresolved:
+            results.add_fail("Resolve shared fixture role references", f"Not found: {', '.join(unresolved)}")
+        else:
+            results.add_pass("Resolve shared fixture role references")
+
+
+def run_practitioner_tests(shared: Optional[SharedFixtures] = None, patterns: Optional[List[str]] = None,
+                           workers: int = 1) -> TestResults:
+    """
+    Run all practitioner and practitioner role tests, or only the checks matching patterns.
+    The shared fixtures are created here when none are passed.
+    """
+    return PRACTITIONER.run(shared, patterns, workers)
 
 
 if __name__ == '__main__':
@@ -2,24 +2,26 @@
 Tests for FHIR Terminology resources and operations
 Based on examples from terminology-basics.md
 """
-import time
+import os
+from typing import List, Optional
 from test_utils import (
     TestResults, make_request, search_resources,
     extract_entries, Colors
 )
-from config import TEST_IDENTIFIER_PREFIX
+from checks import Scenario, CheckContext
+from concept_maps import ConceptMapIndex, translate_batch
+from expansion import PagedExpansion, ExpansionError
+from terminology_mirror import TerminologyMirror
+from config import TEST_IDENTIFIER_PREFIX, TERMINOLOGY_DB
+from fixtures import SharedFixtures
 
 
-def run_terminology_tests() -> TestResults:
-    """Run all terminology tests"""
-    results = TestResults()
+TERMINOLOGY = Scenario('terminology', 'Terminology Tests')
 
-    print(f"\n{Colors.BOLD}=== Terminology Tests ==={Colors.RESET}\n")
 
-    # ========== CodeSystem Tests ==========
-    print(f"\n{Colors.BOLD}CodeSystem Tests{Colors.RESET}")
-
-    # Test 1: Search for all CodeSystems (summary)
+# Test 1: Search for all CodeSystems (summary)
+@TERMINOLOGY.check("Search all CodeSystems with summary", section="CodeSystem Tests")
+def search_all_codesystems(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={'_summary': 'true', '_count': '5'})
     if response.status_code == 200:
         bundle = response.json()
@@ -32,7 +34,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Search all CodeSystems", f"Status {response.status_code}")
 
-    # Test 2: Search CodeSystem by URL
+
+# Test 2: Search CodeSystem by URL
+@TERMINOLOGY.check("Search CodeSystem by URL")
+def search_codesystem_by_url(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={
         'url': 'http://terminology.hl7.org/CodeSystem/v2-0203'
     })
@@ -47,7 +52,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Search CodeSystem by URL", f"Status {response.status_code}")
 
-    # Test 3: Search CodeSystem by status
+
+# Test 3: Search CodeSystem by status
+@TERMINOLOGY.check("Search CodeSystem by status")
+def search_codesystem_by_status(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={'status': 'active', '_count': '3'})
     if response.status_code == 200:
         bundle = response.json()
@@ -60,7 +68,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Search CodeSystem by status", f"Status {response.status_code}")
 
-    # Test 4: Search CodeSystem by content type
+
+# Test 4: Search CodeSystem by content type
+@TERMINOLOGY.check("Search CodeSystem by content")
+def search_codesystem_by_content(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={'content': 'complete', '_count': '3'})
     if response.status_code == 200:
         bundle = response.json()
@@ -73,7 +84,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Search CodeSystem by content", f"Status {response.status_code}")
 
-    # Test 5: Read specific CodeSystem by canonical URL
+
+# Test 5: Read specific CodeSystem by canonical URL
+@TERMINOLOGY.check("Read CodeSystem by canonical URL")
+def read_codesystem_by_url(ctx: CheckContext, results: TestResults):
     # First get one from search to have a valid URL
     response = make_request('GET', '/CodeSystem', params={'_count': '1'})
     if response.status_code == 200:
@@ -102,10 +116,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Read CodeSystem by URL", f"Search failed: {response.status_code}")
 
-    # ========== ValueSet Tests ==========
-    print(f"\n{Colors.BOLD}ValueSet Tests{Colors.RESET}")
 
-    # Test 6: Search for all ValueSets (summary)
+# Test 6: Search for all ValueSets (summary)
+@TERMINOLOGY.check("Search all ValueSets with summary", section="ValueSet Tests")
+def search_all_valuesets(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={'_summary': 'true', '_count': '5'})
     if response.status_code == 200:
         bundle = response.json()
@@ -118,7 +132,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Search all ValueSets", f"Status {response.status_code}")
 
-    # Test 7: Search ValueSet by URL
+
+# Test 7: Search ValueSet by URL
+@TERMINOLOGY.check("Search ValueSet by URL")
+def search_valueset_by_url(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={
         'url': 'http://hl7.org/fhir/ValueSet/administrative-gender'
     })
@@ -133,7 +150,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Search ValueSet by URL", f"Status {response.status_code}")
 
-    # Test 8: Search ValueSet by status
+
+# Test 8: Search ValueSet by status
+@TERMINOLOGY.check("Search ValueSet by status")
+def search_valueset_by_status(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={'status': 'active', '_count': '3'})
     if response.status_code == 200:
         bundle = response.json()
@@ -146,7 +166,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Search ValueSet by status", f"Status {response.status_code}")
 
-    # Test 9: Read specific ValueSet by canonical URL
+
+# Test 9: Read specific ValueSet by canonical URL
+@TERMINOLOGY.check("Read ValueSet by canonical URL")
+def read_valueset_by_url(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={'_count': '1'})
     if response.status_code == 200:
         bundle = response.json()
@@ -174,10 +197,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("Read ValueSet by URL", f"Search failed: {response.status_code}")
 
-    # ========== $expand Operation Tests ==========
-    print(f"\n{Colors.BOLD}$expand Operation Tests{Colors.RESET}")
 
-    # Test 10: Expand ValueSet by ID
+# Test 10: Expand ValueSet by ID
+@TERMINOLOGY.check("$expand ValueSet by ID", section="$expand Operation Tests")
+def expand_valueset_by_id(ctx: CheckContext, results: TestResults):
     # Get a ValueSet that we can expand
     response = make_request('GET', '/ValueSet', params={'_count': '1'})
     if response.status_code == 200:
@@ -206,7 +229,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("$expand ValueSet", f"Search failed: {response.status_code}")
 
-    # Test 11: Expand ValueSet by URL
+
+# Test 11: Expand ValueSet by URL
+@TERMINOLOGY.check("$expand ValueSet by URL")
+def expand_valueset_by_url(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet/$expand', params={
         'url': 'http://hl7.org/fhir/ValueSet/administrative-gender'
     })
@@ -223,7 +249,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("$expand ValueSet by URL", f"Status {response.status_code}")
 
-    # Test 12: Expand ValueSet with count parameter
+
+# Test 12: Expand ValueSet with count parameter
+@TERMINOLOGY.check("$expand ValueSet with count parameter")
+def expand_valueset_with_count(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={'_count': '1'})
     if response.status_code == 200:
         bundle = response.json()
@@ -254,7 +283,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_fail("$expand with count", f"Search failed: {response.status_code}")
 
-    # Test 13: Expand ValueSet with filter parameter
+
+# Test 13: Expand ValueSet with filter parameter
+@TERMINOLOGY.check("$expand ValueSet with filter parameter")
+def expand_valueset_with_filter(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet/$expand', params={
         'url': 'http://hl7.org/fhir/ValueSet/administrative-gender',
         'filter': 'male'
@@ -273,10 +305,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("$expand with filter", f"Status {response.status_code}")
 
-    # ========== $validate-code Operation Tests ==========
-    print(f"\n{Colors.BOLD}$validate-code Operation Tests{Colors.RESET}")
 
-    # Test 14: Validate a valid code
+# Test 14: Validate a valid code
+@TERMINOLOGY.check("$validate-code with valid code", section="$validate-code Operation Tests")
+def validate_valid_code(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet/$validate-code', params={
         'url': 'http://hl7.org/fhir/ValueSet/administrative-gender',
         'code': 'male',
@@ -294,7 +326,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("$validate-code valid", f"Status {response.status_code}")
 
-    # Test 15: Validate an invalid code
+
+# Test 15: Validate an invalid code
+@TERMINOLOGY.check("$validate-code with invalid code")
+def validate_invalid_code(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet/$validate-code', params={
         'url': 'http://hl7.org/fhir/ValueSet/administrative-gender',
         'code': 'INVALID_CODE',
@@ -312,7 +347,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("$validate-code invalid", f"Status {response.status_code}")
 
-    # Test 16: Validate code with wrong system
+
+# Test 16: Validate code with wrong system
+@TERMINOLOGY.check("$validate-code with wrong system")
+def validate_wrong_system(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet/$validate-code', params={
         'url': 'http://hl7.org/fhir/ValueSet/administrative-gender',
         'code': 'male',
@@ -330,10 +368,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("$validate-code wrong system", f"Status {response.status_code}")
 
-    # ========== $lookup Operation Tests ==========
-    print(f"\n{Colors.BOLD}$lookup Operation Tests{Colors.RESET}")
 
-    # Test 17: Lookup a code in CodeSystem
+# Test 17: Lookup a code in CodeSystem
+@TERMINOLOGY.check("$lookup code in CodeSystem", section="$lookup Operation Tests")
+def lookup_code(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem/$lookup', params={
         'system': 'http://hl7.org/fhir/administrative-gender',
         'code': 'male'
@@ -351,7 +389,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("$lookup code", f"Status {response.status_code}")
 
-    # Test 18: Lookup a non-existent code
+
+# Test 18: Lookup a non-existent code
+@TERMINOLOGY.check("$lookup non-existent code")
+def lookup_nonexistent_code(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem/$lookup', params={
         'system': 'http://hl7.org/fhir/administrative-gender',
         'code': 'INVALID_CODE'
@@ -370,10 +411,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("$lookup non-existent", f"Status {response.status_code}")
 
-    # ========== ConceptMap Tests ==========
-    print(f"\n{Colors.BOLD}ConceptMap Tests{Colors.RESET}")
 
-    # Test 19: Search for ConceptMaps
+# Test 19: Search for ConceptMaps
+@TERMINOLOGY.check("Search for ConceptMaps", section="ConceptMap Tests")
+def search_conceptmaps(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ConceptMap', params={'_summary': 'true', '_count': '5'})
     if response.status_code == 200:
         bundle = response.json()
@@ -386,7 +427,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ConceptMaps", f"Status {response.status_code}")
 
-    # Test 20: Search ConceptMap by status
+
+# Test 20: Search ConceptMap by status
+@TERMINOLOGY.check("Search ConceptMap by status")
+def search_conceptmap_by_status(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ConceptMap', params={'status': 'active', '_count': '3'})
     if response.status_code == 200:
         bundle = response.json()
@@ -399,7 +443,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ConceptMap by status", f"Status {response.status_code}")
 
-    # Test 21: Read ConceptMap by ID (if any exist)
+
+# Test 21: Read ConceptMap by ID (if any exist)
+@TERMINOLOGY.check("Read ConceptMap by ID")
+def read_conceptmap_by_id(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ConceptMap', params={'_count': '1'})
     if response.status_code == 200:
         bundle = response.json()
@@ -421,10 +468,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Read ConceptMap by ID", f"Search failed: {response.status_code}")
 
-    # ========== Version Management Tests ==========
-    print(f"\n{Colors.BOLD}Version Management Tests{Colors.RESET}")
 
-    # Test 22: Search CodeSystem with version sorting
+# Test 22: Search CodeSystem with version sorting
+@TERMINOLOGY.check("Search CodeSystem with version sorting", section="Version Management Tests")
+def search_codesystem_version_sort(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={
         'url': 'http://terminology.hl7.org/CodeSystem/v2-0203',
         '_sort': '-version',
@@ -442,7 +489,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search with version sort", f"Status {response.status_code}")
 
-    # Test 23: Search for specific version of CodeSystem
+
+# Test 23: Search for specific version of CodeSystem
+@TERMINOLOGY.check("Search CodeSystem by specific version")
+def search_codesystem_by_version(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={
         'url': 'http://terminology.hl7.org/CodeSystem/v2-0203',
         'version': '3.0.0'
@@ -459,10 +509,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search by version", f"Status {response.status_code}")
 
-    # ========== Error Handling Tests ==========
-    print(f"\n{Colors.BOLD}Error Handling Tests{Colors.RESET}")
 
-    # Test 24: Try to expand non-existent ValueSet
+# Test 24: Try to expand non-existent ValueSet
+@TERMINOLOGY.check("Error: Expand non-existent ValueSet", section="Error Handling Tests")
+def expand_nonexistent_valueset(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet/$expand', params={
         'url': 'http://example.com/ValueSet/nonexistent'
     })
@@ -479,7 +529,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Error: Expand non-existent", f"Status {response.status_code}")
 
-    # Test 25: Try to validate with missing required parameters
+
+# Test 25: Try to validate with missing required parameters
+@TERMINOLOGY.check("Error: Validate with missing parameters")
+def validate_missing_parameters(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet/$validate-code', params={
         'url': 'http://hl7.org/fhir/ValueSet/administrative-gender'
         # Missing 'code' and 'system'
@@ -497,7 +550,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Error: Missing params", f"Status {response.status_code}")
 
-    # Test 26: Try to lookup with invalid system
+
+# Test 26: Try to lookup with invalid system
+@TERMINOLOGY.check("Error: Lookup with invalid system")
+def lookup_invalid_system(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem/$lookup', params={
         'system': 'http://invalid-system.example.com',
         'code': 'test'
@@ -515,10 +571,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Error: Invalid system", f"Status {response.status_code}")
 
-    # ========== Additional Search Parameter Tests ==========
-    print(f"\n{Colors.BOLD}Additional Search Parameter Tests{Colors.RESET}")
 
-    # Test 27: Search CodeSystem by title
+# Test 27: Search CodeSystem by title
+@TERMINOLOGY.check("Search CodeSystem by title", section="Additional Search Parameter Tests")
+def search_codesystem_by_title(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={
         'title': 'Identifier',
         '_count': '3'
@@ -534,7 +590,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search by title", f"Status {response.status_code}")
 
-    # Test 28: Search CodeSystem by publisher
+
+# Test 28: Search CodeSystem by publisher
+@TERMINOLOGY.check("Search CodeSystem by publisher")
+def search_codesystem_by_publisher(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={
         'publisher': 'HL7',
         '_count': '3'
@@ -550,7 +609,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search by publisher", f"Status {response.status_code}")
 
-    # Test 29: Search ValueSet by name
+
+# Test 29: Search ValueSet by name
+@TERMINOLOGY.check("Search ValueSet by name")
+def search_valueset_by_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={
         'name': 'administrative',
         '_count': '3'
@@ -566,7 +628,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ValueSet by name", f"Status {response.status_code}")
 
-    # Test 30: Search ValueSet by title
+
+# Test 30: Search ValueSet by title
+@TERMINOLOGY.check("Search ValueSet by title")
+def search_valueset_by_title(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={
         'title': 'gender',
         '_count': '3'
@@ -582,7 +647,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ValueSet by title", f"Status {response.status_code}")
 
-    # Test 31: Search ValueSet by publisher
+
+# Test 31: Search ValueSet by publisher
+@TERMINOLOGY.check("Search ValueSet by publisher")
+def search_valueset_by_publisher(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={
         'publisher': 'HL7',
         '_count': '3'
@@ -598,7 +666,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ValueSet by publisher", f"Status {response.status_code}")
 
-    # Test 32: Search ConceptMap by name
+
+# Test 32: Search ConceptMap by name
+@TERMINOLOGY.check("Search ConceptMap by name")
+def search_conceptmap_by_name(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ConceptMap', params={
         'name': 'map',
         '_count': '3'
@@ -614,7 +685,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ConceptMap by name", f"Status {response.status_code}")
 
-    # Test 33: Search ConceptMap by source-scope-uri
+
+# Test 33: Search ConceptMap by source-scope-uri
+@TERMINOLOGY.check("Search ConceptMap by source-scope-uri")
+def search_conceptmap_by_source_scope(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ConceptMap', params={
         'source-scope-uri': 'urn:iso:std:iso:3166',
         '_count': '3'
@@ -630,7 +704,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ConceptMap by source-scope-uri", f"Status {response.status_code}")
 
-    # Test 34: Search ConceptMap by target-scope-uri
+
+# Test 34: Search ConceptMap by target-scope-uri
+@TERMINOLOGY.check("Search ConceptMap by target-scope-uri")
+def search_conceptmap_by_target_scope(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ConceptMap', params={
         'target-scope-uri': 'urn:iso:std:iso:3166',
         '_count': '3'
@@ -646,7 +723,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Search ConceptMap by target-scope-uri", f"Status {response.status_code}")
 
-    # Test 35: Combined search parameters
+
+# Test 35: Combined search parameters
+@TERMINOLOGY.check("Combined search parameters")
+def combined_search_parameters(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/ValueSet', params={
         'status': 'active',
         '_count': '3'
@@ -662,7 +742,10 @@ def run_terminology_tests() -> TestResults:
     else:
         results.add_skip("Combined search", f"Status {response.status_code}")
 
-    # Test 36: Pagination test
+
+# Test 36: Pagination test
+@TERMINOLOGY.check("Pagination: next link present")
+def pagination_next_link(ctx: CheckContext, results: TestResults):
     response = make_request('GET', '/CodeSystem', params={'_count': '2'})
     if response.status_code == 200:
         bundle = response.json()
@@ -677,7 +760,91 @@ def run_terminology_tests() -> TestResults:
         results.add_skip("Pagination test", f"Status {response.status_code}")
 
 
-    return results
+# Test 37: Paged parallel $expand returns the same codes as one request
+@TERMINOLOGY.check("$expand in parallel pages", section="$expand Operation Tests")
+def expand_in_parallel_pages(ctx: CheckContext, results: TestResults):
+    url = 'https://terminology.dhp.uz/fhir/core/ValueSet/position-and-profession-vs'
+    expansion = PagedExpansion(url=url, page_size=10, workers=4)
+    try:
+        codes = [(c.get('system'), c.get('code')) for c in expansion]
+    except ExpansionError as e:
+        results.add_skip("$expand in parallel pages", str(e))
+        return
+    print(f"  {Colors.CYAN}→ {len(codes)} codes in {expansion.pages} page(s), total {expansion.total}{Colors.RESET}")
+    if expansion.total is not None and len(codes) != expansion.total:
+        results.add_fail("$expand in parallel pages", f"Got {len(codes)} codes, expansion.total is {expansion.total}")
+        return
+    if len(set(codes)) != len(codes):
+        results.add_fail("$expand in parallel pages", "Pages overlap (duplicate codes)")
+        return
+    response = make_request('GET', '/ValueSet/$expand', params={'url': url, 'count': str(max(len(codes), 1))})
+    if response.status_code != 200:
+        results.add_skip("$expand in parallel pages", f"Single-request expansion: status {response.status_code}")
+        return
+    single = [(c.get('system'), c.get('code')) for c in response.json().get('expansion', {}).get('contains', [])]
+    if not single:
+        results.add_fail("$expand in parallel pages", "Single-request expansion returned no codes")
+    elif len(single) != len(codes):
+        results.add_fail("$expand in parallel pages",
+                         f"Single-request expansion has {len(single)} codes, the pages together {len(codes)}")
+    elif single == codes:
+        results.add_pass("$expand in parallel pages (same order as one request)")
+    else:
+        results.add_fail("$expand in parallel pages", "Reassembled order differs from a single expansion")
+
+
+# Test 38: Local ConceptMap index agrees with the server's $translate
+@TERMINOLOGY.check("Translate codes with local ConceptMap index")
+def translate_with_local_index(ctx: CheckContext, results: TestResults):
+    map_url = 'https://terminology.dhp.uz/fhir/core/ConceptMap/iso-3166-alpha3-to-alpha2-cs'
+    index = ConceptMapIndex()
+    if index.load(url=map_url) == 0 or not index.covers('urn:iso:std:iso:3166', map_url=map_url):
+        results.add_skip("Translate with local ConceptMap index", "ISO 3166 ConceptMap not found")
+        return
+    codes = sorted(code for system, code in index.index if system == 'urn:iso:std:iso:3166')[:5]
+    local = index.translate_column('urn:iso:std:iso:3166', codes, map_url=map_url)
+    remote = translate_batch('urn:iso:std:iso:3166', codes, map_url=map_url)
+    mismatched = [code for code, mine, theirs in zip(codes, local, remote)
+                  if {t.code for t in mine if t.code} != {t.code for t in theirs if t.code}]
+    print(f"  {Colors.CYAN}→ Indexed {len(index.index)} source codes, compared {len(codes)} with $translate{Colors.RESET}")
+    if mismatched:
+        results.add_fail("Translate with local ConceptMap index", f"Differs from $translate for {', '.join(mismatched)}")
+    else:
+        results.add_pass("Translate with local ConceptMap index")
+
+
+# Test 39: Local terminology mirror agrees with the server's $lookup
+@TERMINOLOGY.check("Lookup code in local terminology mirror")
+def lookup_in_local_mirror(ctx: CheckContext, results: TestResults):
+    if not os.path.exists(TERMINOLOGY_DB):
+        results.add_skip("Lookup in local terminology mirror", f"No mirror at {TERMINOLOGY_DB} (run terminology_mirror.py sync)")
+        return
+    system = 'http://hl7.org/fhir/administrative-gender'
+    mirror = TerminologyMirror(TERMINOLOGY_DB)
+    try:
+        mirror.sync()
+        local = mirror.lookup(system, 'male')
+    finally:
+        mirror.close()
+    if local is None:
+        results.add_skip("Lookup in local terminology mirror", f"{system} is not in the mirror")
+        return
+    response = make_request('GET', '/CodeSystem/$lookup', params={'system': system, 'code': 'male'})
+    if response.status_code != 200:
+        results.add_skip("Lookup in local terminology mirror", f"$lookup status {response.status_code}")
+        return
+    display = next((p.get('valueString') for p in response.json().get('parameter', []) if p.get('name') == 'display'), None)
+    print(f"  {Colors.CYAN}→ Mirror: {local['display']} (version {local['version']}), $lookup: {display}{Colors.RESET}")
+    if local['display'] == display:
+        results.add_pass("Lookup in local terminology mirror")
+    else:
+        results.add_fail("Lookup in local terminology mirror", f"Mirror display {local['display']!r}, $lookup {display!r}")
+
+
+def run_terminology_tests(shared: Optional[SharedFixtures] = None, patterns: Optional[List[str]] = None,
+                          workers: int = 1) -> TestResults:
+    """Run all terminology tests, or only the checks matching patterns (no check uses the shared fixtures)"""
+    return TERMINOLOGY.run(shared, patterns, workers)
 
 
 if __name__ == '__main__':
@@ -4,8 +4,37 @@ Utility functions for FHIR API tests
 import requests
 import json
 import sys
-from typing import Dict, Any, Optional, List
-from config import BASE_URL, REQUEST_TIMEOUT, VERBOSE, INTERACTIVE
+import hashlib
+import gzip
+import threading
+import time
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+from urllib.parse import urlsplit
+from config import (
+    BASE_URL, REQUEST_TIMEOUT, VERBOSE, INTERACTIVE,
+    BANDWIDTH_SAVING, COMPRESS_MIN_BYTES
+)
+from tracing import tracer, SPAN_KIND_CLIENT
+
+# orjson is optional - it decodes large Bundles and expansions several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# urllib3 only decodes brotli responses when a brotli module is installed
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'br, gzip, deflate'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = 'br, gzip, deflate'
+    except ImportError:
+        ACCEPT_ENCODING = 'gzip, deflate'
 
 
 class Colors:
@@ -32,6 +61,70 @@ def wait_for_user(prompt: str = "Press Enter to continue to next test..."):
         print()  # Add blank line after continuing
 
 
+class PhaseTimer:
+    """
+    Wall time spent in network wait, JSON decoding and output formatting, per scope
+    (a scenario key or 'scenario/check name'). Only records while enabled (--profile).
+    Nested phases are exclusive: a decode inside formatting counts as decode only.
+    """
+    PHASES = ('network', 'json_decode', 'formatting')
+
+    def __init__(self):
+        self.enabled = False
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self.wall: Dict[str, float] = {}
+        self._scope = contextvars.ContextVar('phase_scope', default='')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _add(self, phase: str, elapsed: float):
+        scope = self._scope.get()
+        with self._lock:
+            totals = self.totals.setdefault(scope, {})
+            totals[phase] = totals.get(phase, 0.0) + elapsed
+
+    @contextmanager
+    def phase(self, name: str):
+        """Attribute the wall time of the block to a phase"""
+        if not self.enabled:
+            yield
+            return
+        stack = self._local.__dict__.setdefault('stack', [])
+        now = time.perf_counter()
+        if stack:
+            # Pause the enclosing phase
+            self._add(stack[-1][0], now - stack[-1][1])
+        entry = [name, now]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stack.pop()
+            self._add(name, now - entry[1])
+            if stack:
+                stack[-1][1] = now
+
+    @contextmanager
+    def scope(self, name: str):
+        """Attribute phases recorded in the block (and threads started from its context) to a scope"""
+        if not self.enabled:
+            yield
+            return
+        token = self._scope.set(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._scope.reset(token)
+            with self._lock:
+                self.wall[name] = self.wall.get(name, 0.0) + elapsed
+
+
+phase_timer = PhaseTimer()
+
+
 class TestResults:
     """Track test results"""
     def __init__(self):
@@ -39,21 +132,32 @@ class TestResults:
         self.failed = 0
         self.skipped = 0
         self.failures = []
+        # Checks may report from several worker threads at once
+        self._lock = threading.Lock()
 
     def add_pass(self, test_name: str):
-        self.passed += 1
-        print(f"{Colors.GREEN}✓{Colors.RESET} {test_name}")
+        with self._lock:
+            self.passed += 1
+            tracer.event(test_name, outcome='pass')
+            with phase_timer.phase('formatting'):
+                print(f"{Colors.GREEN}✓{Colors.RESET} {test_name}")
         wait_for_user()
 
     def add_fail(self, test_name: str, reason: str):
-        self.failed += 1
-        self.failures.append((test_name, reason))
-        print(f"{Colors.RED}✗{Colors.RESET} {test_name}: {reason}")
+        with self._lock:
+            self.failed += 1
+            self.failures.append((test_name, reason))
+            tracer.event(test_name, outcome='fail', reason=reason)
+            with phase_timer.phase('formatting'):
+                print(f"{Colors.RED}✗{Colors.RESET} {test_name}: {reason}")
         wait_for_user()
 
     def add_skip(self, test_name: str, reason: str):
-        self.skipped += 1
-        print(f"{Colors.YELLOW}⊘{Colors.RESET} {test_name}: {reason}")
+        with self._lock:
+            self.skipped += 1
+            tracer.event(test_name, outcome='skip', reason=reason)
+            with phase_timer.phase('formatting'):
+                print(f"{Colors.YELLOW}⊘{Colors.RESET} {test_name}: {reason}")
         wait_for_user()
 
     def print_summary(self):
@@ -72,6 +176,318 @@ class TestResults:
         return self.failed == 0
 
 
+def decode_json(data: bytes) -> Any:
+    """Decode a JSON body, using orjson when it is installed"""
+    with phase_timer.phase('json_decode'):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+def encode_json(obj: Any) -> bytes:
+    """Encode an object as a UTF-8 JSON body, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+# Response headers kept by FHIRResponse.cache_headers
+CACHE_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Expires', 'Age', 'Vary', 'X-Cache')
+
+
+def parse_server_timing(value: str) -> Dict[str, float]:
+    """Parse a Server-Timing header ('db;dur=3.2;desc="Query", app;dur=7.5') into {name: ms}"""
+    metrics = {}
+    for metric in value.split(','):
+        parts = [part.strip() for part in metric.split(';')]
+        if not parts[0]:
+            continue
+        for param in parts[1:]:
+            key, _, raw = param.partition('=')
+            if key.strip().lower() == 'dur':
+                try:
+                    metrics[parts[0]] = metrics.get(parts[0], 0.0) + float(raw.strip('"'))
+                except ValueError:
+                    pass
+    return metrics
+
+
+def parse_duration_ms(value: Optional[str]) -> Optional[float]:
+    """Parse an X-Response-Time style value ('12.3ms', '0.012s', '12') into ms"""
+    if not value:
+        return None
+    value = value.strip().lower()
+    try:
+        if value.endswith('ms'):
+            return float(value[:-2])
+        if value.endswith('s'):
+            return float(value[:-1]) * 1000
+        return float(value)
+    except ValueError:
+        return None
+
+
+class FHIRResponse:
+    """
+    Wrapper around requests.Response that decodes the JSON body only once.
+    The raw body bytes stay available through `content` and `digest` so they
+    can be hashed or cached without re-encoding the parsed JSON.
+    """
+    def __init__(self, response: requests.Response, request_bytes: int = 0, request_wire_bytes: int = 0,
+                 latency_ms: float = 0.0):
+        self.response = response
+        self.request_bytes = request_bytes
+        self.request_wire_bytes = request_wire_bytes
+        # Client-measured time from sending the request to having the full body
+        self.latency_ms = latency_ms
+        self._json = None
+        self._decoded = False
+        self._digest = None
+
+    @property
+    def status_code(self) -> int:
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    def url(self) -> str:
+        """Full request URL, query string included"""
+        return self.response.url
+
+    @property
+    def content(self) -> bytes:
+        return self.response.content
+
+    @property
+    def text(self) -> str:
+        return self.response.text
+
+    @property
+    def wire_bytes(self) -> int:
+        """Number of response body bytes received over the wire (before decompression)"""
+        try:
+            wire = self.response.raw.tell()
+        except (AttributeError, ValueError):
+            wire = 0
+        if not wire:
+            wire = int(self.headers.get('Content-Length') or len(self.content))
+        return wire
+
+    @property
+    def compression_ratio(self) -> float:
+        """Decoded body size divided by bytes on the wire (1.0 when uncompressed)"""
+        wire = self.wire_bytes
+        return len(self.content) / wire if wire else 1.0
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 hex digest of the raw response body"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.content).hexdigest()
+        return self._digest
+
+    @property
+    def request_id(self) -> Optional[str]:
+        """Server-assigned request id (X-Request-Id or X-Correlation-Id), for matching server logs"""
+        return self.headers.get('X-Request-Id') or self.headers.get('X-Correlation-Id')
+
+    @property
+    def server_timing(self) -> Dict[str, float]:
+        """Server-Timing metrics as {name: duration in ms}"""
+        return parse_server_timing(self.headers.get('Server-Timing', ''))
+
+    @property
+    def server_time_ms(self) -> Optional[float]:
+        """
+        Server processing time in ms: the Server-Timing 'total' metric, else X-Response-Time,
+        else the sum of all Server-Timing durations. None if the server reports none of these.
+        """
+        timing = self.server_timing
+        if 'total' in timing:
+            return timing['total']
+        response_time = parse_duration_ms(self.headers.get('X-Response-Time'))
+        if response_time is not None:
+            return response_time
+        return sum(timing.values()) if timing else None
+
+    @property
+    def cache_headers(self) -> Dict[str, str]:
+        """Validators and caching headers present on the response (ETag, Last-Modified, Cache-Control, ...)"""
+        return {name: self.headers[name] for name in CACHE_HEADERS if name in self.headers}
+
+    def json(self) -> Any:
+        """Return the decoded JSON body, decoding it on first access only"""
+        if not self._decoded:
+            self._json = decode_json(self.content)
+            self._decoded = True
+        return self._json
+
+    def __getattr__(self, name):
+        # Everything else (url, reason, elapsed, ...) comes from the wrapped response
+        return getattr(self.response, name)
+
+
+class TransferStats:
+    """Accumulate request/response byte counts for the compression report"""
+    def __init__(self):
+        self.requests = 0
+        self.request_bytes = 0
+        self.request_wire_bytes = 0
+        self.response_bytes = 0
+        self.response_wire_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, response: FHIRResponse):
+        with self._lock:
+            self.requests += 1
+            self.request_bytes += response.request_bytes
+            self.request_wire_bytes += response.request_wire_bytes
+            self.response_bytes += len(response.content)
+            self.response_wire_bytes += response.wire_bytes
+
+    def print_summary(self):
+        def ratio(raw, wire):
+            return raw / wire if wire else 1.0
+
+        print(f"\n{Colors.BOLD}Transfer Summary{Colors.RESET}")
+        print(f"{'='*60}")
+        print(f"Requests:  {self.requests}")
+        print(f"Sent:      {format_bytes(self.request_wire_bytes)} "
+              f"({format_bytes(self.request_bytes)} uncompressed, "
+              f"ratio {ratio(self.request_bytes, self.request_wire_bytes):.1f}x)")
+        print(f"Received:  {format_bytes(self.response_wire_bytes)} "
+              f"({format_bytes(self.response_bytes)} decoded, "
+              f"ratio {ratio(self.response_bytes, self.response_wire_bytes):.1f}x)")
+
+
+# Byte counts for every request made during this run
+transfer_stats = TransferStats()
+
+
+def endpoint_label(method: str, endpoint: str, params: Optional[Dict] = None) -> str:
+    """
+    Group requests by endpoint: ids become {id}, search parameters are reduced to their names
+    (e.g. 'GET /Patient/{id}', 'GET /Patient?family:contains&given', 'GET /ValueSet/{id}/$expand')
+    """
+    path, _, query = endpoint.partition('?')
+    parts = [part for part in path.split('/') if part]
+    labelled = [part if i == 0 or part.startswith('$') or part.startswith('_') else '{id}'
+                for i, part in enumerate(parts)]
+    names = set(params or {})
+    names.update(pair.partition('=')[0] for pair in query.split('&') if pair)
+    label = f"{method} /{'/'.join(labelled)}"
+    return f"{label}?{'&'.join(sorted(names))}" if names else label
+
+
+class ServerTimingStats:
+    """Client latency next to server-reported processing time, per endpoint"""
+    def __init__(self):
+        self.endpoints: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, endpoint: str, params: Optional[Dict], response: FHIRResponse):
+        label = endpoint_label(method, endpoint, params)
+        server_ms = response.server_time_ms
+        with self._lock:
+            stats = self.endpoints.setdefault(label, {
+                'calls': 0, 'client_ms': 0.0, 'server_calls': 0, 'server_ms': 0.0,
+                'network_ms': 0.0, 'slowest_ms': 0.0, 'slowest_request_id': None
+            })
+            stats['calls'] += 1
+            stats['client_ms'] += response.latency_ms
+            if server_ms is not None:
+                stats['server_calls'] += 1
+                stats['server_ms'] += server_ms
+                stats['network_ms'] += max(response.latency_ms - server_ms, 0.0)
+            if response.latency_ms >= stats['slowest_ms']:
+                stats['slowest_ms'] = response.latency_ms
+                stats['slowest_request_id'] = response.request_id
+
+    def print_summary(self):
+        print(f"\n{Colors.BOLD}Server Timing (ms, averages per call){Colors.RESET}")
+        print(f"{'='*60}")
+        if not any(stats['server_calls'] for stats in self.endpoints.values()):
+            print("No Server-Timing or X-Response-Time headers received; only client latency is known.")
+        print(f"  {'Endpoint':<48} {'Calls':>5} {'Client':>8} {'Server':>8} {'Network':>8} {'Slowest':>8}  Request-Id")
+        by_time = sorted(self.endpoints.items(), key=lambda item: item[1]['client_ms'], reverse=True)
+        for label, stats in by_time:
+            client = stats['client_ms'] / stats['calls']
+            if stats['server_calls']:
+                server = f"{stats['server_ms'] / stats['server_calls']:>8.1f}"
+                network = f"{stats['network_ms'] / stats['server_calls']:>8.1f}"
+            else:
+                server = network = f"{'-':>8}"
+            print(f"  {label[:48]:<48} {stats['calls']:>5} {client:>8.1f} {server} {network} "
+                  f"{stats['slowest_ms']:>8.1f}  {stats['slowest_request_id'] or '-'}")
+
+
+# Client and server time per endpoint for every request made during this run
+server_timing_stats = ServerTimingStats()
+
+# Set once the server answers a gzip-encoded body with 415, so we stop compressing
+_gzip_bodies_rejected = False
+
+# Callbacks invoked as listener(method, endpoint, response) after every request
+request_listeners = []
+
+
+def add_request_listener(listener):
+    """Register a callback to be notified after every request made through make_request"""
+    if listener not in request_listeners:
+        request_listeners.append(listener)
+
+
+def remove_request_listener(listener):
+    """Unregister a callback added with add_request_listener"""
+    if listener in request_listeners:
+        request_listeners.remove(listener)
+
+
+# Shared limit on requests in flight (concurrency.AdaptiveLimiter), None for no limit
+request_limiter = None
+
+
+def set_request_limiter(limiter):
+    """Make every request wait for a slot from limiter (None removes it); returns the previous limiter"""
+    global request_limiter
+    previous, request_limiter = request_limiter, limiter
+    return previous
+
+
+# Policy deciding how a request is sent (resilience.ResilientReads), None to send it once
+request_policy = None
+
+
+def set_request_policy(policy):
+    """Send every request through policy.call(method, endpoint, params, attempt); returns the previous policy"""
+    global request_policy
+    previous, request_policy = request_policy, policy
+    return previous
+
+
+# Single-flight gate for GETs (coalescing.Coalescer), None to send every GET
+request_coalescer = None
+
+
+def set_request_coalescer(coalescer):
+    """Let concurrent identical GETs share one request through coalescer; returns the previous one"""
+    global request_coalescer
+    previous, request_coalescer = request_coalescer, coalescer
+    return previous
+
+
+def format_bytes(size: int) -> str:
+    """Format a byte count for humans (e.g. 1.5 KB)"""
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
 def highlight_json_field(obj: Any, highlight_paths: List[str] = None, current_path: str = "") -> str:
     """
     Convert object to JSON string with highlighted paths.
@@ -137,49 +553,146 @@ def highlight_json_field(obj: Any, highlight_paths: List[str] = None, current_pa
 
 def make_request(method: str, endpoint: str, data: Optional[Dict] = None,
                  headers: Optional[Dict] = None, params: Optional[Dict] = None,
-                 highlight_fields: List[str] = None) -> requests.Response:
+                 highlight_fields: List[str] = None, elements: List[str] = None,
+                 summary: Optional[str] = None) -> FHIRResponse:
     """
     Make HTTP request to FHIR server
 
     Args:
         highlight_fields: List of JSON paths to highlight in response (e.g., ['name', 'identifier[0].value'])
+        elements: Top-level elements the caller needs; sent as _elements so the server can trim the payload
+        summary: Value for the _summary parameter (e.g., 'true', 'count', 'data')
     """
+    coalescer = request_coalescer
+    if coalescer and method == 'GET' and data is None:
+        return coalescer.call(method, endpoint, params, headers, elements, summary, lambda: _make_request(
+            method, endpoint, data, headers, params, highlight_fields, elements, summary))
+    return _make_request(method, endpoint, data, headers, params, highlight_fields, elements, summary)
+
+
+def _make_request(method: str, endpoint: str, data: Optional[Dict], headers: Optional[Dict],
+                  params: Optional[Dict], highlight_fields: Optional[List[str]], elements: Optional[List[str]],
+                  summary: Optional[str]) -> FHIRResponse:
+    """make_request without coalescing: sends the request (through the policy and limiter, if any)"""
+    global _gzip_bodies_rejected
+
     url = f"{BASE_URL}/{endpoint.lstrip('/')}"
 
-    default_headers = {'Content-Type': 'application/fhir+json'}
+    default_headers = {
+        'Content-Type': 'application/fhir+json',
+        'Accept-Encoding': ACCEPT_ENCODING
+    }
     if headers:
         default_headers.update(headers)
 
+    if elements or summary:
+        params = dict(params or {})
+        if elements:
+            params['_elements'] = ','.join(elements)
+        if summary:
+            params['_summary'] = summary
+
+    body = encode_json(data) if data is not None else None
+    wire_body = body
+    if (BANDWIDTH_SAVING and body is not None and len(body) >= COMPRESS_MIN_BYTES
+            and not _gzip_bodies_rejected):
+        wire_body = gzip.compress(body)
+        default_headers['Content-Encoding'] = 'gzip'
+
     if VERBOSE:
-        print(f"\n{Colors.BLUE}→{Colors.RESET} {method} {url}")
-        if params:
-            print(f"  {Colors.BOLD}Params:{Colors.RESET} {params}")
-        if data:
-            print(f"  {Colors.BOLD}Request Data:{Colors.RESET}")
-            print("  " + json.dumps(data, indent=2).replace("\n", "\n  "))
+        with phase_timer.phase('formatting'):
+            print(f"\n{Colors.BLUE}→{Colors.RESET} {method} {url}")
+            if params:
+                print(f"  {Colors.BOLD}Params:{Colors.RESET} {params}")
+            if data:
+                print(f"  {Colors.BOLD}Request Data:{Colors.RESET}")
+                print("  " + json.dumps(data, indent=2).replace("\n", "\n  "))
+
+    def attempt(payload, request_headers):
+        limiter = request_limiter
+        if limiter:
+            limiter.acquire()
+        response = None
+        try:
+            with phase_timer.phase('network'):
+                start = time.perf_counter()
+                raw_response = requests.request(
+                    method=method,
+                    url=url,
+                    data=payload,
+                    headers=request_headers,
+                    params=params,
+                    timeout=REQUEST_TIMEOUT
+                )
+                latency_ms = (time.perf_counter() - start) * 1000
+                response = FHIRResponse(raw_response, len(body or b''), len(payload or b''), latency_ms)
+                return response
+        finally:
+            if limiter:
+                limiter.release(response)
+
+    def send(payload, request_headers):
+        policy = request_policy
+        if policy:
+            return policy.call(method, endpoint, params, lambda: attempt(payload, request_headers))
+        return attempt(payload, request_headers)
 
     try:
-        response = requests.request(
-            method=method,
-            url=url,
-            json=data,
-            headers=default_headers,
-            params=params,
-            timeout=REQUEST_TIMEOUT
-        )
+        with tracer.span(f"{method} {endpoint.split('?')[0]}", SPAN_KIND_CLIENT,
+                         **{'http.request.method': method, 'url.full': url}) as span:
+            if span:
+                default_headers['traceparent'] = span.traceparent
+            response = send(wire_body, default_headers)
+
+            if response.status_code == 415 and default_headers.get('Content-Encoding') == 'gzip':
+                # Server does not accept compressed bodies - resend as-is and stop compressing
+                _gzip_bodies_rejected = True
+                del default_headers['Content-Encoding']
+                response = send(body, default_headers)
+
+            if span:
+                span.attributes.update({
+                    'url.full': response.url,
+                    'http.response.status_code': response.status_code,
+                    'http.request.body.size': len(body or b''),
+                    'http.response.body.size': len(response.content),
+                    'http.response.wire_size': response.wire_bytes,
+                    'http.response.header.x-request-id': response.request_id,
+                    'server.duration_ms': response.server_time_ms
+                })
+                span.error = response.status_code >= 400
+
+        transfer_stats.record(response)
+        server_timing_stats.record(method, endpoint, params, response)
+        for listener in list(request_listeners):
+            listener(method, endpoint, response)
 
         if VERBOSE:
-            print(f"{Colors.BLUE}←{Colors.RESET} {Colors.BOLD}Status:{Colors.RESET} {response.status_code}")
-            if response.content:
-                try:
-                    resp_json = response.json()
-                    print(f"  {Colors.BOLD}Response:{Colors.RESET}")
-                    if highlight_fields:
-                        print("  " + highlight_json_field(resp_json, highlight_fields).replace("\n", "\n  "))
-                    else:
-                        print("  " + json.dumps(resp_json, indent=2).replace("\n", "\n  "))
-                except:
-                    print(f"  {Colors.BOLD}Response:{Colors.RESET} {response.text}")
+            with phase_timer.phase('formatting'):
+                print(f"{Colors.BLUE}←{Colors.RESET} {Colors.BOLD}Status:{Colors.RESET} {response.status_code}")
+                timing = f"{response.latency_ms:.1f} ms"
+                if response.server_time_ms is not None:
+                    timing += f" (server {response.server_time_ms:.1f} ms)"
+                if response.request_id:
+                    timing += f", request id {response.request_id}"
+                print(f"  {Colors.BOLD}Timing:{Colors.RESET} {timing}")
+                if response.cache_headers:
+                    cache = ', '.join(f"{name}: {value}" for name, value in response.cache_headers.items())
+                    print(f"  {Colors.BOLD}Cache:{Colors.RESET} {cache}")
+                if BANDWIDTH_SAVING:
+                    encoding = response.headers.get('Content-Encoding', 'identity')
+                    print(f"  {Colors.BOLD}Transfer:{Colors.RESET} {format_bytes(response.wire_bytes)} {encoding} "
+                          f"({format_bytes(len(response.content))} decoded, ratio {response.compression_ratio:.1f}x)")
+                if response.content:
+                    try:
+                        resp_json = response.json()
+                        print(f"  {Colors.BOLD}Response:{Colors.RESET}")
+                        if highlight_fields:
+                            print("  " + highlight_json_field(resp_json, highlight_fields).replace("\n", "\n  "))
+                        else:
+                            print("  " + json.dumps(resp_json, indent=2).replace("\n", "\n  "))
+                    except ValueError:
+                        print(f"  {Colors.BOLD}Response:{Colors.RESET} {response.text}")
 
         return response
     except requests.exceptions.RequestException as e:
@@ -195,9 +708,9 @@ def create_resource(resource_type: str, data: Dict) -> Optional[Dict]:
     return None
 
 
-def read_resource(resource_type: str, resource_id: str) -> Optional[Dict]:
+def read_resource(resource_type: str, resource_id: str, elements: List[str] = None) -> Optional[Dict]:
     """Read a FHIR resource by ID"""
-    response = make_request('GET', f'/{resource_type}/{resource_id}')
+    response = make_request('GET', f'/{resource_type}/{resource_id}', elements=elements)
     if response.status_code == 200:
         return response.json()
     return None
@@ -221,14 +734,104 @@ def delete_resource(resource_type: str, resource_id: str) -> bool:
     return response.status_code == 200
 
 
-def search_resources(resource_type: str, params: Dict) -> Optional[Dict]:
+def search_resources(resource_type: str, params: Dict, elements: List[str] = None) -> Optional[Dict]:
     """Search for FHIR resources"""
-    response = make_request('GET', f'/{resource_type}', params=params)
+    response = make_request('GET', f'/{resource_type}', params=params, elements=elements)
     if response.status_code == 200:
         return response.json()
     return None
 
 
+def next_page_endpoint(bundle: Optional[Dict]) -> Optional[str]:
+    """Endpoint of a search Bundle's 'next' link relative to BASE_URL, or None on the last page"""
+    links = (bundle or {}).get('link', [])
+    url = next((link.get('url') for link in links if link.get('relation') == 'next'), None)
+    if not url:
+        return None
+    if url.startswith(BASE_URL):
+        return url[len(BASE_URL):]
+    # Servers behind a proxy may link to their internal host; keep the path below the base path
+    base_path = urlsplit(BASE_URL).path
+    parts = urlsplit(url)
+    path = parts.path[len(base_path):] if base_path and parts.path.startswith(base_path) else parts.path
+    return f"{path}?{parts.query}" if parts.query else path
+
+
+def search_all(resource_type: str, params: Dict, elements: List[str] = None,
+               required: bool = False) -> Iterator[Dict]:
+    """
+    Search and follow the 'next' links, yielding the resource_type resources of every page.
+    A failed first page yields nothing, or raises HTTPError when required; a failed later page always raises.
+    """
+    bundle = search_resources(resource_type, params, elements=elements)
+    if bundle is None and required:
+        raise requests.exceptions.HTTPError(f"Search {resource_type} failed")
+    seen = set()
+    while bundle:
+        yield from extract_entries(bundle, resource_type)
+        endpoint = next_page_endpoint(bundle)
+        # A link back to a page already read would loop forever
+        if endpoint is None or endpoint in seen:
+            break
+        seen.add(endpoint)
+        bundle = fetch_page(endpoint)
+
+
+def fetch_page(endpoint: str) -> Dict:
+    """
+    The Bundle behind a 'next' link. A page that cannot be read raises HTTPError: stopping quietly
+    would hand the caller a truncated result that looks complete.
+    """
+    response = make_request('GET', endpoint)
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(f"Page {endpoint} returned status {response.status_code}",
+                                            response=response.response)
+    return response.json()
+
+
+def parse_instant(value: Optional[str]) -> Optional[datetime]:
+    """A FHIR instant as an aware datetime (None if missing or malformed), comparable across offsets"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+    except ValueError:
+        return None
+
+
+def changes_since(resource_type: str, since: str, count: int = 100) -> Iterator[Tuple[str, Optional[Dict]]]:
+    """
+    (id, resource) of every resource_type resource changed since an instant, newest version only;
+    resource is None for a deletion. Reads _history?_since=, or a _lastUpdated=ge search (which
+    cannot see deletions) on servers without type-level history.
+    """
+    response = make_request('GET', f'/{resource_type}/_history', params={'_since': since, '_count': str(count)})
+    if response.status_code != 200:
+        # ge rather than gt so a change in the checkpoint's own second is not missed
+        for resource in search_all(resource_type, {'_lastUpdated': f'ge{since}', '_count': str(count)}):
+            yield resource.get('id'), resource
+        return
+
+    # History lists the newest version first; older versions of the same id are skipped
+    applied = set()
+    pages = set()
+    bundle = response.json()
+    while bundle:
+        for entry in bundle.get('entry', []):
+            resource = entry.get('resource')
+            request = entry.get('request', {})
+            # Deletions carry no resource, only request.url '<type>/<id>[/_history/<vid>]'
+            url_parts = request.get('url', '').split('/')
+            resource_id = resource.get('id') if resource else (url_parts[1] if len(url_parts) > 1 else None)
+            if not resource_id or resource_id in applied:
+                continue
+            applied.add(resource_id)
+            yield resource_id, None if request.get('method') == 'DELETE' or resource is None else resource
+        endpoint = next_page_endpoint(bundle)
+        if endpoint is None or endpoint in pages:
+            break
+        pages.add(endpoint)
+        bundle = fetch_page(endpoint)
+
+
 def extract_entries(bundle: Dict, resource_type: str) -> List[Dict]:
     """Extract resources of specific type from a search bundle"""
     if not bundle or bundle.get('resourceType') != 'Bundle':
@@ -242,7 +845,7 @@ def extract_entries(bundle: Dict, resource_type: str) -> List[Dict]:
     ]
 
 
-def assert_status_code(response: requests.Response, expected: int, test_name: str, results: TestResults):
+def assert_status_code(response: FHIRResponse, expected: int, test_name: str, results: TestResults):
     """Assert that response has expected status code"""
     if response.status_code == expected:
         results.add_pass(test_name)
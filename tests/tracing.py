@@ -0,0 +1,154 @@
+"""
+Trace export for FHIR API test runs (--trace / --trace-otlp)
+One trace per run: a span per scenario, a child span per check and a grandchild span per
+HTTP request. Requests carry a W3C traceparent header so server-side traces line up.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+SERVICE_NAME = 'dhp-fhir-api-tests'
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+
+class Span:
+    """A timed operation with attributes and point-in-time events (e.g. test results)"""
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes
+        self.events: List[tuple] = []
+        self.error = False
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.time_ns()
+        self.end_ns = self.start_ns
+
+    @property
+    def traceparent(self) -> str:
+        """W3C trace context header value for requests made inside this span"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+class Tracer:
+    """Collects spans while enabled; the current span follows contextvars, so -j worker threads nest correctly"""
+    def __init__(self):
+        self.enabled = False
+        self.trace_id = None
+        self.spans: List[Span] = []
+        self._current = contextvars.ContextVar('current_span', default=None)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Enable tracing with a fresh trace id"""
+        self.enabled = True
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        """Record the block as a child of the current span; yields None when tracing is off"""
+        if not self.enabled:
+            yield None
+            return
+        parent = self._current.get()
+        span = Span(name, self.trace_id, parent.span_id if parent else None, kind, attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException:
+            span.error = True
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            self._current.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def event(self, name: str, **attributes):
+        """Attach an event to the current span, if any"""
+        span = self._current.get() if self.enabled else None
+        if span is not None:
+            span.events.append((time.time_ns(), name, attributes))
+
+    def write_chrome(self, path: str):
+        """Write the spans as Chrome trace-event JSON (chrome://tracing, Perfetto, speedscope)"""
+        threads = {}
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': SERVICE_NAME}}]
+        for span in sorted(self.spans, key=lambda s: s.start_ns):
+            tid = threads.setdefault(span.thread_id, len(threads) + 1)
+            args = dict(span.attributes, span_id=span.span_id, parent_id=span.parent_id)
+            events.append({
+                'name': span.name, 'cat': 'client' if span.kind == SPAN_KIND_CLIENT else 'test',
+                'ph': 'X', 'ts': span.start_ns / 1000, 'dur': (span.end_ns - span.start_ns) / 1000,
+                'pid': 1, 'tid': tid, 'args': args
+            })
+            for ts, name, attributes in span.events:
+                events.append({'name': name, 'cat': 'result', 'ph': 'i', 's': 't',
+                               'ts': ts / 1000, 'pid': 1, 'tid': tid, 'args': attributes})
+        _write_json(path, {'traceEvents': events, 'displayTimeUnit': 'ms',
+                           'otherData': {'trace_id': self.trace_id}})
+
+    def write_otlp(self, path: str):
+        """Write the spans as one OTLP/JSON export request (the OpenTelemetry file exporter format)"""
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                'traceId': span.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': span.kind,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': _otlp_attributes(span.attributes),
+                'events': [{'timeUnixNano': str(ts), 'name': name, 'attributes': _otlp_attributes(attributes)}
+                           for ts, name, attributes in span.events],
+                'status': {'code': 2 if span.error else 1}
+            }
+            if span.parent_id:
+                otlp_span['parentSpanId'] = span.parent_id
+            spans.append(otlp_span)
+        _write_json(path, {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': SERVICE_NAME})},
+            'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}]
+        }]})
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict]:
+    """Convert a dict to OTLP key/value attributes"""
+    result = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {'boolValue': value}
+        elif isinstance(value, int):
+            typed = {'intValue': str(value)}
+        elif isinstance(value, float):
+            typed = {'doubleValue': value}
+        else:
+            typed = {'stringValue': str(value)}
+        result.append({'key': key, 'value': typed})
+    return result
+
+
+def _write_json(path: str, obj: Any):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f)
+        f.write('\n')
+
+
+tracer = Tracer()